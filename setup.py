@@ -18,6 +18,10 @@ setup(
     author_email='mansourjohn@gmail.com',
     url='https://github.com/jmansour/tawnycalc',
     license=license,
-    packages=find_packages(exclude=('tests', 'docs'))
+    packages=find_packages(exclude=('tests', 'docs')),
+    install_requires=['numpy'],
+    entry_points={
+        'console_scripts': ['tawnycalc=tawnycalc.cli:main'],
+    },
 )
 
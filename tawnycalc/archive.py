@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+Append-only archive of raw `thermocalc` outputs.
+
+Rather than retaining a temporary directory per execution, the files
+generated by each execution (`tc-log.txt`, the `-ic` file, any other new
+or modified files, and the standard output and error streams) may be
+appended as a single compressed segment to an archive file:
+
+>>> archive = Archive("gtfrac.tcar")
+>>> results = context.execute(archive=archive)
+>>> archive.read(results.config_hash, "tc-log.txt")
+
+Segments are keyed by the configuration hash of the execution (refer to
+`Context.config_hash()`). An offset index is maintained alongside the
+archive (with suffix `.idx`) for random access, and may be regenerated
+from the archive itself with `rebuild_index()`. Archives may be appended
+to concurrently from multiple threads and processes.
+"""
+import os
+import json
+import time
+import zlib
+import struct
+import threading
+from collections import OrderedDict
+
+_MAGIC = b"TCAR"
+_VERSION = 1
+_PREFIX = struct.Struct("<4sBIQ")     # magic, version, header length, payload length
+
+
+class Archive(object):
+    """
+    Segmented, append-only archive of execution outputs.
+
+    Params
+    ------
+    path: str
+        Archive file. Created where it does not exist.
+    level: int
+        zlib compression level.
+    fsync: bool
+        If `True`, appended data is flushed to disk before `append` returns.
+    """
+    def __init__(self, path, level=6, fsync=False):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.level = int(level)
+        self.fsync = bool(fsync)
+        self._lock = threading.RLock()
+        self._entries = []
+        self._by_hash = {}
+        self._index_position = 0
+
+    def _locked(self, fp):
+        try:
+            import fcntl
+        except ImportError:
+            return None
+        fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+        return fcntl
+
+    def append(self, config_hash, files, meta=None):
+        """
+        Appends a segment.
+
+        Params
+        ------
+        config_hash: str
+            Configuration hash of the execution.
+        files: dict
+            File contents (`bytes` or `str`) keyed by file name.
+        meta: dict
+            Further JSON serialisable information recorded with the segment.
+
+        Returns
+        -------
+        entry: dict
+            The index entry of the appended segment.
+        """
+        names, blobs = [], []
+        for name, data in files.items():
+            names.append(name)
+            blobs.append(data.encode("utf-8") if isinstance(data, str) else bytes(data))
+        header = OrderedDict([("hash", config_hash), ("time", time.time()),
+                              ("files", [ [name, len(blob)] for name, blob in zip(names, blobs) ]),
+                              ("meta", meta or {})])
+        header = json.dumps(header, separators=(",",":")).encode("utf-8")
+        payload = zlib.compress(b"".join(blobs), self.level)
+        record = _PREFIX.pack(_MAGIC, _VERSION, len(header), len(payload)) + header + payload
+        with self._lock, open(self.path, 'ab') as fp:
+            fcntl = self._locked(fp)
+            try:
+                fp.seek(0, os.SEEK_END)
+                offset = fp.tell()
+                fp.write(record)
+                fp.flush()
+                if self.fsync:
+                    os.fsync(fp.fileno())
+                entry = OrderedDict([("hash", config_hash), ("offset", offset), ("length", len(record)),
+                                     ("files", names)])
+                with open(self.index_path, 'a') as index:
+                    index.write(json.dumps(entry, separators=(",",":")) + "\n")
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+        return entry
+
+    def _refresh(self):
+        """
+        Reads index entries appended since the last call.
+        """
+        if not os.path.isfile(self.index_path):
+            return
+        with open(self.index_path, 'r') as fp:
+            fp.seek(self._index_position)
+            while True:
+                line = fp.readline()
+                if not line.endswith("\n"):
+                    break
+                self._index_position = fp.tell()
+                entry = json.loads(line, object_pairs_hook=OrderedDict)
+                self._entries.append(entry)
+                self._by_hash.setdefault(entry["hash"], []).append(entry)
+
+    def entries(self, config_hash=None):
+        """
+        Returns index entries, optionally only those of `config_hash`, in the
+        order appended. Each entry records the `hash`, `offset` and `length`
+        of the segment, and its `files`.
+        """
+        with self._lock:
+            self._refresh()
+            if config_hash is None:
+                return list(self._entries)
+            return list(self._by_hash.get(config_hash, []))
+
+    def hashes(self):
+        """
+        Returns the configuration hashes within the archive.
+        """
+        with self._lock:
+            self._refresh()
+            return list(self._by_hash.keys())
+
+    def __contains__(self, config_hash):
+        return bool(self.entries(config_hash))
+
+    def __len__(self):
+        return len(self.entries())
+
+    def _read_segment(self, offset):
+        with open(self.path, 'rb') as fp:
+            fp.seek(offset)
+            prefix = fp.read(_PREFIX.size)
+            if len(prefix) < _PREFIX.size:
+                raise RuntimeError("Archive '{}' is truncated at offset {}.".format(self.path, offset))
+            magic, version, header_length, payload_length = _PREFIX.unpack(prefix)
+            if magic != _MAGIC or version != _VERSION:
+                raise RuntimeError("No archive segment found at offset {} of '{}'.".format(offset, self.path))
+            header = json.loads(fp.read(header_length).decode("utf-8"), object_pairs_hook=OrderedDict)
+            payload = fp.read(payload_length)
+        return header, payload
+
+    def read(self, config_hash, name=None, which=-1):
+        """
+        Reads archived files.
+
+        Params
+        ------
+        config_hash: str
+            Configuration hash of the execution.
+        name: str
+            File to return. If not provided, all files of the segment are
+            returned.
+        which: int
+            Where the configuration was executed more than once, the segment
+            to read, in the order appended. Defaults to the latest.
+
+        Returns
+        -------
+        data: bytes, OrderedDict
+            Contents of file `name`, or an ordered dictionary of the contents
+            of all files keyed by name.
+        """
+        entries = self.entries(config_hash)
+        if not entries:
+            raise KeyError(config_hash)
+        entry = entries[which]
+        if name is not None and name not in entry["files"]:
+            raise KeyError(name)
+        header, payload = self._read_segment(entry["offset"])
+        data = zlib.decompress(payload)
+        files = OrderedDict()
+        start = 0
+        for file_name, length in header["files"]:
+            files[file_name] = data[start:start+length]
+            start += length
+        return files[name] if name is not None else files
+
+    def meta(self, config_hash, which=-1):
+        """
+        Returns the time of archival and any further information recorded
+        with a segment.
+        """
+        entries = self.entries(config_hash)
+        if not entries:
+            raise KeyError(config_hash)
+        header = self._read_segment(entries[which]["offset"])[0]
+        return OrderedDict([("time", header["time"])] + list(header["meta"].items()))
+
+    def rebuild_index(self):
+        """
+        Regenerates the index by scanning the archive, for example after an
+        interrupted append. Truncated or corrupt segments are skipped, with
+        scanning resuming from the next segment marker, so that segments
+        appended after an interrupted append are retained.
+
+        Returns
+        -------
+        count: int
+            Number of segments indexed.
+        """
+        import mmap
+        entries = []
+        with self._lock:
+            size = os.path.getsize(self.path) if os.path.isfile(self.path) else 0
+            if size:
+                with open(self.path, 'rb') as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    offset = 0
+                    while 0 <= offset < size:
+                        segment = _segment(data, offset)
+                        if segment is None:
+                            # resynchronise on the next segment marker
+                            offset = data.find(_MAGIC, offset + 1)
+                            continue
+                        header, length = segment
+                        entries.append(OrderedDict([("hash", header["hash"]), ("offset", offset), ("length", length),
+                                                    ("files", [ name for name, file_length in header["files"] ])]))
+                        offset += length
+            temp = "{}.{}.tmp".format(self.index_path, os.getpid())
+            with open(temp, 'w') as index:
+                for entry in entries:
+                    index.write(json.dumps(entry, separators=(",",":")) + "\n")
+            os.replace(temp, self.index_path)
+            self._entries, self._by_hash, self._index_position = [], {}, 0
+        return len(entries)
+
+
+def _segment(data, offset):
+    """
+    Validates the segment at `offset` of the archive contents `data`,
+    returning its header and length, or `None` where the segment is
+    truncated or corrupt.
+    """
+    if offset + _PREFIX.size > len(data):
+        return None
+    magic, version, header_length, payload_length = _PREFIX.unpack_from(data, offset)
+    length = _PREFIX.size + header_length + payload_length
+    if magic != _MAGIC or version != _VERSION or offset + length > len(data):
+        return None
+    start = offset + _PREFIX.size
+    try:
+        header = json.loads(data[start:start+header_length].decode("utf-8"), object_pairs_hook=OrderedDict)
+        # a truncated segment may be followed by others, so its payload must also be intact
+        content = zlib.decompress(data[start+header_length:offset+length])
+        if len(content) != sum( file_length for name, file_length in header["files"] ) or "hash" not in header:
+            return None
+    except (ValueError, TypeError, KeyError, zlib.error):
+        return None
+    return header, length
+
+
+def snapshot(directory):
+    """
+    Returns the size and modification time of each file in `directory`.
+    """
+    state = {}
+    for entry in os.scandir(directory):
+        if entry.is_file():
+            stat = entry.stat()
+            state[entry.name] = (stat.st_size, stat.st_mtime_ns)
+    return state
+
+
+def changed_files(directory, before):
+    """
+    Returns the sorted names of files in `directory` which are new or
+    modified relative to the `snapshot` `before`.
+    """
+    after = snapshot(directory)
+    return sorted( name for name, state in after.items() if before.get(name) != state )
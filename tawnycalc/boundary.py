@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Phase boundary tracing.
+
+Rather than sweeping dense grids to locate where an assemblage changes,
+a boundary may be traced directly. Given two P-T points with differing
+assemblages, the boundary between them is first located by bisection,
+and then followed by continuation: a step is taken along the boundary,
+and the boundary is re-located by bisection across it. Each execution is
+warm started using the guesses from the nearest previous result.
+
+>>> import tawnycalc.boundary as boundary
+>>> line = boundary.trace(context, (11.,580.), (11.,640.))
+>>> plt.plot(line.points[:,1], line.points[:,0])
+
+"""
+from collections import namedtuple
+import numpy as np
+
+from .runner import assemblage
+
+Boundary = namedtuple("Boundary", ["points", "assemblages", "executions"])
+Boundary.__doc__ = """
+A traced phase boundary. `points` is an array of `(P,T)` pairs of shape
+`(n_points,2)`, ordered along the boundary. `assemblages` records the
+assemblages either side of the boundary, and `executions` the number of
+`thermocalc` executions performed.
+"""
+
+
+class _tracer(object):
+    """
+    Performs executions at P-T points, warm starting from the nearest
+    previous result.
+    """
+    def __init__(self, context, scale, execute_kwargs):
+        self.context = context.copy()
+        self.scale = np.asarray(scale, dtype=float)
+        self.execute_kwargs = execute_kwargs
+        self.executions = 0
+        self._points = []
+        self._results = []
+
+    def __call__(self, point):
+        """
+        Returns the assemblage at `point`, or `None` where execution fails.
+        """
+        point = np.asarray(point, dtype=float)
+        if self._results:
+            distances = np.linalg.norm((np.asarray(self._points) - point)/self.scale, axis=1)
+            self.context.set_guesses(self._results[int(np.argmin(distances))])
+        self.context.set_pt(*point)
+        self.executions += 1
+        try:
+            results = self.context.execute(**self.execute_kwargs)
+        except Exception:
+            return None
+        if "modes" not in results:
+            return None
+        self._points.append(point)
+        self._results.append(results)
+        return assemblage(results)
+
+    def bisect(self, a, b, assemblage_a, assemblage_b, tol):
+        """
+        Bisects between points `a` and `b` until the bracket is smaller than
+        `tol` (in scaled units). Returns the final bracket, or `None` where a
+        third assemblage (or failure) is encountered.
+        """
+        while np.linalg.norm((b - a)/self.scale) > tol:
+            mid = 0.5*(a + b)
+            found = self(mid)
+            if   found == assemblage_a:
+                a = mid
+            elif found == assemblage_b:
+                b = mid
+            else:
+                return None
+        return a, b
+
+
+def trace(context, point_a, point_b, tol=0.01, step=0.5, scale=(1., 50.), bounds=None,
+          max_points=100, max_widen=3, **execute_kwargs):
+    """
+    Traces the phase boundary between two P-T points.
+
+    Distances are measured in scaled units, where pressure and temperature
+    are divided by the corresponding `scale` values. With the default scale,
+    1 kbar is considered equivalent to 50 °C.
+
+    Tracing proceeds in both directions from the initially located
+    boundary point, and terminates where the boundary leaves `bounds`,
+    where a third assemblage (or an execution failure) is encountered, or
+    after `max_points` points in each direction.
+
+    Params
+    ------
+    context: tawnycalc.Context
+        The model configuration. The context itself is not modified.
+    point_a, point_b: tuple
+        `(P,T)` points, which must have differing assemblages.
+    tol: float
+        Bisection tolerance, in scaled units.
+    step: float
+        Continuation step length along the boundary, in scaled units.
+    scale: tuple
+        Pressure and temperature scaling.
+    bounds: tuple
+        Optional `((Pmin,Pmax),(Tmin,Tmax))` box to which tracing is confined.
+    max_points: int
+        Maximum number of continuation steps in each direction.
+    max_widen: int
+        Number of times the bracket across the boundary is enlarged
+        when the boundary is not found after a step.
+    execute_kwargs:
+        Further arguments are passed through to `Context.execute()`.
+
+    Returns
+    -------
+    boundary: Boundary
+        The traced boundary.
+    """
+    tracer = _tracer(context, scale, execute_kwargs)
+    try:
+        a = np.asarray(point_a, dtype=float)
+        b = np.asarray(point_b, dtype=float)
+        assemblage_a = tracer(a)
+        assemblage_b = tracer(b)
+        if assemblage_a is None or assemblage_b is None:
+            raise RuntimeError("Execution failed at one of the provided end points.")
+        if assemblage_a == assemblage_b:
+            raise RuntimeError("Both points have the same assemblage '{}'.".format(assemblage_a))
+        bracket = tracer.bisect(a, b, assemblage_a, assemblage_b, tol)
+        if bracket is None:
+            raise RuntimeError("A third assemblage was encountered between the provided points.")
+
+        scale = tracer.scale
+        if bounds is not None:
+            bounds = np.asarray(bounds, dtype=float)
+
+        def inside(point):
+            return bounds is None or np.all((point >= bounds[:,0]) & (point <= bounds[:,1]))
+
+        def follow(bracket, direction):
+            a, b = bracket
+            line = [0.5*(a + b),]
+            for i in range(max_points):
+                # normal across the boundary, oriented from `a` to `b`, in scaled space
+                across = (b - a)/scale
+                if len(line) > 1:
+                    # secant predictor along the previously traced points
+                    tangent = (line[-1] - line[-2])/scale
+                    tangent /= np.linalg.norm(tangent)
+                    normal = np.array([tangent[1], -tangent[0]])
+                    if np.dot(normal, across) < 0.:
+                        normal = -normal
+                    half = 2.*tol
+                else:
+                    normal = across/np.linalg.norm(across)
+                    tangent = direction*np.array([-normal[1], normal[0]])
+                    half = 0.25*step
+                centre = line[-1] + step*tangent*scale
+                if not inside(centre):
+                    break
+                for j in range(max_widen+1):
+                    a_new = centre - half*normal*scale
+                    b_new = centre + half*normal*scale
+                    found_a, found_b = tracer(a_new), tracer(b_new)
+                    if found_a == assemblage_a and found_b == assemblage_b:
+                        break
+                    if found_a not in (assemblage_a, assemblage_b) or found_b not in (assemblage_a, assemblage_b):
+                        return line[1:]
+                    half *= 4.
+                else:
+                    return line[1:]
+                bracket = tracer.bisect(a_new, b_new, assemblage_a, assemblage_b, tol)
+                if bracket is None:
+                    break
+                a, b = bracket
+                line.append(0.5*(a + b))
+            return line[1:]
+
+        start = 0.5*(bracket[0] + bracket[1])
+        backward = follow(bracket, -1.)
+        forward = follow(bracket, 1.)
+        points = np.array(backward[::-1] + [start,] + forward)
+        return Boundary(points, (assemblage_a, assemblage_b), tracer.executions)
+    finally:
+        tracer.context.cleanup()
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk composition utilities.
+
+All routines operate on NumPy arrays where the last axis runs over
+oxides, so that a single composition has shape `(n_oxides,)` and a
+batch of compositions has shape `(n_compositions, n_oxides)`. Batches
+are processed in a single vectorised call, which makes these functions
+suitable for ensemble studies involving many thousands of compositions.
+
+Compositions generated here may be provided to `thermocalc` via the
+`setbulk` script entry:
+
+>>> import tawnycalc.bulk as bulk
+>>> comp = bulk.from_rbi(results.rbi, remove={"g":0.8})
+>>> context.script["setbulk"] = bulk.setbulk(comp)
+>>> del context.script["rbi"]
+
+"""
+from collections import OrderedDict
+import numpy as np
+
+# Oxide molar masses (g/mol). `O` is the excess oxygen component used
+# by `thermocalc` to record ferric iron.
+OXIDE_MOLAR_MASSES = OrderedDict([
+    ("H2O",    18.0153),
+    ("CO2",    44.0095),
+    ("SiO2",   60.0843),
+    ("TiO2",   79.8658),
+    ("Al2O3", 101.9613),
+    ("Cr2O3", 151.9904),
+    ("Fe2O3", 159.6882),
+    ("FeO",    71.8444),
+    ("MnO",    70.9374),
+    ("MgO",    40.3044),
+    ("NiO",    74.6928),
+    ("CaO",    56.0774),
+    ("Na2O",   61.9789),
+    ("K2O",    94.1960),
+    ("P2O5",  141.9445),
+    ("O",      15.9994),
+])
+
+
+def molar_masses(oxides):
+    """
+    Returns the molar masses for the provided oxides.
+
+    Params
+    ------
+    oxides: str, list
+        Oxide names, either as a list or a whitespace separated string.
+
+    Returns
+    -------
+    masses: numpy.ndarray
+        Array of molar masses (g/mol), ordered as per `oxides`.
+    """
+    if isinstance(oxides, str):
+        oxides = oxides.split()
+    try:
+        return np.array([OXIDE_MOLAR_MASSES[oxide] for oxide in oxides])
+    except KeyError as e:
+        raise RuntimeError("No molar mass is available for oxide {}.".format(e))
+
+
+def normalise(comp, total=100.):
+    """
+    Normalises compositions such that each sums to `total`.
+
+    Params
+    ------
+    comp: array_like
+        Composition or batch of compositions.
+    total: float
+        Required sum for each composition.
+
+    Returns
+    -------
+    comp: numpy.ndarray
+        Normalised compositions.
+    """
+    comp = np.asarray(comp, dtype=float)
+    sums = comp.sum(axis=-1, keepdims=True)
+    if np.any(sums <= 0.):
+        raise RuntimeError("Unable to normalise compositions with non-positive totals.")
+    return comp*(total/sums)
+
+
+def wt_to_mol(comp, oxides, total=100.):
+    """
+    Converts compositions from oxide weight percent to oxide mole percent.
+
+    Params
+    ------
+    comp: array_like
+        Composition or batch of compositions in wt%.
+    oxides: str, list
+        Oxides corresponding to the composition columns.
+    total: float
+        Required sum for each returned composition.
+
+    Returns
+    -------
+    comp: numpy.ndarray
+        Compositions in mol%.
+    """
+    return normalise(np.asarray(comp, dtype=float)/molar_masses(oxides), total)
+
+
+def mol_to_wt(comp, oxides, total=100.):
+    """
+    Converts compositions from oxide mole percent to oxide weight percent.
+
+    Params
+    ------
+    comp: array_like
+        Composition or batch of compositions in mol%.
+    oxides: str, list
+        Oxides corresponding to the composition columns.
+    total: float
+        Required sum for each returned composition.
+
+    Returns
+    -------
+    comp: numpy.ndarray
+        Compositions in wt%.
+    """
+    return normalise(np.asarray(comp, dtype=float)*molar_masses(oxides), total)
+
+
+def mode_weighted(modes, compositions, total=100.):
+    """
+    Forms bulk compositions as the mode weighted sum of phase compositions.
+
+    `thermocalc` reports modes on a one-oxide basis, so phase compositions
+    are first rescaled to a single oxide before being weighted.
+
+    Params
+    ------
+    modes: array_like
+        Phase modes, with shape `(..., n_phases)`.
+    compositions: array_like
+        Phase compositions in oxide moles per formula unit, with shape
+        `(..., n_phases, n_oxides)`.
+    total: float
+        Required sum for each returned composition.
+
+    Returns
+    -------
+    bulk: numpy.ndarray
+        Bulk compositions (mol%) with shape `(..., n_oxides)`.
+    """
+    modes = np.asarray(modes, dtype=float)
+    compositions = np.asarray(compositions, dtype=float)
+    oxide_sums = compositions.sum(axis=-1)
+    scale = np.divide(modes, oxide_sums, out=np.zeros(np.broadcast(modes, oxide_sums).shape),
+                      where=oxide_sums > 0.)
+    return normalise(np.einsum("...p,...po->...o", scale, compositions), total)
+
+
+def rbi_arrays(rbis, phases=None):
+    """
+    Extracts modes and phase compositions from `rbi` objects as arrays.
+
+    Params
+    ------
+    rbis: tawnycalc.rbi, list
+        A single `rbi` object, or a list of `rbi` objects. All objects
+        must share the same oxides.
+    phases: list
+        Phases to extract. Defaults to the union of phases across `rbis`.
+        Phases absent from a given `rbi` are assigned zero mode.
+
+    Returns
+    -------
+    oxides: list
+        The oxide columns.
+    phases: list
+        The extracted phases.
+    modes: numpy.ndarray
+        Modes, with shape `(n_phases,)` or `(n_rbis, n_phases)`.
+    compositions: numpy.ndarray
+        Compositions, with shape `(n_phases, n_oxides)` or
+        `(n_rbis, n_phases, n_oxides)`.
+    """
+    single = not isinstance(rbis, (list, tuple))
+    if single:
+        rbis = [rbis,]
+    oxides = list(rbis[0].oxides)
+    for item in rbis[1:]:
+        if list(item.oxides) != oxides:
+            raise RuntimeError("All 'rbi' objects must share the same oxides.")
+    if phases is None:
+        phases = []
+        for item in rbis:
+            phases.extend(phase for phase in item.keys() if phase not in phases)
+    modes = np.zeros((len(rbis), len(phases)))
+    compositions = np.zeros((len(rbis), len(phases), len(oxides)))
+    for i, item in enumerate(rbis):
+        for j, phase in enumerate(phases):
+            if phase in item:
+                modes[i,j] = float(item[phase]["mode"])
+                compositions[i,j] = [float(item[phase][oxide]) for oxide in oxides]
+    if single:
+        return oxides, phases, modes[0], compositions[0]
+    return oxides, phases, modes, compositions
+
+
+def from_rbi(rbis, remove=None, total=100.):
+    """
+    Derives bulk compositions from `rbi` objects, optionally after
+    fractional removal of phases.
+
+    >>> comp = bulk.from_rbi(results.rbi, remove={"g":0.8})
+
+    Params
+    ------
+    rbis: tawnycalc.rbi, list
+        A single `rbi` object, or a list of `rbi` objects.
+    remove: dict
+        Fraction of each phase mode to remove, keyed by phase name. Values
+        may be scalars, or arrays providing a fraction per `rbi` object.
+    total: float
+        Required sum for each returned composition.
+
+    Returns
+    -------
+    bulk: numpy.ndarray
+        Bulk compositions (mol%), with shape `(n_oxides,)` or
+        `(n_rbis, n_oxides)`. Oxides are ordered as per the `rbi` columns.
+    """
+    oxides, phases, modes, compositions = rbi_arrays(rbis)
+    if remove:
+        retained = np.ones_like(modes)
+        for phase, fraction in remove.items():
+            if phase in phases:
+                retained[...,phases.index(phase)] = 1. - np.asarray(fraction, dtype=float)
+        modes = modes*retained
+    return mode_weighted(modes, compositions, total)
+
+
+def fractionate(bulk, removed, amount, total=100.):
+    """
+    Removes material from bulk compositions.
+
+    Both `bulk` and `removed` are rescaled to a one-oxide basis before
+    `amount` of `removed` is subtracted. Negative results are clipped to
+    zero and the remaining compositions renormalised.
+
+    Params
+    ------
+    bulk: array_like
+        Bulk compositions (mol%), with shape `(..., n_oxides)`.
+    removed: array_like
+        Compositions of removed material in oxide moles, broadcastable to
+        the shape of `bulk`.
+    amount: float, array_like
+        Molar proportion (one-oxide basis) of `removed` to subtract.
+        Arrays must be broadcastable to `bulk.shape[:-1]`.
+    total: float
+        Required sum for each returned composition.
+
+    Returns
+    -------
+    bulk: numpy.ndarray
+        Fractionated bulk compositions.
+    """
+    bulk = normalise(bulk, 1.)
+    removed = normalise(removed, 1.)
+    amount = np.asarray(amount, dtype=float)[...,np.newaxis]
+    return normalise(np.clip(bulk - amount*removed, 0., None), total)
+
+
+def setbulk(comp, precision=4):
+    """
+    Renders compositions as `thermocalc` `setbulk` script values.
+
+    >>> context.script["setbulk"] = bulk.setbulk(comp)
+
+    Params
+    ------
+    comp: array_like
+        Composition or batch of compositions, ordered as per the
+        oxides of the model `rbi`.
+    precision: int
+        Number of decimal places to render.
+
+    Returns
+    -------
+    setbulk: str, list
+        The script value for a single composition, or a list of values
+        for a batch of compositions.
+    """
+    comp = np.asarray(comp, dtype=float)
+    fmt = "{{:.{}f}}".format(precision)
+    if comp.ndim == 1:
+        return "yes " + " ".join(fmt.format(value) for value in comp)
+    return ["yes " + " ".join(fmt.format(value) for value in row) for row in comp]
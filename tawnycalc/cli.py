@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+"""
+Command line interface for headless batch execution.
+
+Three commands are provided:
+
+    tawnycalc sweep spec.toml    # rectangular P-T grid
+    tawnycalc path  spec.toml    # sequence of P-T points
+    tawnycalc merge gtfrac.csv   # combine the outputs of sharded jobs
+
+The specification file (TOML or JSON) describes the points and may
+provide any of the command line options. For example:
+
+    scripts_dir = "gtfrac"
+    output      = "gtfrac.csv"
+    workers     = 16
+
+    [grid]
+    P = { start = 8.0, stop = 12.0, num = 41 }
+    T = [550, 575, 600, 625, 650]
+
+    [script]
+    dogmin = "yes 0"
+
+A path specification instead provides a `path` list of `[P,T]` pairs.
+Results are appended to a CSV file with one row per point, so that an
+interrupted job may be continued with `--resume`. Resuming retries
+points recorded as failed, appending rows which supersede the failed
+rows. A row oriented format is used rather than a columnar format
+(such as Parquet), as rows may then be appended as points complete
+without rewriting the file, and no further dependencies are required.
+Results may also be recorded to a result store (`--store`) or JSON
+lines file (`--jsonl`), and outputs are written in batches (refer to
+`tawnycalc.sinks`).
+
+The `--shard` option (which defaults to the SLURM array task variables)
+selects a subset of points for array jobs. Each shard writes its own
+CSV and JSON lines outputs, named by inserting `.shard<index>` before
+the file extension (or by replacing a `{shard}` placeholder within the
+file name), so that concurrent shards neither interleave rows nor
+resume from the outputs of other shards. Once all shards are complete,
+`tawnycalc merge` combines the shard CSV files into the named output,
+ordered by point index. Result stores and archives may be shared
+between shards.
+
+Exit status is 0 where all points succeed, 1 where any point fails,
+2 for usage or specification errors and 130 when interrupted.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+EXIT_OK = 0
+EXIT_FAILURES = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+
+
+class SpecError(RuntimeError):
+    """
+    Raised for invalid specification files.
+    """
+    pass
+
+
+def load_spec(path):
+    """
+    Loads a TOML or JSON specification file.
+    """
+    if path.endswith(".json"):
+        with open(path, 'r') as fp:
+            return json.load(fp)
+    try:
+        import tomllib
+    except ImportError:
+        try:
+            import tomli as tomllib
+        except ImportError:
+            raise SpecError("Reading TOML specifications requires Python 3.11 or the `tomli` package.")
+    with open(path, 'rb') as fp:
+        return tomllib.load(fp)
+
+
+def _axis(spec, name):
+    """
+    Returns the values along a grid axis, specified either as an explicit
+    list or as a `start`/`stop`/`num` table.
+    """
+    import numpy as np
+    if name not in spec:
+        raise SpecError("Grid axis '{}' is not specified.".format(name))
+    axis = spec[name]
+    if isinstance(axis, dict):
+        try:
+            return [ float(value) for value in np.linspace(axis["start"], axis["stop"], int(axis["num"])) ]
+        except KeyError as e:
+            raise SpecError("Grid axis '{}' requires {} entry.".format(name, e))
+    if isinstance(axis, (int, float)):
+        return [float(axis),]
+    return [ float(value) for value in axis ]
+
+
+def points_from_spec(command, spec):
+    """
+    Returns the list of `(P,T)` points described by `spec`.
+    """
+    if command == "sweep":
+        if "grid" not in spec:
+            raise SpecError("A sweep specification requires a [grid] table.")
+        grid = spec["grid"]
+        return [ (P,T) for P in _axis(grid, "P") for T in _axis(grid, "T") ]
+    if "path" not in spec:
+        raise SpecError("A path specification requires a 'path' list.")
+    try:
+        return [ (float(P), float(T)) for P,T in spec["path"] ]
+    except (TypeError, ValueError):
+        raise SpecError("Path entries must be [P,T] pairs.")
+
+
+def parse_shard(shard):
+    """
+    Parses a shard specification of the form `i/n`, returning `(i,n)`.
+    Where `shard` is not provided, the SLURM array task variables are used.
+    """
+    if not shard:
+        if "SLURM_ARRAY_TASK_ID" in os.environ and "SLURM_ARRAY_TASK_COUNT" in os.environ:
+            offset = int(os.environ.get("SLURM_ARRAY_TASK_MIN", 0))
+            return int(os.environ["SLURM_ARRAY_TASK_ID"]) - offset, int(os.environ["SLURM_ARRAY_TASK_COUNT"])
+        return 0, 1
+    try:
+        index, count = (int(value) for value in shard.split("/"))
+    except ValueError:
+        raise SpecError("Shard must be specified as 'index/count', for example '3/16'.")
+    if not 0 <= index < count:
+        raise SpecError("Shard index must lie within [0,{}).".format(count))
+    return index, count
+
+
+def shard_path(path, index, count=None):
+    """
+    Returns the output path for shard `index` of `count`. Where `count` is
+    one, `path` is returned unchanged.
+    """
+    if count == 1:
+        return path
+    if "{shard}" in path:
+        return path.replace("{shard}", str(index))
+    root, ext = os.path.splitext(path)
+    return "{}.shard{}{}".format(root, index, ext)
+
+
+def merge(output, paths=None):
+    """
+    Combines shard CSV outputs into `output`, ordering rows by point index.
+    Where a point is recorded more than once, rows retain their recorded
+    order, so that later rows continue to supersede earlier rows.
+
+    Params
+    ------
+    output: str
+        The merged CSV file.
+    paths: list
+        The shard CSV files. By default, files matching `shard_path()`
+        for `output` are merged.
+
+    Returns
+    -------
+    paths: list
+        The merged shard files.
+    """
+    import csv
+    import glob
+    if not paths:
+        pattern = shard_path(output, "*")
+        paths = sorted(glob.glob(pattern), key=lambda path: (len(path), path))
+    if not paths:
+        raise SpecError("No shard outputs found for '{}'.".format(output))
+    columns = []
+    rows = []
+    for path in paths:
+        with open(path, 'r', newline='') as fp:
+            reader = csv.DictReader(fp)
+            columns.extend(column for column in reader.fieldnames or [] if column not in columns)
+            rows.extend(row for row in reader if row.get("index"))
+    rows.sort(key=lambda row: int(row["index"]))
+    tmp = "{}.{}.tmp".format(output, os.getpid())
+    with open(tmp, 'w', newline='') as fp:
+        writer = csv.DictWriter(fp, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp, output)
+    return paths
+
+
+class progress(object):
+    """
+    Reports progress to `stderr`. On terminals a single line is updated
+    in place, otherwise a line is written every `interval` seconds.
+    """
+    def __init__(self, total, quiet=False, stream=sys.stderr):
+        self.total = total
+        self.quiet = quiet
+        self.stream = stream
+        self.tty = hasattr(stream, "isatty") and stream.isatty()
+        self.interval = 0.5 if self.tty else 30.
+        self.done = self.failed = 0
+        self._start = self._last = time.time()
+
+    def update(self, failed=False, force=False):
+        self.done += 1
+        self.failed += int(failed)
+        now = time.time()
+        if self.quiet or not (force or now - self._last >= self.interval or self.done == self.total):
+            return
+        self._last = now
+        rate = self.done/max(now - self._start, 1e-9)
+        eta = (self.total - self.done)/rate if rate > 0. else 0.
+        line = "[{}/{}] ok={} failed={} {:.2f}/s eta {:.0f}s".format(
+                self.done, self.total, self.done - self.failed, self.failed, rate, eta)
+        self.stream.write(("\r" + line) if self.tty else (line + "\n"))
+        self.stream.flush()
+
+    def close(self):
+        if self.tty and not self.quiet:
+            self.stream.write("\n")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="tawnycalc", description="Headless batch execution of thermocalc models.")
+    subparsers = parser.add_subparsers(dest="command")
+    sub = subparsers.add_parser("merge", help="combine the CSV outputs of sharded jobs")
+    sub.add_argument("output", help="merged output CSV file")
+    sub.add_argument("shards", nargs="*", help="shard CSV files (default: the shard outputs of 'output')")
+    for command, helptext in (("sweep", "execute a rectangular P-T grid"),
+                              ("path",  "execute a sequence of P-T points")):
+        sub = subparsers.add_parser(command, help=helptext)
+        sub.add_argument("spec", help="TOML or JSON specification file")
+        sub.add_argument("-s", "--scripts-dir", help="directory containing tc-prefs.txt and scripts")
+        sub.add_argument("-o", "--output", help="output CSV file (suffixed per shard for sharded jobs)")
+        sub.add_argument("-w", "--workers", type=int, help="number of concurrent executions")
+        sub.add_argument("-e", "--executable", help="thermocalc executable")
+        sub.add_argument("-t", "--timeout", type=float, help="seconds after which an execution is aborted")
+        sub.add_argument("--detectors", action="store_true",
+                         help="abort executions early where output matches tawnycalc.failures.DEFAULT_DETECTORS")
+        sub.add_argument("--resume", action="store_true", help="skip points already recorded as successful in the output")
+        sub.add_argument("--shard", help="execute shard 'index/count' of the points (default: SLURM array task)")
+        sub.add_argument("--metrics-path", help="periodically write Prometheus metrics to this file")
+        sub.add_argument("--archive", help="append raw thermocalc outputs to this archive file")
+        sub.add_argument("--store", help="also record results to this SQLite result store")
+        sub.add_argument("--jsonl", help="also record results to this JSON lines file")
+        sub.add_argument("--batch-size", type=int, help="number of results written to outputs per batch")
+        sub.add_argument("--pin", action="store_true", help="pin each thermocalc process to a single core")
+        sub.add_argument("--nice", type=int, help="niceness increment for thermocalc processes")
+        sub.add_argument("--memory-limit", help="address space limit per thermocalc process, eg '2G'")
+        sub.add_argument("--min-free-memory", help="only start executions while this much memory is free, eg '4G'")
+        sub.add_argument("--adaptive", action="store_true",
+                         help="attempt targeted calculations of neighbouring assemblages before dogmin")
+        sub.add_argument("--trim", nargs="?", const=True, choices=["verify"],
+                         help="stage trimmed dataset and a-x files ('verify' also checks against the full files)")
+        sub.add_argument("-q", "--quiet", action="store_true", help="disable progress reporting")
+    return parser
+
+
+def run(args):
+    """
+    Executes a parsed command, returning the exit status.
+    """
+    from .core import Context
+    from .runner import Runner, pt_task
+    from .failures import DEFAULT_DETECTORS
+    from .scheduler import Scheduler
+    from .sinks import csv_output, jsonl_output, store_output, stream
+
+    if args.command == "merge":
+        merge(args.output, args.shards)
+        return EXIT_OK
+
+    spec = load_spec(args.spec)
+    points = points_from_spec(args.command, spec)
+    spec_dir = os.path.dirname(os.path.abspath(args.spec))
+    scripts_dir = args.scripts_dir or os.path.join(spec_dir, spec.get("scripts_dir", "."))
+    output = args.output or spec.get("output")
+    if not output:
+        raise SpecError("An output file must be specified.")
+    workers = args.workers or spec.get("workers")
+    shard_index, shard_count = parse_shard(args.shard or spec.get("shard"))
+    # concurrent shards must not append to (or resume from) a shared file
+    output = shard_path(output, shard_index, shard_count)
+
+    context = Context(scripts_dir=scripts_dir, tc_executable=args.executable or spec.get("executable"))
+    for key, value in spec.get("script", {}).items():
+        context.script[key] = value
+
+    completed = csv_output(output, context).completed() if args.resume else set()
+    selected = [ index for index in range(len(points))
+                 if index % shard_count == shard_index and index not in completed ]
+
+    detectors = DEFAULT_DETECTORS if args.detectors or spec.get("detectors") else None
+    archive = None
+    if args.archive or spec.get("archive"):
+        from .archive import Archive
+        archive = Archive(args.archive or os.path.join(spec_dir, spec["archive"]))
+    batch_size = args.batch_size or spec.get("batch_size", 100)
+    sinks = [ csv_output(output, context, batch_size=batch_size), ]
+    if args.store or spec.get("store"):
+        sinks.append(store_output(args.store or os.path.join(spec_dir, spec["store"]), batch_size=batch_size))
+    if args.jsonl or spec.get("jsonl"):
+        jsonl = args.jsonl or os.path.join(spec_dir, spec["jsonl"])
+        sinks.append(jsonl_output(shard_path(jsonl, shard_index, shard_count), batch_size=batch_size))
+    timeout = args.timeout or spec.get("timeout")
+    trim = args.trim or spec.get("trim", False)
+    scheduler = Scheduler(workers=workers,
+                          pin=args.pin or spec.get("pin", False),
+                          nice=args.nice if args.nice is not None else spec.get("nice"),
+                          memory_limit=args.memory_limit or spec.get("memory_limit"),
+                          min_free_memory=args.min_free_memory or spec.get("min_free_memory"))
+    strategy = None
+    if args.adaptive or spec.get("adaptive"):
+        from .strategy import Adaptive, coarse_to_fine
+        strategy = Adaptive()
+        # targeted calculations require points bracketed by dogmin results
+        selected = [ selected[i] for i in coarse_to_fine([ points[index] for index in selected ]) ]
+    runner = Runner(context, metrics_path=args.metrics_path or spec.get("metrics_path"), scheduler=scheduler,
+                    strategy=strategy)
+    report = progress(len(selected), quiet=args.quiet)
+    tasks = ( pt_task(*points[index]) for index in selected )
+    outcomes = stream(runner, tasks, sinks, indices=selected, append=args.resume, detectors=detectors,
+                      timeout=timeout, archive=archive, trim=trim)
+    failures = 0
+    try:
+        for outcome in outcomes:
+            failed = outcome.results is None or bool(outcome.results.get("failure"))
+            failures += failed
+            report.update(failed=failed)
+    finally:
+        outcomes.close()
+        report.close()
+        runner.close()
+        context.cleanup()
+    return EXIT_FAILURES if failures else EXIT_OK
+
+
+def main(argv=None):
+    """
+    Entry point for the `tawnycalc` console command.
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.print_help()
+        return EXIT_USAGE
+    try:
+        return run(args)
+    except (SpecError, RuntimeError, OSError) as e:
+        sys.stderr.write("tawnycalc: error: {}\n".format(e))
+        return EXIT_USAGE
+    except KeyboardInterrupt:
+        sys.stderr.write("\ntawnycalc: interrupted\n")
+        return EXIT_INTERRUPTED
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,28 @@
 # -*- coding: utf-8 -*-
 import os
+import threading
 from collections import OrderedDict
-from .data_objects import xyz, site_fractions, thermodynamic_properties, rbi, Printable_OrderedDict
+from .data_objects import xyz, site_fractions, thermodynamic_properties, rbi, Printable_OrderedDict, Results
+
+def _randomword():
+    import random, string
+    letters = string.ascii_lowercase
+    return ''.join(random.choice(letters) for i in range(6))
+
+def _make_temp_dir(id, temp_dir=None):
+    if not temp_dir:
+        import tempfile
+        temp_dir = os.path.join(tempfile.gettempdir(), 'TC_'+id)
+    if not os.path.exists(temp_dir):
+        os.makedirs(temp_dir)
+    return temp_dir
 
 class Context(object):
     """
     The class records a context for a `thermocalc` computation.
-    Multiple concurrent running contexts are allowed.
+    Multiple concurrent running contexts are allowed, and `execute()` may
+    be called concurrently on a single context (for example from a thread
+    pool), in which case each call executes in its own scratch directory.
 
     The default behaviour is for the context to leverage the standard 
     `thermocalc` input files to for model setup. The user may optionally
@@ -40,23 +56,8 @@ class Context(object):
         a standard system location is used. 
     """
     def __init__(self, scripts_dir=os.getcwd(), tc_executable=None, temp_dir=None):
-        # lets first check that we have an executable
-        # the following is borrowed from https://stackoverflow.com/questions/377017/test-if-executable-exists-in-python
-        def which(program):
-            def is_exe(fpath):
-                return os.path.isfile(fpath) and os.access(fpath, os.X_OK)
-
-            fpath, fname = os.path.split(program)
-            if fpath:
-                if is_exe(program):
-                    return program
-            else:
-                for path in os.environ["PATH"].split(os.pathsep):
-                    exe_file = os.path.join(path, program)
-                    if is_exe(exe_file):
-                        return exe_file
-            return None
-
+        # resolve the executable (cached process-wide, refer to `tawnycalc.inputs`)
+        from .inputs import which
         if tc_executable:
             self.exec = which(tc_executable)
             if self.exec is None:
@@ -71,20 +72,68 @@ class Context(object):
                 raise RuntimeError("Unable to find `thermo` executable. Ensure it is in your path, or set " \
                                    "the `THERMOCALC_EXECUTABLE` environment variable, or the `tc_executable` parameter.")
         self.scripts_dir = scripts_dir
-        def randomword():
-            import random, string
-            letters = string.ascii_lowercase
-            return ''.join(random.choice(letters) for i in range(6))
-        self._id = randomword()
+        self._id = _randomword()
         self.reload()
 
+        self.temp_dir = _make_temp_dir(self._id, temp_dir)
+        self._owned_temp_dir = None if temp_dir else self.temp_dir
+        self._lock = threading.RLock()
+        self._init_scratch()
+
+    def _init_scratch(self):
+        """
+        Initialises the pool of scratch directories used by `execute()`,
+        the first of which is `temp_dir`.
+        """
+        self._scratch_root = self.temp_dir
+        self._scratch = [self.temp_dir,]
+        self._scratch_count = 1
 
-        if not temp_dir:
-            import tempfile
-            temp_dir = os.path.join(tempfile.gettempdir(), 'TC_'+self._id)
-        if not os.path.exists(temp_dir):
-            os.makedirs(temp_dir)
-        self.temp_dir = temp_dir
+    def _snapshot(self):
+        """
+        Returns a shallow copy of this context holding its own copies of
+        the `prefs` and script configuration, and a scratch directory from
+        the pool as its `temp_dir`. The directory must be returned with
+        `_release()`.
+        """
+        import copy
+        with self._lock:
+            if self._scratch_root != self.temp_dir:
+                # `temp_dir` has been reassigned, so start a new pool there
+                self._init_scratch()
+            snapshot = copy.copy(self)
+            snapshot.prefs = copy.deepcopy(self.prefs)
+            snapshot._script = copy.deepcopy(self._script)
+            if self._scratch:
+                snapshot.temp_dir = _make_temp_dir(None, self._scratch.pop())
+            else:
+                snapshot.temp_dir = _make_temp_dir(None, "{}_{}".format(self._scratch_root, self._scratch_count))
+                self._scratch_count += 1
+        return snapshot
+
+    def _release(self, snapshot):
+        """
+        Returns the scratch directory of `snapshot` to the pool.
+        """
+        with self._lock:
+            if self._scratch_root == snapshot._scratch_root:
+                self._scratch.append(snapshot.temp_dir)
+
+    def cleanup(self):
+        """
+        Removes the temporary locations created by this context, including
+        any scratch directories created for concurrent executions. User
+        specified `temp_dir` locations are not removed. Locations are
+        created again should the context subsequently be executed.
+        """
+        import shutil
+        with self._lock:
+            paths = [ "{}_{}".format(self._scratch_root, count) for count in range(1, self._scratch_count) ]
+            if self._owned_temp_dir and self._scratch_root == self._owned_temp_dir:
+                paths.append(self._owned_temp_dir)
+            for path in paths:
+                shutil.rmtree(path, ignore_errors=True)
+            self._init_scratch()
 
     def reload(self):
         """
@@ -102,20 +151,13 @@ class Context(object):
 
         # load from existing inputs if required
         if self.scripts_dir:
+            from .inputs import load
             # find tc-prefs.txt        
             tc_prefs = os.path.join(self.scripts_dir,'tc-prefs.txt')
             if not os.path.isfile(tc_prefs):
                 raise RuntimeError("Unable to find 'tc-prefs.txt' in '{}'".format(self.scripts_dir))
-            # read tc-prefs
-            with open(tc_prefs,'r') as fp:
-                while True:
-                    line = fp.readline()
-                    if not line: break
-                    line = line.split("%", 1)[0]
-                    splitline = line.split()
-                    # print(splitline)
-                    if len(splitline)>1:
-                        self.prefs[splitline[0]] = splitline[1]
+            # read tc-prefs (parsed files are cached process-wide)
+            self.prefs.update(load("prefs", tc_prefs))
             if 'scriptfile' not in self.prefs:
                 raise RuntimeError("'scriptfile' does not appear to be specified in 'tc-prefs.txt' file.")
 
@@ -131,54 +173,135 @@ class Context(object):
             if not os.path.isfile(tc_sf):
                 raise RuntimeError("Unable to find scriptfile '{}' in '{}'".format(sf,self.scripts_dir))
             # read script file
-            # keep track of repeated keys to handle differently
-            from collections import defaultdict
-            keycount = defaultdict(lambda: 0)
-            with open(tc_sf,'r') as fp:
-                while True:
-                    line = fp.readline()
-                    if not line: break
-                    # get rid of everything after '%'
-                    line = line.split("%", 1)[0]
-                    splitline = line.split()
-                    if len(splitline)>0:
-                        if splitline[0] == '*':                # don't read anything past here
-                            break
-                        key = splitline[0]
-                        value = splitline[1:]
-                        # now need to decide how to enter into dictionary.
-                        # treat "xyzguess" as dictionary
-                        if key=="xyzguess":
-                            if "xyzguess" not in self._script.keys():
-                                self._script["xyzguess"] = xyz()
-                            self._script["xyzguess"][value[0]] = value[1:]
-                        elif key=="rbi":
-                            if "rbi" not in self._script:
-                                # create `rbi` object and provide `value` for oxide columns
-                                self._script["rbi"] = rbi(value)
-                            else:
-                                self._script["rbi"].add_data(value)
-                        else:
-                            val_count = len(value)
-                            if val_count == 0:                   # if no values, just set to None
-                                value = None
-                            else:
-                                value = " ".join(value)
-                                if value == 'ask':
-                                    raise RuntimeError("'ask' is not supported setting from Python interface.")
-                            # first check the number of times this key has been encountered
-                            keycount[key]+=1                       # increment key count
-                            if   keycount[key] == 1:               # if only encountered once, simply create direct pair
-                                self._script[key] = value
-                            if keycount[key] == 2:                 # this is the second time we've encountered this key,
-                                rows = list()                      # so create a list store the rows,
-                                rows.append(self._script[key])      # and append previously encountered value as first item in row list.
-                                self._script[key] = rows            # now replace that previous value with the rows list (which contains it). 
-                                                                   # note that the new value is entered in the following block.
-                            if keycount[key] > 1:
-                                self._script[key].append(value)     # append value to rows list of values
+            self._script.update(load("script", tc_sf))
             self.check_config()
 
+    @classmethod
+    def from_text(cls, prefs, script, tc_executable=None, temp_dir=None, scripts_dir=None):
+        """
+        Returns a context configured from in-memory `tc-prefs.txt` and
+        scriptfile contents, rather than from files. Parsed text is cached
+        process-wide (refer to `tawnycalc.inputs`).
+
+        Params
+        ------
+        prefs: str
+            Contents of the `tc-prefs.txt` file.
+        script: str
+            Contents of the scriptfile.
+        tc_executable: str
+            Thermocalc executable. Refer to the class descriptor.
+        temp_dir: str
+            Temporary location used for the `thermocalc` execution.
+        scripts_dir: str
+            Location of the dataset and axfile, recorded as the context
+            `scripts_dir`. If not specified, files provided with `tawnycalc`
+            are used (or those of `datasets_dir` passed to `execute()`).
+
+        Returns
+        -------
+        context: tawnycalc.Context
+            The configured context.
+        """
+        from .inputs import loads
+        context = cls(scripts_dir=None, tc_executable=tc_executable, temp_dir=temp_dir)
+        context.scripts_dir = scripts_dir
+        context.prefs.update(loads("prefs", prefs))
+        context._script.update(loads("script", script))
+        context.check_config()
+        return context
+
+
+    def copy(self, temp_dir=None):
+        """
+        Returns a copy of this context. The copy holds its own `prefs` and
+        `script` configuration, and its own temporary location, so that 
+        the copy and the original may be executed concurrently.
+
+        Params
+        ------
+        temp_dir: str
+            Temporary location used for the copy's `thermocalc` execution.
+            If not specified, a standard system location is used. 
+
+        Returns
+        -------
+        context: tawnycalc.Context
+            The copied context.
+        """
+        import copy
+        cpy = copy.copy(self)
+        cpy.prefs = copy.deepcopy(self.prefs)
+        cpy._script = copy.deepcopy(self._script)
+        cpy._id = _randomword()
+        cpy.temp_dir = _make_temp_dir(cpy._id, temp_dir)
+        cpy._owned_temp_dir = None if temp_dir else cpy.temp_dir
+        cpy._lock = threading.RLock()
+        cpy._init_scratch()
+        return cpy
+
+    def set_pt(self, P, T):
+        """
+        Configures the script for a calculation at a single pressure
+        and temperature, by setting the `setPwindow` and `setTwindow` 
+        entries.
+
+        Params
+        ------
+        P: float
+            Pressure (kbar).
+        T: float
+            Temperature (°C).
+        """
+        with self._lock:
+            self._script["setPwindow"] = "{} {}".format(P,P)
+            self._script["setTwindow"] = "{} {}".format(T,T)
+
+    def set_guesses(self, results):
+        """
+        Sets the script starting guesses (`ptguess` and `xyzguess`) from
+        the results of a previous execution. This is useful to warm start
+        calculations at nearby conditions. Existing `xyzguess` entries 
+        not present in the results are retained, as are any `range` 
+        specifications.
+
+        Params
+        ------
+        results: dict
+            Results returned from `execute()`.
+        """
+        with self._lock:
+            if "P" in results and "T" in results:
+                self._script["ptguess"] = "{} {}".format(results["P"],results["T"])
+            if "xyz" in results:
+                existing = self._script.get("xyzguess", {})
+                guesses = xyz(existing)
+                for key, value in results["xyz"].items():
+                    suffix = existing.get(key, "")
+                    if not isinstance(suffix, list):
+                        suffix = str(suffix).split()
+                    suffix = [str(token) for token in suffix[1:]]
+                    guesses[key] = " ".join([str(value),] + suffix)
+                self._script["xyzguess"] = guesses
+
+    def config_hash(self, datasets_dir=None):
+        """
+        Returns a hash of the current configuration, being the `prefs` and
+        script entries, and the contents of the dataset and axfile. Refer to
+        `tawnycalc.sweep.dependencies`.
+
+        Params
+        ------
+        datasets_dir: str
+            Location of datasets, as per `execute()`.
+
+        Returns
+        -------
+        config_hash: str
+            Hexadecimal digest.
+        """
+        from .sweep import dependencies, fingerprint
+        return fingerprint(dependencies(self, datasets_dir=datasets_dir))
 
     def check_config(self):
         """
@@ -324,7 +447,66 @@ class Context(object):
             for key, value in self.prefs.items():
                 fp.write("{} {}\n".format(key.ljust(longest+1),self._get_string(value)))
 
-    def execute(self, print_output=False, copy_new_files=False, datasets_dir=None):
+    def _run(self, print_output=False, detectors=None, timeout=None, on_spawn=None):
+        """
+        Runs the `thermocalc` executable, streaming standard output through
+        the failure detectors. Returns the `(stdout,stderr)` data and the
+        failure reason (or `None`).
+        """
+        from subprocess import Popen, PIPE
+        from .failures import monitor, TIMEOUT
+        p = Popen(self.exec,cwd=self.temp_dir, stdout=PIPE, stdin=PIPE, stderr=PIPE)
+        if on_spawn is not None:
+            try:
+                on_spawn(p)
+            except BaseException:
+                p.kill()
+                p.wait()
+                raise
+        # answer the final prompt upfront, as output is streamed until exit
+        p.stdin.write(b'n\n')
+        p.stdin.close()
+
+        timed_out = threading.Event()
+        def expire():
+            timed_out.set()
+            p.kill()
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, expire)
+            timer.daemon = True
+            timer.start()
+
+        # drain standard error concurrently, so that neither pipe can fill
+        # and block `thermocalc` while the other is being read
+        stderr = []
+        drain = threading.Thread(target=lambda: stderr.append(p.stderr.read()))
+        drain.daemon = True
+        drain.start()
+
+        watch = monitor(detectors)
+        stdout = []
+        try:
+            for line in iter(p.stdout.readline, b''):
+                stdout.append(line)
+                if print_output or watch.detectors:
+                    text = line.decode("cp437").rstrip()
+                    if print_output:
+                        print('{}'.format(text))
+                    if watch.failure is None and watch(text):
+                        p.terminate()
+            p.wait()
+            drain.join()
+        finally:
+            if timer is not None:
+                timer.cancel()
+            p.stdout.close()
+            p.stderr.close()
+        failure = TIMEOUT if timed_out.is_set() else watch.failure
+        return (b''.join(stdout), b''.join(stderr)), failure
+
+    def execute(self, print_output=False, copy_new_files=False, datasets_dir=None, metrics=None,
+                detectors=None, timeout=None, on_spawn=None, archive=None, trim=False):
         """
         Execute thermocalc for the current configuration, and parse generated
         outputs. Recorded outputs include execution standard output (`stdout`),
@@ -333,14 +515,16 @@ class Context(object):
         Files generated as a result of the execution are as default not copied
         back to the context location.
 
-        All results are returned as a dictionary. Refer to the list of dictionary 
-        keys to get a list of returned data:
+        All results are returned as a `Results` object, which behaves as a 
+        dictionary. Refer to the list of dictionary keys to get a list of 
+        returned data:
 
         >>> results = mycontext.execute()
         >>> results.print_keys()
         P
         T
         bulk_composition
+        failure
         modes
         output_stderr
         output_stdout
@@ -361,31 +545,98 @@ class Context(object):
         >>> results["P"]
         11.0
 
+        Executions may be aborted early where failure `detectors` match the
+        streamed `thermocalc` output, or where `timeout` is exceeded. In this
+        case the `failure` entry records the classified reason (refer to 
+        `tawnycalc.failures`), and outputs are not parsed. For completed 
+        executions `failure` is `None`.
+
+        The configuration is captured when this method is called, and each
+        call executes in its own scratch directory (the first of which is
+        `temp_dir`), so that a single context may be executed concurrently
+        from multiple threads.
 
         Params
         ------
         print_output: bool
             If set to `True`, prints `thermocalc` output to screen. 
-        copy_new_files: bool
+        copy_new_files: str
             Files which are generated resultant of the `thermocalc` execution are by 
-            default not copied back to the context location. Enable this flag to have
-            generated files copied. 
+            default not copied back to the context location. Provide a directory
+            (created if necessary) to have generated files copied there. This must
+            not be the `scripts_dir`, as generated files would overwrite its inputs.
+            Alternatively, use `archive` to retain the outputs of every execution.
 
         datasets_dir: string
             Location of required datasets. It is usually not necessary to specify this
             as the files will be obtained from the `scripts_dir` or from `tawnycalc` 
             itself. 
+        metrics: tawnycalc.metrics.Metrics
+            If provided, the latency of each execution stage (`stage`, `run`
+            and `parse`) is recorded to this object.
+        detectors: list
+            Failure detectors (see `tawnycalc.failures`) applied to standard 
+            output as it is generated. `tawnycalc.failures.DEFAULT_DETECTORS`
+            provides a standard set.
+        timeout: float
+            Seconds after which the execution is terminated.
+        on_spawn: callable
+            If provided, called with the `subprocess.Popen` object of the
+            `thermocalc` process immediately after it is started. For example,
+            `tawnycalc.scheduler.Scheduler` uses this to apply CPU affinity
+            and resource limits.
+        archive: tawnycalc.archive.Archive
+            If provided, the files generated by the execution, along with its
+            standard output and error, are appended to this archive keyed by
+            the configuration hash, which is recorded in the `config_hash`
+            entry of the results.
+        trim: bool, str
+            If `True`, trimmed dataset and a-x files containing only the
+            phases and end-members required by the script are staged
+            (refer to `tawnycalc.staging`). If `"verify"`, the full files are
+            also executed, and an exception is raised where the results
+            differ.
 
         Returns
         -------
-        results: dict
-            Dictionary containing execution results.
+        results: Results
+            Dictionary-like object containing execution results.
         """
-        self.check_config()
-
-        if copy_new_files:
+        if trim not in (False, True, "verify"):
+            raise RuntimeError("`trim` must be `True`, `False` or 'verify'.")
+        if copy_new_files is True:
             import warnings
-            warnings.warn("'copy_new_files' not yet implemented.\nGenerated files may be found in {}".format(self.temp_dir))
+            warnings.warn("`copy_new_files` requires an output directory, so generated files are not copied.\n"
+                          "Provide a directory, or use `archive`.")
+            copy_new_files = False
+        if copy_new_files and self.scripts_dir and \
+           os.path.realpath(copy_new_files) == os.path.realpath(self.scripts_dir):
+            raise RuntimeError("Generated files may not be copied to the `scripts_dir`.")
+        snapshot = self._snapshot()
+        try:
+            results = snapshot._execute(print_output, copy_new_files, datasets_dir, metrics,
+                                        detectors, timeout, on_spawn, archive, bool(trim))
+            if trim == "verify":
+                from .staging import compare
+                reference = snapshot._execute(False, False, datasets_dir, metrics,
+                                              detectors, timeout, on_spawn, None, False)
+                differences = compare(results, reference)
+                if differences:
+                    raise RuntimeError("Results using trimmed files differ from those using full files:\n    " +
+                                       "\n    ".join(differences))
+            return results
+        finally:
+            self._release(snapshot)
+
+    def _execute(self, print_output, copy_new_files, datasets_dir, metrics, detectors, timeout,
+                 on_spawn, archive, trim=False):
+        """
+        Executes within `temp_dir`, which must not be in use by any other
+        execution. Refer to `execute()`.
+        """
+        from .metrics import stopwatch
+        watch = stopwatch(metrics)
+        self.check_config()
 
         # write prefs file to temp location
         self.save_prefs(os.path.join(self.temp_dir,"tc-prefs.txt"))
@@ -402,36 +653,64 @@ class Context(object):
             # use python module files
             datasets_dir = os.path.join(__file__[:-7],"datasets")
         
-        # now copy dataset file
+        # now copy dataset file and axfile, trimmed if requested
         from shutil import copyfile
         dataset = "tc-ds{}.txt".format(self.prefs['dataset'])
-        copyfile(os.path.join(datasets_dir,dataset), os.path.join(self.temp_dir,dataset))
-
-        # now copy axfile
         axfile = "tc-{}.txt".format(self._script['axfile'])
-        copyfile(os.path.join(datasets_dir,axfile), os.path.join(self.temp_dir,axfile))
-
-        from subprocess import Popen, PIPE, STDOUT
-        p = Popen(self.exec,cwd=self.temp_dir, stdout=PIPE, stdin=PIPE, stderr=PIPE)
-        if print_output:
-            for line in iter(p.stdout.readline, b''):
-                print('{}'.format(line.decode("cp437").rstrip()))
-        std_data = p.communicate(input=b'n\n')
-
-
-        # create a special dictionary which allows keys/vals to be accessed
-        # via object attributes
-        class ResultsDict(dict):
-            def __init__(self, *args, **kwargs):
-                super(ResultsDict, self).__init__(*args, **kwargs)
-                self.__dict__ = self
-            def print_keys(self):
-                for key in sorted(self.keys()):
-                    print(key)
-
-        results = ResultsDict()
+        sources = (os.path.join(datasets_dir,dataset), os.path.join(datasets_dir,axfile))
+        if trim:
+            from .staging import trimmed
+            sources = trimmed(sources[0], sources[1], self._script)
+        copyfile(sources[0], os.path.join(self.temp_dir,dataset))
+        copyfile(sources[1], os.path.join(self.temp_dir,axfile))
+        watch.lap("stage")
+
+        # remove outputs of any previous execution
+        filename = "tc-" + self.prefs["scriptfile"] + "-ic.txt"
+        for output in ("tc-log.txt", filename):
+            if os.path.isfile(os.path.join(self.temp_dir,output)):
+                os.remove(os.path.join(self.temp_dir,output))
+
+        before = None
+        if copy_new_files or archive is not None:
+            from .archive import snapshot
+            before = snapshot(self.temp_dir)
+        config_hash = self.config_hash(datasets_dir) if archive is not None else None
+
+        std_data, failure = self._run(print_output, detectors, timeout, on_spawn)
+        watch.lap("run")
+
+        if before is not None:
+            from .archive import changed_files
+            generated = changed_files(self.temp_dir, before)
+            if copy_new_files:
+                from shutil import copyfile
+                os.makedirs(copy_new_files, exist_ok=True)
+                for name in generated:
+                    copyfile(os.path.join(self.temp_dir,name), os.path.join(copy_new_files,name))
+            if archive is not None:
+                files = OrderedDict([("stdout", std_data[0]), ("stderr", std_data[1])])
+                for name in generated:
+                    with open(os.path.join(self.temp_dir,name),'rb') as fp:
+                        files[name] = fp.read()
+                archive.append(config_hash, files, {"failure":failure})
+                watch.lap("archive")
+
+        results = Results()
         results["output_stdout"] = std_data[0].decode("cp437") # record standard output
         results["output_stderr"] = std_data[1].decode("cp437") # record standard error
+        results["failure"] = failure
+        if config_hash is not None:
+            results["config_hash"] = config_hash
+
+        if failure:
+            # aborted executions leave incomplete outputs, so only record raw text
+            for key, output in (("output_tc_log","tc-log.txt"), ("output_tc_ic",filename)):
+                if os.path.isfile(os.path.join(self.temp_dir,output)):
+                    with open(os.path.join(self.temp_dir,output),'r',encoding="cp437") as fp:
+                        results[key] = fp.read()
+            watch.lap("parse")
+            return results
 
         # try parse `tc-log.txt`
         try:
@@ -489,7 +768,6 @@ class Context(object):
             results["output_tc_log"] = fp.read()
 
         # try parse `tc-ic.txt`
-        filename = "tc-" + self.prefs["scriptfile"] + "-ic.txt"
         try:
             with open(os.path.join(self.temp_dir,filename),'r',encoding="cp437") as fp:
                 while True:
@@ -536,6 +814,7 @@ class Context(object):
         # ok, grab entire output for user's convenience 
         with open(os.path.join(self.temp_dir,filename),'r',encoding="cp437") as fp:
             results["output_tc_ic"] = fp.read()
+        watch.lap("parse")
 
         return results
 
@@ -113,6 +113,12 @@ class _tabled_data(OrderedDict):
             List of string tokens read from the a TC input/output.
         """
         raise RuntimeError("Child must define.")
+
+    def __reduce__(self):
+        """
+        Enables copying and pickling, as the header is required at construction.
+        """
+        return (self.__class__, (self.header,), self.__dict__, None, iter(self.items()))
     
     def _generate_table_rows(self):
         rows = [ ["",]+self.header, ]
@@ -238,3 +244,219 @@ class rbi(_tabled_data):
         for key,val in self.items():
             cpy[key]=val.copy()
         return cpy
+
+
+_RESULTS_MAGIC = b"TCRS"
+_RESULTS_VERSION = 1
+
+class Results(object):
+    """
+    Container for the results of a `thermocalc` execution, as returned by 
+    `Context.execute()`.
+
+    Entries may be accessed directly as attributes or via the usual 
+    dictionary methods:
+
+    >>> results.P
+    11.0
+    >>> results["P"]
+    11.0
+
+    Only the entries listed in `Results.__slots__` may be set. Unset entries
+    behave as missing dictionary keys.
+
+    Unlike the dictionary previously returned, `Results` is not a `dict`
+    subclass, so `isinstance(results, dict)` is `False` and results cannot
+    be passed directly to `json.dumps()`. Use `to_dict()` where a
+    dictionary is required.
+
+    Results may be pickled, and provide a compact binary serialisation via 
+    `to_bytes` and `from_bytes`, in which numeric data is recorded as arrays
+    and raw outputs are optionally included (compressed).
+    """
+    __slots__ = ("P", "T", "bulk_composition", "config_hash", "failure", "modes", 
+                 "output_stderr", "output_stdout", "output_tc_ic", "output_tc_log", 
+                 "phases", "rbi", "site_fractions", "strategy", "thermodynamic_properties", "xyz")
+
+    _raw_keys = ("output_stderr", "output_stdout", "output_tc_ic", "output_tc_log")
+
+    def __init__(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError("'{}' is not a valid results entry.".format(key))
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        try:
+            delattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.__slots__ and hasattr(self, key)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if not isinstance(other, Results):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def keys(self):
+        return [ key for key in self.__slots__ if hasattr(self, key) ]
+
+    def values(self):
+        return [ getattr(self, key) for key in self.keys() ]
+
+    def items(self):
+        return [ (key, getattr(self, key)) for key in self.keys() ]
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def to_dict(self):
+        """
+        Returns the results as a dictionary.
+        """
+        return OrderedDict(self.items())
+
+    def print_keys(self):
+        for key in sorted(self.keys()):
+            print(key)
+
+    def __repr__(self):
+        return "Results({})".format(", ".join(self.keys()))
+
+    def __reduce__(self):
+        return (_results_from_bytes, (self.to_bytes(raw=True),))
+
+    def to_bytes(self, raw=False):
+        """
+        Serialises the results to a compact binary representation.
+
+        Params
+        ------
+        raw: bool
+            If `True`, the raw `output_` entries are included (compressed).
+
+        Returns
+        -------
+        data: bytes
+            The serialised results.
+        """
+        import json, struct, zlib
+        import numpy as np
+        header = OrderedDict()
+        arrays = []
+        offset = [0]
+        def add_array(values):
+            values = np.ascontiguousarray(values, dtype=np.float64)
+            arrays.append(values.tobytes())
+            start = offset[0]
+            offset[0] += values.size
+            return [start, values.size]
+
+        for key in ("P", "T", "phases", "failure", "config_hash", "strategy"):
+            if key in self:
+                header[key] = self[key]
+        for key in ("modes", "xyz", "bulk_composition"):
+            if key in self:
+                item = self[key]
+                header[key] = [list(item.keys()), add_array([float(value) for value in item.values()])]
+        if "rbi" in self:
+            item = self["rbi"]
+            table = [ [float(row["mode"])] + [float(row[oxide]) for oxide in item.oxides] for row in item.values() ]
+            header["rbi"] = [list(item.oxides), list(item.keys()), add_array(table)]
+        if "site_fractions" in self:
+            header["site_fractions"] = [ [phase, list(item.items())] for phase, item in self["site_fractions"].items() ]
+        if "thermodynamic_properties" in self:
+            item = self["thermodynamic_properties"]
+            header["thermodynamic_properties"] = [item.header, [ [phase, list(row.values())] for phase, row in item.items() ]]
+        blobs = []
+        if raw:
+            header["raw"] = OrderedDict()
+            for key in self._raw_keys:
+                if key in self:
+                    blob = zlib.compress(self[key].encode("utf-8"))
+                    header["raw"][key] = len(blob)
+                    blobs.append(blob)
+        header = json.dumps(header, separators=(",",":")).encode("utf-8")
+        return b"".join([_RESULTS_MAGIC, struct.pack("<BII", _RESULTS_VERSION, len(header), offset[0]), header] + arrays + blobs)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Reconstructs results from the output of `to_bytes`.
+
+        Params
+        ------
+        data: bytes
+            The serialised results.
+
+        Returns
+        -------
+        results: Results
+            The reconstructed results.
+        """
+        import json, struct, zlib
+        import numpy as np
+        if data[:4] != _RESULTS_MAGIC:
+            raise RuntimeError("Data does not appear to be serialised results.")
+        version, header_length, array_length = struct.unpack_from("<BII", data, 4)
+        if version != _RESULTS_VERSION:
+            raise RuntimeError("Unsupported serialised results version {}.".format(version))
+        start = 4 + struct.calcsize("<BII")
+        header = json.loads(data[start:start+header_length].decode("utf-8"), object_pairs_hook=OrderedDict)
+        start += header_length
+        array = np.frombuffer(data, dtype=np.float64, count=array_length, offset=start)
+        start += 8*array_length
+
+        def get_array(span):
+            return array[span[0]:span[0]+span[1]]
+
+        results = cls()
+        for key in ("P", "T", "phases", "failure", "config_hash", "strategy"):
+            if key in header:
+                results[key] = header[key]
+        for key, container in (("modes", Printable_OrderedDict), ("xyz", xyz), ("bulk_composition", Printable_OrderedDict)):
+            if key in header:
+                names, span = header[key]
+                results[key] = container(zip(names, get_array(span).tolist()))
+        if "rbi" in header:
+            oxides, phases, span = header["rbi"]
+            table = get_array(span).reshape(len(phases), len(oxides)+1)
+            item = rbi(oxides)
+            for phase, row in zip(phases, table.tolist()):
+                item.add_phase(phase, row[0], row[1:])
+            results["rbi"] = item
+        if "site_fractions" in header:
+            item = site_fractions()
+            for phase, values in header["site_fractions"]:
+                item[phase] = OrderedDict(values)
+            results["site_fractions"] = item
+        if "thermodynamic_properties" in header:
+            columns, rows = header["thermodynamic_properties"]
+            item = thermodynamic_properties(columns)
+            for phase, values in rows:
+                item.add_data([phase,] + values)
+            results["thermodynamic_properties"] = item
+        for key, length in header.get("raw", {}).items():
+            results[key] = zlib.decompress(data[start:start+length]).decode("utf-8")
+            start += length
+        return results
+
+def _results_from_bytes(data):
+    return Results.from_bytes(data)
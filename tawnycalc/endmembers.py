@@ -0,0 +1,501 @@
+# -*- coding: utf-8 -*-
+"""
+End-member thermodynamics evaluated directly from `thermocalc` datasets.
+
+This module reads end-member parameters from `tc-ds62.txt`/`tc-ds633.txt`
+style dataset files, and evaluates their Gibbs energy, enthalpy, entropy
+and volume over arrays of pressure and temperature following the Holland
+& Powell (2011) formulation:
+
+* heat capacity polynomial `Cp = a + bT + c/T^2 + d/T^(1/2)`,
+* modified Tait equation of state with Einstein thermal pressure for
+  solids, and a temperature dependent bulk modulus for liquids,
+* Landau and Bragg-Williams order-disorder contributions,
+* CORK fluid equations of state (Holland & Powell 1991, 1998) for `H2O`
+  and, via corresponding states, for other gas species.
+
+This allows quick screening of P-T windows without executing `thermocalc`:
+
+>>> import tawnycalc.endmembers as endmembers
+>>> ds = endmembers.dataset(62)
+>>> G = ds.gibbs(["ky","sill","and"], P=P_grid, T=T_grid)
+>>> T = ds.reaction_temperature({"ky":-1, "sill":1}, P=[4.,6.,8.])
+
+Units follow `thermocalc`: pressures in kbar, temperatures in °C, energies
+in kJ/mol, entropies in kJ/K/mol and volumes in kJ/kbar. Entropies and
+volumes are evaluated by central differences of the Gibbs energy.
+Aqueous species are not supported.
+"""
+import os
+from collections import OrderedDict
+import numpy as np
+
+R = 8.3144621e-3        # kJ/K/mol
+TR = 298.15             # reference temperature (K)
+PR = 0.001              # reference pressure (kbar)
+
+# element indices used by the dataset formulae
+ELEMENTS = ("Si", "Ti", "Al", "Fe", "Mg", "Mn", "Ca", "Na", "K", "O",
+            "H", "C", "Cl", "e", "Ni", "Zr", "S", "Cu", "Cr")
+
+# critical constants (K, kbar) for the corresponding states CORK
+CRITICAL_CONSTANTS = {
+    "CO2": (304.2,  0.0738),
+    "CH4": (190.6,  0.0460),
+    "O2":  (154.6,  0.0504),
+    "H2":  (41.2,   0.0211),
+    "CO":  (132.9,  0.0350),
+    "S2":  (208.15, 0.072954),
+    "H2S": (373.15, 0.08963),
+}
+
+_SOLID, _LIQUID, _GAS, _AQUEOUS = range(4)
+
+
+def _dataset_path(dataset):
+    if isinstance(dataset, (int, np.integer)) or str(dataset).isdigit():
+        return os.path.join(os.path.dirname(__file__), "datasets", "tc-ds{}.txt".format(dataset))
+    return dataset
+
+
+class dataset(object):
+    """
+    End-member dataset.
+
+    Params
+    ------
+    dataset: int, str
+        Dataset number (eg `62` or `633`) for datasets provided with
+        `tawnycalc`, or the path to a dataset file.
+    """
+    def __init__(self, dataset=62):
+        self.path = _dataset_path(dataset)
+        if not os.path.isfile(self.path):
+            raise RuntimeError("Unable to find dataset file '{}'.".format(self.path))
+        self.endmembers = OrderedDict()
+        with open(self.path, 'r') as fp:
+            lines = fp.read().splitlines()
+        try:
+            count = int(lines[0].split()[0])
+        except (IndexError, ValueError):
+            raise RuntimeError("Unable to parse dataset header of '{}'.".format(self.path))
+        i = 3
+        while len(self.endmembers) < count:
+            if i >= len(lines):
+                raise RuntimeError("Dataset '{}' ended before all {} end-members were read.".format(self.path, count))
+            if not lines[i].split():
+                i += 1
+                continue
+            self._parse(lines[i:i+4])
+            i += 4
+
+    def _parse(self, lines):
+        tokens = lines[0].split()
+        name = tokens[0]
+        formula = OrderedDict()
+        j = 2
+        while j < len(tokens) and tokens[j] != "0":
+            formula[ELEMENTS[int(tokens[j])-1]] = float(tokens[j+1])
+            j += 2
+        H, S, V = (float(value) for value in lines[1].split()[:3])
+        cp = [ float(value) for value in lines[2].split()[:4] ]
+        eos = lines[3].split()
+        params = OrderedDict([("formula", formula), ("H", H), ("S", S), ("V", V), ("cp", cp),
+                              ("alpha", float(eos[0])), ("K", float(eos[1])),
+                              ("Kp", float(eos[2])), ("Kpp", float(eos[3])),
+                              ("dKdT", 0.), ("landau", None), ("bw", None)])
+        flag = eos[4]
+        if len(eos) == 6 and flag not in ("0", "1", "2", "-1"):
+            params["type"] = _LIQUID
+            params["dKdT"] = float(eos[4])
+        elif flag == "-1":
+            params["type"] = _AQUEOUS
+        elif params["V"] == 0. and params["K"] == 0.:
+            params["type"] = _GAS
+        else:
+            params["type"] = _SOLID
+            if flag == "1":
+                params["landau"] = [ float(value) for value in eos[5:8] ]
+            elif flag == "2":
+                params["bw"] = [ float(value) for value in eos[5:11] ]
+        params["atoms"] = sum(amount for element, amount in formula.items() if element != "e")
+        self.endmembers[name] = params
+
+    def __contains__(self, name):
+        return name in self.endmembers
+
+    def formula(self, name):
+        """
+        Returns the formula of end-member `name` as a dictionary of
+        element amounts.
+        """
+        return OrderedDict(self.endmembers[name]["formula"])
+
+    def _select(self, names):
+        if isinstance(names, str):
+            names = names.split()
+        missing = [ name for name in names if name not in self.endmembers ]
+        if missing:
+            raise RuntimeError("End-members {} not found in dataset '{}'.".format(missing, self.path))
+        unsupported = [ name for name in names if self.endmembers[name]["type"] == _AQUEOUS ]
+        if unsupported:
+            raise RuntimeError("Aqueous species {} are not supported.".format(unsupported))
+        return list(names)
+
+    def gibbs(self, names, P, T):
+        """
+        Evaluates end-member Gibbs energies.
+
+        Params
+        ------
+        names: str, list
+            End-member names.
+        P: float, array_like
+            Pressure (kbar).
+        T: float, array_like
+            Temperature (°C). Must be broadcastable against `P`.
+
+        Returns
+        -------
+        G: numpy.ndarray
+            Gibbs energies (kJ/mol) of shape `broadcast(P,T).shape + (len(names),)`.
+        """
+        names = self._select(names)
+        P, T = np.broadcast_arrays(np.asarray(P, dtype=float), np.asarray(T, dtype=float) + 273.15)
+        return self._gibbs(names, P[...,np.newaxis], T[...,np.newaxis])
+
+    def properties(self, names, P, T, dP=1e-4, dT=1e-2):
+        """
+        Evaluates end-member Gibbs energy, enthalpy, entropy and volume.
+
+        Params
+        ------
+        names: str, list
+            End-member names.
+        P: float, array_like
+            Pressure (kbar).
+        T: float, array_like
+            Temperature (°C). Must be broadcastable against `P`.
+        dP, dT: float
+            Central difference steps used to evaluate volume (relative to
+            pressure, or in kbar below 1 kbar) and entropy (°C).
+
+        Returns
+        -------
+        properties: dict
+            Dictionary of `G`, `H`, `S` and `V` arrays, each of shape
+            `broadcast(P,T).shape + (len(names),)`.
+        """
+        names = self._select(names)
+        P, T = np.broadcast_arrays(np.asarray(P, dtype=float), np.asarray(T, dtype=float) + 273.15)
+        P = P[...,np.newaxis]
+        T = T[...,np.newaxis]
+        G = self._gibbs(names, P, T)
+        S = -(self._gibbs(names, P, T + dT) - self._gibbs(names, P, T - dT))/(2.*dT)
+        # one-sided differences where the step would cross zero pressure
+        h = dP*np.maximum(P, 1.)
+        low = np.maximum(P - h, 0.)
+        V = (self._gibbs(names, P + h, T) - self._gibbs(names, low, T))/(P + h - low)
+        return OrderedDict([("G", G), ("H", G + T*S), ("S", S), ("V", V)])
+
+    def reaction_gibbs(self, reaction, P, T):
+        """
+        Evaluates the Gibbs energy change of a reaction.
+
+        Params
+        ------
+        reaction: dict
+            Stoichiometric coefficients keyed by end-member, negative for
+            reactants. For example `{"ky":-1, "sill":1}`.
+        P, T: float, array_like
+            Pressure (kbar) and temperature (°C).
+
+        Returns
+        -------
+        dG: numpy.ndarray
+            Reaction Gibbs energy (kJ).
+        """
+        names = list(reaction.keys())
+        coefficients = np.array([ float(reaction[name]) for name in names ])
+        return self.gibbs(names, P, T) @ coefficients
+
+    def reaction_temperature(self, reaction, P, T_range=(200., 1500.), tol=1e-3):
+        """
+        Locates the temperature at which `reaction` is at equilibrium for
+        each provided pressure, by vectorised bisection. Pressures for
+        which the reaction does not change sign within `T_range` return NaN.
+
+        Params
+        ------
+        reaction: dict
+            Stoichiometric coefficients keyed by end-member.
+        P: float, array_like
+            Pressure (kbar).
+        T_range: tuple
+            Temperature interval (°C) searched.
+        tol: float
+            Temperature tolerance (°C).
+
+        Returns
+        -------
+        T: numpy.ndarray
+            Equilibrium temperatures (°C).
+        """
+        P = np.asarray(P, dtype=float)
+        low = np.full(P.shape, float(T_range[0]))
+        high = np.full(P.shape, float(T_range[1]))
+        g_low = self.reaction_gibbs(reaction, P, low)
+        valid = np.sign(g_low) != np.sign(self.reaction_gibbs(reaction, P, high))
+        while np.any(high - low > tol):
+            mid = 0.5*(low + high)
+            g_mid = self.reaction_gibbs(reaction, P, mid)
+            lower = np.sign(g_mid) == np.sign(g_low)
+            low = np.where(lower, mid, low)
+            g_low = np.where(lower, g_mid, g_low)
+            high = np.where(lower, high, mid)
+        return np.where(valid, 0.5*(low + high), np.nan)
+
+    def _parameters(self, names, key):
+        return np.array([ self.endmembers[name][key] for name in names ], dtype=float)
+
+    def _gibbs(self, names, P, T):
+        """
+        Gibbs energy for pressures `P` (kbar) and temperatures `T` (K),
+        broadcast against the end-member axis.
+        """
+        types = np.array([ self.endmembers[name]["type"] for name in names ])
+        if np.any(P < 0.):
+            raise RuntimeError("Pressures must not be negative.")
+        if np.any(types == _GAS) and np.any(P <= 0.):
+            raise RuntimeError("Gas species require positive pressures, as their Gibbs energy diverges as P tends to zero.")
+        shape = np.broadcast(P, T).shape[:-1] + (len(names),)
+        G = np.empty(shape)
+        P = np.broadcast_to(P, shape[:-1] + (1,))
+        T = np.broadcast_to(T, shape[:-1] + (1,))
+        for kind, function in ((_SOLID, _solid_gibbs), (_LIQUID, _liquid_gibbs), (_GAS, _gas_gibbs)):
+            index = np.nonzero(types == kind)[0]
+            if len(index):
+                selected = [ names[i] for i in index ]
+                G[...,index] = _reference_gibbs(self, selected, T) + function(self, selected, P, T)
+        return G
+
+
+def _reference_gibbs(ds, names, T):
+    """
+    Gibbs energy at the reference pressure from the heat capacity polynomial.
+    """
+    H0 = ds._parameters(names, "H")
+    S0 = ds._parameters(names, "S")
+    a, b, c, d = ds._parameters(names, "cp").T
+    cp_int = a*(T - TR) + 0.5*b*(T*T - TR*TR) - c*(1./T - 1./TR) + 2.*d*(np.sqrt(T) - np.sqrt(TR))
+    cp_t_int = a*np.log(T/TR) + b*(T - TR) - 0.5*c*(1./(T*T) - 1./(TR*TR)) - 2.*d*(1./np.sqrt(T) - 1./np.sqrt(TR))
+    return H0 + cp_int - T*(S0 + cp_t_int)
+
+
+def _tait_constants(K, Kp, Kpp):
+    a = (1. + Kp)/(1. + Kp + K*Kpp)
+    b = Kp/K - Kpp/(1. + Kp)
+    c = (1. + Kp + K*Kpp)/(Kp*Kp + Kp - K*Kpp)
+    return a, b, c
+
+
+def _solid_gibbs(ds, names, P, T):
+    """
+    Pressure contribution (modified Tait with thermal pressure) plus
+    order-disorder contributions for solids.
+    """
+    V0 = ds._parameters(names, "V")
+    alpha = ds._parameters(names, "alpha")
+    K = ds._parameters(names, "K")
+    a, b, c = _tait_constants(K, ds._parameters(names, "Kp"), ds._parameters(names, "Kpp"))
+    theta = 10636./(ds._parameters(names, "S")*1000./ds._parameters(names, "atoms") + 6.44)
+    u0 = theta/TR
+    xi0 = u0*u0*np.exp(u0)/np.expm1(u0)**2
+    Pth = alpha*K*theta/xi0*(1./np.expm1(theta/T) - 1./np.expm1(u0))
+    # the Tait integral, arranged without division by `P` so that it
+    # vanishes smoothly as `P` tends to zero
+    G = P*V0*(1. - a) + a*V0*((1. - b*Pth)**(1. - c) - (1. + b*(P - Pth))**(1. - c))/(b*(c - 1.))
+
+    for i, name in enumerate(names):
+        params = ds.endmembers[name]
+        if params["landau"] is not None:
+            G[...,i] += _landau_gibbs(P[...,0], T[...,0], *params["landau"])
+        elif params["bw"] is not None:
+            G[...,i] += _bragg_williams_gibbs(P[...,0], T[...,0], *params["bw"])
+    return G
+
+
+def _liquid_gibbs(ds, names, P, T):
+    """
+    Pressure contribution for liquids, using a modified Tait equation of
+    state with temperature dependent bulk modulus.
+    """
+    V0 = ds._parameters(names, "V")
+    alpha = ds._parameters(names, "alpha")
+    K = ds._parameters(names, "K") + ds._parameters(names, "dKdT")*(T - TR)
+    a, b, c = _tait_constants(K, ds._parameters(names, "Kp"), ds._parameters(names, "Kpp"))
+    V1 = V0*(1. + alpha*(T - TR) - 20.*alpha*(np.sqrt(T) - np.sqrt(TR)))
+    return P*V1*(1. - a) + a*V1*(1. - (1. + b*P)**(1. - c))/(b*(c - 1.))
+
+
+def _landau_gibbs(P, T, Tc0, Smax, Vmax):
+    """
+    Landau contribution, relative to the ordered state at the reference conditions.
+    """
+    Q0 = np.power(max(Tc0 - TR, 0.)/Tc0, 0.25)
+    Tc = Tc0 + Vmax/Smax*(P - PR)
+    Q = np.power(np.clip(Tc - T, 0., None)/Tc0, 0.25)
+    return Tc0*Smax*(Q0**2 - Q0**6/3.) - Smax*(Tc*Q**2 - Tc0*Q**6/3.) \
+           - T*Smax*(Q0**2 - Q**2) + (P - PR)*Vmax*Q0**2
+
+
+def _bragg_williams_gibbs(P, T, dH, dV, W, Wv, n, factor, iterations=60):
+    """
+    Bragg-Williams contribution relative to the fully ordered state, with
+    the equilibrium order parameter found by vectorised bisection.
+    """
+    f0, f1 = (factor, factor) if factor > 0. else (1., -factor)
+    dH = dH + P*dV
+    W = W + P*Wv
+    tiny = 1e-12
+
+    def fractions(Q):
+        return ((1. + n*Q)/(n + 1.), n*(1. - Q)/(n + 1.), (1. - Q)/(n + 1.), (n + Q)/(n + 1.))
+
+    def entropy(Q):
+        xA1, xB1, xA2, xB2 = (np.clip(x, tiny, None) for x in fractions(Q))
+        return -R*(f0*(xA1*np.log(xA1) + xB1*np.log(xB1)) + f1*n*(xA2*np.log(xA2) + xB2*np.log(xB2)))
+
+    def gradient(Q):
+        xA1, xB1, xA2, xB2 = (np.clip(x, tiny, None) for x in fractions(Q))
+        dS = -R*n/(n + 1.)*(f0*np.log(xA1/xB1) + f1*np.log(xB2/xA2))
+        return -dH + W*(1. - 2.*Q) - T*dS
+
+    def gibbs(Q):
+        return (1. - Q)*dH + W*Q*(1. - Q) - T*entropy(Q)
+
+    # bracket the most ordered local minimum on a coarse grid, refine it by
+    # bisection, then compare against the fully disordered state
+    grid = np.linspace(0., 1. - tiny, 33)
+    gradients = np.stack([ gradient(Q)*np.ones(np.broadcast(P, T).shape) for Q in grid ], axis=-1)
+    rising = (gradients[...,:-1] < 0.) & (gradients[...,1:] >= 0.)
+    last = np.where(rising.any(axis=-1), rising.shape[-1] - 1 - np.argmax(rising[...,::-1], axis=-1), -1)
+    low = grid[np.clip(last, 0, None)]
+    high = grid[np.clip(last, 0, None) + 1]
+    for i in range(iterations):
+        mid = 0.5*(low + high)
+        negative = gradient(mid) < 0.
+        low = np.where(negative, mid, low)
+        high = np.where(negative, high, mid)
+    Q = np.where(last >= 0, 0.5*(low + high), 0.)
+    return np.minimum(gibbs(Q), gibbs(np.zeros_like(Q)))
+
+
+def _gas_gibbs(ds, names, P, T):
+    """
+    Pressure contribution `RT ln f` for gas species.
+    """
+    G = np.empty(np.broadcast(P, T).shape[:-1] + (len(names),))
+    for i, name in enumerate(names):
+        if name == "H2O":
+            G[...,i] = _h2o_rtlnf(P[...,0], T[...,0])
+        elif name in CRITICAL_CONSTANTS:
+            G[...,i] = _cork_rtlnf(P[...,0], T[...,0], *CRITICAL_CONSTANTS[name])
+        else:
+            G[...,i] = R*T[...,0]*np.log(P[...,0]/PR)
+    return G
+
+
+def _cork_rtlnf(P, T, Tc, Pc):
+    """
+    Corresponding states CORK (Holland & Powell 1991, 1998).
+    """
+    a = 5.45963e-5*Tc**2.5/Pc - 8.63920e-6*Tc**1.5/Pc*T
+    b = 9.18301e-4*Tc/Pc
+    c = -3.30558e-5*Tc/Pc**1.5 + 2.30524e-6/Pc**1.5*T
+    d = 6.93054e-7*Tc/Pc**2 - 8.38293e-8/Pc**2*T
+    RT = R*T
+    return RT*np.log(P/PR) + b*P + a/(b*np.sqrt(T))*(np.log(RT + b*P) - np.log(RT + 2.*b*P)) \
+           + 2./3.*c*P*np.sqrt(P) + 0.5*d*P*P
+
+
+# Holland & Powell (1991) H2O CORK constants
+_H2O_A = (1113.4, -0.88517, 4.5300e-3, -1.3183e-5, -0.22291, -3.8022e-4, 1.7791e-7, 5.8487, -2.1370e-2, 6.8133e-5)
+_H2O_B = 1.465
+_H2O_C = (-3.025650e-2, -5.343144e-6)
+_H2O_D = (-3.2297554e-3, 2.2215221e-6)
+_H2O_TC = 695.
+_H2O_P0 = 2.
+
+
+def _mrk_lnf(P, T, a, b, root):
+    """
+    Modified Redlich-Kwong `ln f` (f in kbar), using the largest (`root="gas"`)
+    or smallest (`root="liquid"`) physical volume root.
+    """
+    sqT = np.sqrt(T)
+    RT = R*T
+    # P V^3 - RT V^2 - (b^2 P + bRT - a/sqrt(T)) V - ab/sqrt(T) = 0
+    coefficients = np.stack(np.broadcast_arrays(P, -RT, -(b*b*P + b*RT - a/sqT), -a*b/sqT), axis=-1)
+    V = _cubic_roots(coefficients)
+    physical = np.isfinite(V) & (V > b)
+    if root == "gas":
+        V = np.max(np.where(physical, V, -np.inf), axis=-1)
+    else:
+        V = np.min(np.where(physical, V, np.inf), axis=-1)
+    Z = P*V/RT
+    B = b*P/RT
+    return np.log(P) + Z - 1. - np.log(Z - B) - a/(b*R*T*sqT)*np.log(1. + B/Z)
+
+
+def _cubic_roots(coefficients):
+    """
+    Real roots of cubics `c0 x^3 + c1 x^2 + c2 x + c3`, vectorised over the
+    leading axes. Complex roots are returned as NaN.
+    """
+    c0, c1, c2, c3 = np.moveaxis(coefficients, -1, 0)
+    p1, p2, p3 = c1/c0, c2/c0, c3/c0
+    q = (3.*p2 - p1*p1)/9.
+    r = (9.*p1*p2 - 27.*p3 - 2.*p1**3)/54.
+    disc = q**3 + r*r
+    roots = np.full(p1.shape + (3,), np.nan)
+    # three real roots
+    three = disc <= 0.
+    theta = np.arccos(np.clip(np.where(three, r/np.sqrt(np.where(three, -q**3, 1.)), 0.), -1., 1.))
+    sq = 2.*np.sqrt(np.where(three, -q, 0.))
+    for k in range(3):
+        roots[...,k] = np.where(three, sq*np.cos((theta + 2.*np.pi*k)/3.) - p1/3., roots[...,k])
+    # single real root
+    sqd = np.sqrt(np.where(three, 0., disc))
+    single = np.cbrt(r + sqd) + np.cbrt(r - sqd) - p1/3.
+    roots[...,0] = np.where(three, roots[...,0], single)
+    return roots
+
+
+def _h2o_rtlnf(P, T):
+    """
+    `RT ln f` for H2O from the Holland & Powell (1991) CORK, relative to
+    the 1 bar standard state.
+    """
+    P, T = np.broadcast_arrays(np.asarray(P, dtype=float), np.asarray(T, dtype=float))
+    A = _H2O_A
+    dT = _H2O_TC - T
+    a_gas = A[0] + A[7]*dT + A[8]*dT**2 + A[9]*dT**3
+    a_liq = A[0] + A[1]*dT + A[2]*dT**2 + A[3]*dT**3
+    a_sup = A[0] - A[4]*dT + A[5]*dT**2 - A[6]*dT**3
+    psat = -13.627e-3 + 7.29395e-7*T**2 - 2.34622e-9*T**3 + 4.83607e-15*T**5
+    subcritical = T < _H2O_TC
+    above_sat = subcritical & (P > psat)
+    psat = np.where(above_sat, psat, P)
+
+    lnf = np.where(subcritical,
+                   _mrk_lnf(psat, T, a_gas, _H2O_B, "gas"),
+                   _mrk_lnf(P, T, a_sup, _H2O_B, "gas"))
+    liquid = _mrk_lnf(P, T, a_liq, _H2O_B, "liquid") - _mrk_lnf(psat, T, a_liq, _H2O_B, "liquid")
+    lnf = np.where(above_sat, lnf + liquid, lnf)
+
+    RT = R*T
+    excess = np.clip(P - _H2O_P0, 0., None)
+    c = _H2O_C[0] + _H2O_C[1]*T
+    d = _H2O_D[0] + _H2O_D[1]*T
+    return RT*(lnf - np.log(PR)) + 2./3.*c*excess**1.5 + 0.5*d*excess**2
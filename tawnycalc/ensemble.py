@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Monte Carlo bulk composition ensembles.
+
+Analytical uncertainty in whole-rock compositions is propagated by
+executing `thermocalc` for many perturbed bulk compositions. Rather than
+retaining every result, the ensemble streams results into fixed size
+statistics accumulators, so that memory usage is independent of the
+number of ensemble members:
+
+>>> import tawnycalc.ensemble as ensemble
+>>> stats = ensemble.run(context, bulk, sigma, n=10000, P=11., T=600.)
+>>> stats.mean()
+>>> stats.quantiles((0.05,0.5,0.95))
+>>> stats.assemblages()
+
+"""
+from collections import OrderedDict, Counter
+import numpy as np
+
+from . import bulk as _bulk
+from .runner import Runner, pt_task, assemblage
+
+
+def sample_bulk(bulk, sigma, n, distribution="normal", rng=None):
+    """
+    Draws perturbed bulk compositions.
+
+    Each oxide is perturbed independently using its `sigma`, with negative
+    values clipped to zero. Samples are then renormalised to the total of
+    `bulk`, so that closure is preserved.
+
+    Params
+    ------
+    bulk: array_like
+        The reference bulk composition.
+    sigma: float, array_like
+        Per-oxide standard deviation, in the units of `bulk`.
+    n: int
+        Number of compositions to draw.
+    distribution: str
+        Either `"normal"` for additive perturbations, or `"lognormal"` for
+        multiplicative perturbations with relative deviation `sigma/bulk`.
+    rng: numpy.random.Generator, int
+        Random generator or seed.
+
+    Returns
+    -------
+    samples: numpy.ndarray
+        Array of compositions with shape `(n, n_oxides)`.
+    """
+    bulk = np.asarray(bulk, dtype=float)
+    sigma = np.broadcast_to(np.asarray(sigma, dtype=float), bulk.shape)
+    rng = np.random.default_rng(rng)
+    z = rng.standard_normal((int(n),) + bulk.shape)
+    if distribution == "normal":
+        samples = bulk + sigma*z
+    elif distribution == "lognormal":
+        relative = np.divide(sigma, bulk, out=np.zeros_like(bulk), where=bulk > 0.)
+        samples = bulk*np.exp(relative*z - 0.5*relative**2)
+    else:
+        raise RuntimeError("Unknown distribution '{}'. Use 'normal' or 'lognormal'.".format(distribution))
+    return _bulk.normalise(np.clip(samples, 0., None), bulk.sum())
+
+
+class statistics(object):
+    """
+    Streaming statistics accumulator for ensemble results.
+
+    Mode means and variances are accumulated as running sums, and mode
+    quantiles are estimated from fixed bin histograms over the `[0,1]`
+    interval. Phases absent from a given result contribute a zero mode.
+    Memory usage is therefore independent of the number of results added.
+
+    Params
+    ------
+    bins: int
+        Number of histogram bins used for quantile estimation. Quantiles
+        are resolved to `1/bins`.
+    """
+    def __init__(self, bins=1000):
+        self.bins = int(bins)
+        self.count = 0
+        self.failures = 0
+        self._sum = OrderedDict()
+        self._sumsq = OrderedDict()
+        self._hist = OrderedDict()
+        self._assemblages = Counter()
+
+    def add(self, results):
+        """
+        Adds results to the accumulator.
+
+        Params
+        ------
+        results: dict
+            Results returned from `Context.execute()`, or `None` to record
+            a failed execution.
+        """
+        if results is None or "modes" not in results:
+            self.failures += 1
+            return
+        self.count += 1
+        self._assemblages[assemblage(results)] += 1
+        for phase, mode in results["modes"].items():
+            if phase not in self._sum:
+                self._sum[phase] = 0.
+                self._sumsq[phase] = 0.
+                self._hist[phase] = np.zeros(self.bins, dtype=np.int64)
+            mode = float(mode)
+            self._sum[phase] += mode
+            self._sumsq[phase] += mode*mode
+            self._hist[phase][min(max(int(mode*self.bins), 0), self.bins-1)] += 1
+
+    def merge(self, other):
+        """
+        Merges another accumulator into this one.
+        """
+        if other.bins != self.bins:
+            raise RuntimeError("Unable to merge statistics with differing bin counts.")
+        self.count += other.count
+        self.failures += other.failures
+        self._assemblages.update(other._assemblages)
+        for phase in other._sum:
+            if phase not in self._sum:
+                self._sum[phase] = 0.
+                self._sumsq[phase] = 0.
+                self._hist[phase] = np.zeros(self.bins, dtype=np.int64)
+            self._sum[phase] += other._sum[phase]
+            self._sumsq[phase] += other._sumsq[phase]
+            self._hist[phase] += other._hist[phase]
+
+    def mean(self):
+        """
+        Returns the mean mode of each phase.
+        """
+        return OrderedDict((phase, total/max(self.count, 1)) for phase, total in self._sum.items())
+
+    def std(self):
+        """
+        Returns the standard deviation of the mode of each phase.
+        """
+        n = max(self.count, 1)
+        return OrderedDict((phase, np.sqrt(max(self._sumsq[phase]/n - (total/n)**2, 0.)))
+                           for phase, total in self._sum.items())
+
+    def quantiles(self, q=(0.05, 0.5, 0.95)):
+        """
+        Returns estimated mode quantiles for each phase.
+
+        Params
+        ------
+        q: float, list
+            Quantile(s) to evaluate, within `[0,1]`.
+
+        Returns
+        -------
+        quantiles: dict
+            Dictionary of quantile arrays, keyed by phase.
+        """
+        q = np.atleast_1d(np.asarray(q, dtype=float))
+        edges = np.linspace(0., 1., self.bins+1)
+        quantiles = OrderedDict()
+        for phase, hist in self._hist.items():
+            counts = hist.copy()
+            counts[0] += self.count - hist.sum()   # absent phase records zero mode
+            cumulative = np.concatenate(([0.], np.cumsum(counts)/max(self.count, 1)))
+            quantiles[phase] = np.interp(q, cumulative, edges)
+        return quantiles
+
+    def assemblages(self):
+        """
+        Returns the frequency of each assemblage amongst successful results.
+        """
+        return OrderedDict((key, value/max(self.count, 1)) for key, value in self._assemblages.most_common())
+
+    def __repr__(self):
+        from tabulate import tabulate
+        mean, std = self.mean(), self.std()
+        rows = [ [phase, mean[phase], std[phase]] + list(values) for phase, values in self.quantiles().items() ]
+        return "members: {}  failures: {}\n".format(self.count, self.failures) + \
+               tabulate(rows, headers=["phase", "mean", "std", "q05", "q50", "q95"], tablefmt="plain")
+
+
+def run(context, bulk, sigma, n, P=None, T=None, path=None, distribution="normal",
+        seed=None, workers=None, chunk=1000, bins=1000, **execute_kwargs):
+    """
+    Executes a Monte Carlo ensemble of perturbed bulk compositions.
+
+    Each ensemble member is supplied to `thermocalc` via a `setbulk` script
+    entry, replacing any `rbi` entry of the context. Compositions are drawn
+    in chunks as required, and results are accumulated into `statistics`
+    objects as they complete, so memory usage remains flat for large
+    ensembles.
+
+    Params
+    ------
+    context: tawnycalc.Context
+        The model configuration.
+    bulk: array_like
+        The reference bulk composition, ordered as per the model oxides.
+    sigma: float, array_like
+        Per-oxide standard deviation. Refer to `sample_bulk`.
+    n: int
+        Number of ensemble members.
+    P, T: float
+        Pressure and temperature for a single point calculation.
+    path: list
+        Alternatively, a list of `(P,T)` tuples. Each member is
+        executed at every point along the path.
+    distribution: str
+        Sampling distribution. Refer to `sample_bulk`.
+    seed: int
+        Random seed.
+    workers: int
+        Number of concurrent executions.
+    chunk: int
+        Number of compositions drawn at a time.
+    bins: int
+        Histogram bins used for quantile estimation.
+    execute_kwargs:
+        Further arguments are passed through to `Context.execute()`.
+
+    Returns
+    -------
+    stats: statistics, list
+        A `statistics` object, or for `path` calculations, a list of
+        `statistics` objects ordered as per `path`.
+    """
+    if path is None:
+        if P is None or T is None:
+            raise RuntimeError("Either 'P' and 'T', or 'path' must be specified.")
+        points = [(P,T)]
+    else:
+        points = list(path)
+    rng = np.random.default_rng(seed)
+
+    def tasks():
+        remaining = int(n)
+        while remaining > 0:
+            samples = sample_bulk(bulk, sigma, min(chunk, remaining), distribution, rng)
+            remaining -= len(samples)
+            for setbulk in _bulk.setbulk(samples):
+                for P, T in points:
+                    yield pt_task(P, T, setbulk=setbulk, rbi=None)
+
+    stats = [ statistics(bins) for point in points ]
+    with Runner(context, workers) as runner:
+        for outcome in runner.imap_unordered(tasks(), **execute_kwargs):
+            stats[outcome.index % len(points)].add(outcome.results)
+
+    if path is None:
+        return stats[0]
+    return stats
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Detection of failing `thermocalc` executions.
+
+Failure detectors are applied to `thermocalc` standard output as it is
+streamed during `Context.execute()`. Where a detector matches, the process
+is terminated early and the returned results record the classified reason
+in their `failure` entry:
+
+>>> from tawnycalc.failures import DEFAULT_DETECTORS
+>>> results = context.execute(detectors=DEFAULT_DETECTORS, timeout=60.)
+>>> results.failure
+'bad_guess'
+
+Custom detectors may be constructed from regular expressions or from
+arbitrary predicates on each line of output:
+
+>>> slow = detector("no_assemblage", predicate=lambda line: "dogmin" in line, count=50)
+"""
+import re
+
+BAD_GUESS = "bad_guess"
+NO_ASSEMBLAGE = "no_assemblage"
+DATASET_ERROR = "dataset_error"
+TIMEOUT = "timeout"
+
+
+class detector(object):
+    """
+    Failure detector for lines of `thermocalc` output.
+
+    Params
+    ------
+    reason: str
+        Failure classification recorded where the detector triggers.
+    pattern: str
+        Regular expression searched for within each line (case insensitive).
+    predicate: callable
+        Alternatively, a function accepting a line of output and returning
+        `True` where it matches.
+    count: int
+        Number of matching lines required before the detector triggers.
+    """
+    def __init__(self, reason, pattern=None, predicate=None, count=1):
+        if (pattern is None) == (predicate is None):
+            raise RuntimeError("Exactly one of 'pattern' or 'predicate' must be provided.")
+        self.reason = reason
+        self.pattern = re.compile(pattern, re.IGNORECASE) if pattern is not None else None
+        self.predicate = predicate
+        self.count = int(count)
+
+    def matches(self, line):
+        """
+        Returns `True` where `line` matches this detector.
+        """
+        if self.pattern is not None:
+            return self.pattern.search(line) is not None
+        return bool(self.predicate(line))
+
+    def __repr__(self):
+        test = self.pattern.pattern if self.pattern is not None else self.predicate
+        return "detector({!r}, {!r}, count={})".format(self.reason, test, self.count)
+
+
+# Note that these patterns are heuristics which have not been validated
+# against a comprehensive set of `thermocalc` outputs, so they are not
+# applied unless explicitly requested. Check them against logs of your own
+# models (for example using `classify()`) before relying on them.
+DEFAULT_DETECTORS = [
+    detector(DATASET_ERROR, r"(cannot|can't|unable to) (open|find|read)|error (reading|in) (the )?(dataset|axfile|a-x file|scriptfile)|unknown (phase|end-?member)"),
+    detector(BAD_GUESS,     r"(failed|fails|unable) to converge|did not converge|non-?convergence|no convergence|singular", count=3),
+    detector(NO_ASSEMBLAGE, r"no (stable )?(assemblage|solution)s?( found)?|nothing (found|stable)", count=3),
+]
+
+
+class monitor(object):
+    """
+    Applies detectors to a stream of output lines, tracking match counts.
+    A new monitor should be used for each execution.
+    """
+    def __init__(self, detectors):
+        self.detectors = list(detectors or [])
+        self.counts = [0]*len(self.detectors)
+        self.failure = None
+
+    def __call__(self, line):
+        """
+        Processes a line of output, returning the failure reason where a
+        detector triggers, and `None` otherwise.
+        """
+        if self.failure is None:
+            for i, item in enumerate(self.detectors):
+                if item.matches(line):
+                    self.counts[i] += 1
+                    if self.counts[i] >= item.count:
+                        self.failure = item.reason
+                        break
+        return self.failure
+
+
+def classify(text, detectors=DEFAULT_DETECTORS):
+    """
+    Classifies previously recorded output, returning the failure reason of
+    the first detector to trigger, or `None`.
+
+    Params
+    ------
+    text: str
+        Output text, for example `results.output_stdout`.
+    detectors: list
+        Detectors to apply.
+    """
+    watch = monitor(detectors)
+    for line in text.splitlines():
+        if watch(line):
+            break
+    return watch.failure
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent library of converged starting guesses.
+
+Converged `xyz` values are recorded against the pressure, temperature,
+bulk composition and assemblage at which they were obtained. Before
+subsequent executions, the nearest compatible entry is injected into the
+script as `ptguess` and `xyzguess` entries:
+
+>>> library = GuessLibrary("guesses.sqlite")
+>>> runner = Runner(context, guess_library=library)
+
+The library is stored in an SQLite database, so it may be shared between
+processes and sessions. Its size is bounded, with the least recently
+used entries evicted first. Nearest neighbour queries are performed using
+a KD-tree (`scipy.spatial.cKDTree` where available, otherwise a vectorised
+brute force search) over scaled pressure, temperature and composition.
+"""
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from .runner import assemblage as _assemblage
+
+
+def script_point(script):
+    """
+    Returns the pressure, temperature and bulk composition described by
+    a script.
+
+    Pressure and temperature are taken as the centres of the `setPwindow`
+    and `setTwindow` entries. The bulk composition is taken from the
+    `setbulk` entry where present, otherwise from the `rbi` entry.
+
+    Params
+    ------
+    script: dict
+        The script, for example `Context.script`.
+
+    Returns
+    -------
+    P, T: float
+        Pressure and temperature, or `None` where unavailable.
+    bulk: numpy.ndarray
+        Bulk composition normalised to unity, or `None` where unavailable.
+    """
+    def centre(key):
+        try:
+            values = [ float(value) for value in str(script[key]).split() ]
+            return 0.5*(values[0] + values[-1])
+        except (KeyError, ValueError, IndexError):
+            return None
+    bulk = None
+    try:
+        if "setbulk" in script:
+            values = [ float(value) for value in str(script["setbulk"]).split() if value not in ("yes", "no") ]
+            bulk = np.array(values)
+        elif "rbi" in script:
+            from .bulk import from_rbi
+            bulk = from_rbi(script["rbi"])
+        if bulk is not None:
+            bulk = bulk/bulk.sum()
+    except (ValueError, RuntimeError, ZeroDivisionError):
+        bulk = None
+    return centre("setPwindow"), centre("setTwindow"), bulk
+
+
+def script_phases(script):
+    """
+    Returns the set of phases a script may produce, from its `which`,
+    `inexcess` and `samecoding` entries.
+    """
+    phases = set()
+    for key in ("which", "inexcess", "samecoding"):
+        values = script.get(key) or []
+        if not isinstance(values, list):
+            values = [values,]
+        for value in values:
+            phases.update(str(value).split())
+    return phases
+
+
+class _group(object):
+    """
+    Nearest neighbour index over the entries of a single assemblage.
+
+    Features are stored in an array whose capacity grows geometrically, so
+    appending is amortised constant time. The KD-tree covers only a prefix
+    of the entries, and is rebuilt once the unindexed tail exceeds a
+    fraction of the indexed entries. Queries search the tree and then the
+    tail by brute force, so the cost of rebuilding is amortised over many
+    appends.
+    """
+    # minimum unindexed entries before the tree is rebuilt
+    min_tail = 64
+    # unindexed entries, as a fraction of indexed entries, before the tree is rebuilt
+    tail_fraction = 0.25
+
+    def __init__(self):
+        self.ids = []
+        self._array = np.zeros((16, 0))
+        self._tree = None
+        self._indexed = 0
+
+    def append(self, id, features):
+        features = np.asarray(features, dtype=float)
+        size, width = len(self.ids), self._array.shape[1]
+        if len(features) > width or size == len(self._array):
+            # shorter features are padded with zeros, so widening invalidates the tree
+            if len(features) > width:
+                self._tree, self._indexed = None, 0
+            array = np.zeros((max(2*len(self._array), 16) if size == len(self._array) else len(self._array),
+                              max(width, len(features))))
+            array[:size,:width] = self._array[:size]
+            self._array = array
+        self._array[size,:len(features)] = features
+        self._array[size,len(features):] = 0.
+        self.ids.append(id)
+
+    def _index(self):
+        """
+        Rebuilds the KD-tree where the unindexed tail has grown too large.
+        Returns the tree, or `None` where scipy is unavailable.
+        """
+        size = len(self.ids)
+        if self._tree is False:
+            return None
+        if self._tree is None or size - self._indexed > max(self.min_tail, self.tail_fraction*self._indexed):
+            try:
+                from scipy.spatial import cKDTree
+            except ImportError:
+                self._tree = False
+                return None
+            self._tree = cKDTree(self._array[:size].copy())
+            self._indexed = size
+        return self._tree
+
+    def query(self, features):
+        """
+        Returns `(distance, id)` for the entry nearest `features`. Where
+        `features` is shorter than the stored features, only the leading
+        dimensions are considered.
+        """
+        size, width = len(self.ids), self._array.shape[1]
+        features = np.asarray(features, dtype=float)[:width]
+        start = 0
+        best = (np.inf, None)
+        if len(features) == width:
+            tree = self._index()
+            if tree is not None:
+                distance, i = tree.query(features)
+                best = (distance, int(i))
+                start = self._indexed
+        if start < size:
+            distances = np.linalg.norm(self._array[start:size,:len(features)] - features, axis=1)
+            i = int(np.argmin(distances))
+            if distances[i] < best[0]:
+                best = (distances[i], start + i)
+        return best[0], self.ids[best[1]]
+
+
+class GuessLibrary(object):
+    """
+    Persistent, bounded library of converged starting guesses.
+
+    Params
+    ------
+    path: str
+        SQLite database file. Created if it does not exist.
+    max_entries: int
+        Maximum number of entries retained.
+    scale: tuple
+        Pressure and temperature scaling. Distances are computed in units
+        where pressure and temperature are divided by these values.
+    bulk_weight: float
+        Weighting of bulk composition differences (on a unit sum basis)
+        relative to scaled pressure and temperature differences.
+    max_distance: float
+        Entries further than this (scaled) distance are not used.
+    """
+    def __init__(self, path, max_entries=100000, scale=(1., 50.), bulk_weight=10., max_distance=None):
+        self.path = path
+        self.max_entries = int(max_entries)
+        self.scale = np.asarray(scale, dtype=float)
+        self.bulk_weight = float(bulk_weight)
+        self.max_distance = max_distance
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, timeout=60., check_same_thread=False)
+        with self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS guesses (
+                                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                    P REAL, T REAL, bulk BLOB, assemblage TEXT,
+                                    xyz TEXT, last_used REAL)""")
+        self._state = None
+        self._groups = OrderedDict()
+
+    def _features(self, P, T, bulk):
+        features = [ P/self.scale[0], T/self.scale[1] ]
+        if bulk is not None:
+            features.extend(self.bulk_weight*np.asarray(bulk, dtype=float))
+        return np.array(features)
+
+    def _refresh(self):
+        """
+        Synchronises the in-memory index with the database, which may have
+        been modified by other processes.
+        """
+        state = self._db.execute("SELECT max(id), count(*) FROM guesses").fetchone()
+        if state == self._state:
+            return
+        last_id = self._state[0] if self._state else None
+        if last_id is None or state[0] is None or self._state[1] + (state[0] - last_id) != state[1]:
+            # entries were evicted, so rebuild from scratch
+            self._groups = OrderedDict()
+            rows = self._db.execute("SELECT id, P, T, bulk, assemblage FROM guesses")
+        else:
+            rows = self._db.execute("SELECT id, P, T, bulk, assemblage FROM guesses WHERE id > ?", (last_id,))
+        for id, P, T, bulk, assemblage in rows:
+            bulk = np.frombuffer(bulk, dtype=np.float64) if bulk else None
+            self._groups.setdefault(assemblage, _group()).append(id, self._features(P, T, bulk))
+        self._state = state
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT count(*) FROM guesses").fetchone()[0]
+
+    def add(self, results, script=None):
+        """
+        Adds the converged guesses of `results` to the library.
+
+        Params
+        ------
+        results: dict
+            Results returned from `Context.execute()`.
+        script: dict
+            The script used for the execution, from which the bulk composition
+            is determined (refer to `script_point`).
+
+        Returns
+        -------
+        added: bool
+            `True` where an entry was added.
+        """
+        if results.get("failure") or not results.get("xyz") or "P" not in results or "T" not in results:
+            return False
+        bulk = script_point(script)[2] if script is not None else None
+        xyz = json.dumps([ [key, float(value)] for key, value in results["xyz"].items() ])
+        with self._lock, self._db:
+            self._db.execute("INSERT INTO guesses (P, T, bulk, assemblage, xyz, last_used) VALUES (?,?,?,?,?,?)",
+                             (float(results["P"]), float(results["T"]),
+                              bulk.astype(np.float64).tobytes() if bulk is not None else None,
+                              _assemblage(results), xyz, time.time()))
+            excess = self._db.execute("SELECT count(*) FROM guesses").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self._db.execute("DELETE FROM guesses WHERE id IN "
+                                 "(SELECT id FROM guesses ORDER BY last_used LIMIT ?)", (excess,))
+        return True
+
+    def nearest(self, P, T, bulk=None, assemblage=None, phases=None):
+        """
+        Returns the nearest compatible entry.
+
+        Params
+        ------
+        P, T: float
+            Pressure and temperature.
+        bulk: array_like
+            Bulk composition (unit sum). If not provided, only pressure and
+            temperature are considered.
+        assemblage: str
+            If provided, only entries of this assemblage are considered.
+        phases: set
+            Otherwise, if provided, only entries whose phases all lie within
+            this set are considered.
+
+        Returns
+        -------
+        entry: dict
+            Dictionary with `P`, `T`, `assemblage`, `xyz` and `distance`
+            entries, or `None` where no compatible entry exists.
+        """
+        features = self._features(P, T, bulk)
+        with self._lock:
+            self._refresh()
+            best = None
+            for key, group in self._groups.items():
+                if assemblage is not None and key != assemblage:
+                    continue
+                if assemblage is None and phases is not None and not set(key.split()) <= set(phases):
+                    continue
+                distance, id = group.query(features)
+                if best is None or distance < best[0]:
+                    best = (distance, id)
+            if best is None or (self.max_distance is not None and best[0] > self.max_distance):
+                return None
+            with self._db:
+                row = self._db.execute("SELECT P, T, assemblage, xyz FROM guesses WHERE id=?", (best[1],)).fetchone()
+                if row is None:
+                    return None
+                self._db.execute("UPDATE guesses SET last_used=? WHERE id=?", (time.time(), best[1]))
+        xyz = OrderedDict( (key, value) for key, value in json.loads(row[3]) )
+        return { "P":row[0], "T":row[1], "assemblage":row[2], "xyz":xyz, "distance":float(best[0]) }
+
+    def apply(self, context, assemblage=None):
+        """
+        Sets the `ptguess` and `xyzguess` entries of `context` from the
+        nearest compatible entry. The pressure, temperature and bulk
+        composition are determined from the context script, and entries are
+        restricted to the phases the script may produce.
+
+        Params
+        ------
+        context: tawnycalc.Context
+            The context to modify.
+        assemblage: str
+            If provided, only entries of this assemblage are considered.
+
+        Returns
+        -------
+        entry: dict
+            The applied entry (refer to `nearest`), or `None` where no
+            compatible entry was found.
+        """
+        P, T, bulk = script_point(context.script)
+        if P is None or T is None:
+            return None
+        phases = script_phases(context.script) or None
+        entry = self.nearest(P, T, bulk, assemblage=assemblage, phases=phases)
+        if entry is not None:
+            context.set_guesses(entry)
+        return entry
+
+    def close(self):
+        with self._lock:
+            self._db.close()
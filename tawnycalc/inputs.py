@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Process-wide cache of resolved executables and parsed `thermocalc` inputs.
+
+Constructing a `Context` resolves the `thermocalc` executable and parses
+`tc-prefs.txt` and the scriptfile. Where many contexts are created from
+the same scripts (for example by a web service or notebook), these are
+only resolved and parsed once per process. Parsed files are cached by
+path, modification time and size, so edited files are parsed again, and
+each context receives its own deep copy of the cached structures.
+
+Cache hits and misses are recorded to `metrics` as `executable_hits`,
+`executable_misses`, `parse_hits` and `parse_misses` counters:
+
+>>> tawnycalc.inputs.metrics.snapshot()["counters"]
+
+Contexts may also be constructed from in-memory text via
+`Context.from_text()`, for which parsed text is cached likewise.
+"""
+import os
+import copy
+import threading
+from collections import OrderedDict, defaultdict
+
+from .metrics import Metrics
+from .data_objects import xyz, rbi
+
+# maximum number of parsed inputs retained
+MAX_ENTRIES = 256
+
+metrics = Metrics()
+
+_lock = threading.Lock()
+_parsed = OrderedDict()
+_executables = {}
+
+
+def clear():
+    """
+    Empties the cache.
+    """
+    with _lock:
+        _parsed.clear()
+        _executables.clear()
+
+
+def _is_exe(path):
+    return os.path.isfile(path) and os.access(path, os.X_OK)
+
+
+def which(program):
+    """
+    Returns the path of executable `program`, searching the `PATH`
+    environment variable where `program` is not itself a path, or `None`
+    where not found. Resolved paths are cached per `PATH`, and are
+    resolved again should the executable no longer exist.
+    """
+    key = (program, os.environ.get("PATH", ""))
+    with _lock:
+        found = _executables.get(key)
+    if found is not None and _is_exe(found):
+        metrics.increment("executable_hits")
+        return found
+    metrics.increment("executable_misses")
+    found = None
+    fpath, fname = os.path.split(program)
+    if fpath:
+        if _is_exe(program):
+            found = program
+    else:
+        for path in key[1].split(os.pathsep):
+            exe_file = os.path.join(path, program)
+            if _is_exe(exe_file):
+                found = exe_file
+                break
+    if found is not None:
+        with _lock:
+            _executables[key] = found
+    return found
+
+
+def parse_prefs(lines):
+    """
+    Parses the lines of a `tc-prefs.txt` file, returning an ordered
+    dictionary of its entries.
+    """
+    prefs = OrderedDict()
+    for line in lines:
+        line = line.split("%", 1)[0]
+        splitline = line.split()
+        if len(splitline)>1:
+            prefs[splitline[0]] = splitline[1]
+    return prefs
+
+
+def parse_script(lines):
+    """
+    Parses the lines of a `thermocalc` scriptfile, returning an ordered
+    dictionary of its entries (refer to `Context.script`).
+    """
+    script = OrderedDict()
+    # keep track of repeated keys to handle differently
+    keycount = defaultdict(lambda: 0)
+    for line in lines:
+        # get rid of everything after '%'
+        line = line.split("%", 1)[0]
+        splitline = line.split()
+        if len(splitline)>0:
+            if splitline[0] == '*':                # don't read anything past here
+                break
+            key = splitline[0]
+            value = splitline[1:]
+            # now need to decide how to enter into dictionary.
+            # treat "xyzguess" as dictionary
+            if key=="xyzguess":
+                if "xyzguess" not in script.keys():
+                    script["xyzguess"] = xyz()
+                script["xyzguess"][value[0]] = value[1:]
+            elif key=="rbi":
+                if "rbi" not in script:
+                    # create `rbi` object and provide `value` for oxide columns
+                    script["rbi"] = rbi(value)
+                else:
+                    script["rbi"].add_data(value)
+            else:
+                val_count = len(value)
+                if val_count == 0:                   # if no values, just set to None
+                    value = None
+                else:
+                    value = " ".join(value)
+                    if value == 'ask':
+                        raise RuntimeError("'ask' is not supported setting from Python interface.")
+                # first check the number of times this key has been encountered
+                keycount[key]+=1                       # increment key count
+                if   keycount[key] == 1:               # if only encountered once, simply create direct pair
+                    script[key] = value
+                if keycount[key] == 2:                 # this is the second time we've encountered this key,
+                    rows = list()                      # so create a list store the rows,
+                    rows.append(script[key])           # and append previously encountered value as first item in row list.
+                    script[key] = rows                 # now replace that previous value with the rows list (which contains it).
+                                                       # note that the new value is entered in the following block.
+                if keycount[key] > 1:
+                    script[key].append(value)          # append value to rows list of values
+    return script
+
+
+_PARSERS = { "prefs":parse_prefs, "script":parse_script }
+
+
+def _copy(value):
+    """
+    Returns a deep copy of a parsed entry value. This is considerably
+    faster than `copy.deepcopy` for the structures produced by the parsers.
+    """
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, list):
+        return [ _copy(item) for item in value ]
+    if isinstance(value, rbi):
+        return value.copy()
+    if type(value) in (xyz, OrderedDict):
+        return type(value)( (key, _copy(item)) for key, item in value.items() )
+    return copy.deepcopy(value)
+
+
+def _cached(key, parse):
+    with _lock:
+        if key in _parsed:
+            _parsed.move_to_end(key)
+            parsed = _parsed[key]
+        else:
+            parsed = None
+    if parsed is not None:
+        metrics.increment("parse_hits")
+    else:
+        metrics.increment("parse_misses")
+        parsed = parse()
+        with _lock:
+            _parsed[key] = parsed
+            while len(_parsed) > MAX_ENTRIES:
+                _parsed.popitem(last=False)
+    return _copy(parsed)
+
+
+def load(kind, path):
+    """
+    Returns a copy of the parsed contents of file `path`.
+
+    Params
+    ------
+    kind: str
+        `"prefs"` for `tc-prefs.txt` files, or `"script"` for scriptfiles.
+    path: str
+        The file.
+
+    Returns
+    -------
+    parsed: OrderedDict
+        The parsed entries. The caller may modify these freely.
+    """
+    stat = os.stat(path)
+    key = (kind, os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    def parse():
+        with open(path, 'r') as fp:
+            return _PARSERS[kind](fp)
+    return _cached(key, parse)
+
+
+def loads(kind, text):
+    """
+    Returns a copy of the parsed contents of `text`. Refer to `load`.
+    """
+    return _cached((kind, None, text), lambda: _PARSERS[kind](text.splitlines()))
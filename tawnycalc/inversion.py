@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Pressure-temperature inversion against observed modes and compositions.
+
+Rather than searching a dense P-T grid by hand for the conditions which
+best reproduce measured modes and mineral compositions, `invert()`
+minimises the misfit to target values directly:
+
+>>> import tawnycalc.inversion as inversion
+>>> fit = inversion.invert(context, bounds=((8.,12.),(550.,650.)),
+...                        modes={"g":(0.05,0.01)}, xyz={"x(g)":(0.85,0.02)})
+>>> fit.P, fit.T, fit.misfit, fit.executions
+>>> plt.tricontourf(fit.points[:,1], fit.points[:,0], fit.misfits)
+
+Targets are `(value, sigma)` pairs for entries of the results `modes`,
+`xyz` or `site_fractions`, and the misfit is the sum of squared normalised
+residuals (refer to `misfit()`). Minimisation uses a parallel pattern
+search: a coarse grid is first evaluated, after which the eight compass
+and diagonal neighbours of the best point are evaluated concurrently as a
+single batch, moving to any improvement or otherwise halving the step, until
+the step falls below the requested tolerance. Repeated candidates are not
+executed again. Every evaluated point is returned with its misfit, giving
+a misfit surface concentrated around the best fit.
+"""
+from collections import namedtuple, OrderedDict
+import numpy as np
+
+from .runner import Runner, pt_task
+
+Inversion = namedtuple("Inversion", ["P", "T", "misfit", "results", "points", "misfits", "executions"])
+Inversion.__doc__ = """
+The outcome of a P-T inversion. `P`, `T` and `misfit` describe the best fit,
+and `results` its results. `points` is an array of every evaluated `(P,T)`
+pair, of shape `(n_points,2)`, with `misfits` the corresponding misfits
+(`inf` where execution failed). `executions` records the number of
+`thermocalc` executions performed.
+"""
+
+_DIRECTIONS = np.array([ (i, j) for i in (-1, 0, 1) for j in (-1, 0, 1) if (i, j) != (0, 0) ], dtype=float)
+
+
+def _residual(value, target):
+    value_target, sigma = target
+    return ((float(value) - float(value_target))/float(sigma))**2
+
+
+def misfit(results, modes=None, xyz=None, site_fractions=None, missing=100.):
+    """
+    Returns the misfit of results to target values, as the sum of squared
+    residuals normalised by their uncertainties.
+
+    Params
+    ------
+    results: dict
+        Results returned from `Context.execute()`.
+    modes: dict
+        Target `(value, sigma)` pairs keyed by phase, for example
+        `{"g":(0.05,0.01)}`. Phases absent from the results are taken to
+        have zero mode.
+    xyz: dict
+        Target `(value, sigma)` pairs keyed by `xyz` entry, for example
+        `{"x(g)":(0.85,0.02)}`.
+    site_fractions: dict
+        Target `(value, sigma)` pairs keyed by `(phase, site)` tuples, for
+        example `{("g","xCaX"):(0.12,0.01)}`.
+    missing: float
+        Contribution of each `xyz` or site fraction target absent from the
+        results (for example where the phase is not stable).
+
+    Returns
+    -------
+    misfit: float
+        The misfit, or `inf` where `results` is `None` or records a failure.
+    """
+    if results is None or results.get("failure") or "modes" not in results:
+        return np.inf
+    total = 0.
+    found = results.get("modes") or {}
+    for phase, target in (modes or {}).items():
+        total += _residual(found.get(phase, 0.), target)
+    found = results.get("xyz") or {}
+    for name, target in (xyz or {}).items():
+        total += _residual(found[name], target) if name in found else missing
+    found = results.get("site_fractions") or {}
+    for (phase, site), target in (site_fractions or {}).items():
+        value = (found.get(phase) or {}).get(site)
+        total += _residual(value, target) if value is not None else missing
+    return total
+
+
+class _evaluator(object):
+    """
+    Evaluates batches of points in unit coordinates, caching misfits of
+    points already evaluated.
+    """
+    def __init__(self, runner, lower, upper, targets, max_executions, execute_kwargs):
+        self.runner = runner
+        self.lower = lower
+        self.upper = upper
+        self.targets = targets
+        self.max_executions = max_executions
+        self.execute_kwargs = execute_kwargs
+        self.misfits = OrderedDict()
+        self.best = None
+        self.best_results = None
+
+    def point(self, unit):
+        return self.lower + np.asarray(unit)*(self.upper - self.lower)
+
+    def __call__(self, units):
+        """
+        Evaluates the provided unit points, returning their misfits.
+        """
+        keys = []
+        for unit in units:
+            key = tuple(np.round(np.clip(unit, 0., 1.), 9).tolist())
+            keys.append(key)
+        pending = list(OrderedDict.fromkeys( key for key in keys if key not in self.misfits ))
+        pending = pending[:max(self.max_executions - len(self.misfits), 0)]
+        if pending:
+            tasks = [ pt_task(*self.point(key)) for key in pending ]
+            for key, outcome in zip(pending, self.runner.map(tasks, **self.execute_kwargs)):
+                value = misfit(outcome.results, missing=self.targets["missing"], modes=self.targets["modes"],
+                               xyz=self.targets["xyz"], site_fractions=self.targets["site_fractions"])
+                self.misfits[key] = value
+                if self.best is None or value < self.misfits[self.best]:
+                    self.best = key
+                    self.best_results = outcome.results
+        return [ self.misfits.get(key, np.inf) for key in keys ]
+
+    @property
+    def exhausted(self):
+        return len(self.misfits) >= self.max_executions
+
+
+def invert(context, bounds, modes=None, xyz=None, site_fractions=None, tol=(0.01, 0.5), initial=5,
+           max_executions=200, missing=100., workers=None, runner=None, **execute_kwargs):
+    """
+    Determines the pressure and temperature which best reproduce target
+    modes and compositions.
+
+    Params
+    ------
+    context: tawnycalc.Context
+        The model configuration. The context itself is not modified.
+    bounds: tuple
+        `((Pmin,Pmax),(Tmin,Tmax))` box within which to search.
+    modes, xyz, site_fractions: dict
+        Target `(value, sigma)` pairs. Refer to `misfit()`.
+    tol: tuple
+        Pressure and temperature tolerances. The search terminates once the
+        pattern step falls below these.
+    initial: int
+        Number of points along each axis of the initial coarse grid.
+    max_executions: int
+        Maximum number of `thermocalc` executions.
+    missing: float
+        Misfit contribution of absent targets. Refer to `misfit()`.
+    workers: int
+        Number of concurrent executions.
+    runner: tawnycalc.runner.Runner
+        Runner used for executions, for example configured with a guess
+        library. Created from `context` (and closed on return) if not
+        provided.
+    execute_kwargs:
+        Further arguments are passed through to `Context.execute()`.
+
+    Returns
+    -------
+    fit: Inversion
+        The best fit and evaluated misfit surface.
+    """
+    if not (modes or xyz or site_fractions):
+        raise RuntimeError("At least one target must be provided.")
+    bounds = np.asarray(bounds, dtype=float)
+    if bounds.shape != (2, 2) or np.any(bounds[:,1] <= bounds[:,0]):
+        raise RuntimeError("Bounds must be provided as ((Pmin,Pmax),(Tmin,Tmax)).")
+    owned = runner is None
+    if owned:
+        runner = Runner(context, workers)
+    targets = { "modes":modes, "xyz":xyz, "site_fractions":site_fractions, "missing":missing }
+    evaluate = _evaluator(runner, bounds[:,0], bounds[:,1], targets, int(max_executions), execute_kwargs)
+    tol = np.asarray(tol, dtype=float)/(bounds[:,1] - bounds[:,0])
+
+    try:
+        # coarse grid, then a pattern search from its best point
+        initial = max(int(initial), 1)
+        axis = np.linspace(0., 1., initial) if initial > 1 else np.array([0.5])
+        evaluate([ (u, v) for u in axis for v in axis ])
+        step = np.full(2, 0.5/(initial - 1) if initial > 1 else 0.25)
+        while evaluate.best is not None and np.any(step >= tol) and not evaluate.exhausted:
+            centre = np.asarray(evaluate.best)
+            current = evaluate.misfits[evaluate.best]
+            candidates = np.clip(centre + _DIRECTIONS*step, 0., 1.)
+            found = evaluate(candidates)
+            if not min(found) < current:
+                step = step/2.
+    finally:
+        if owned:
+            runner.close()
+
+    if evaluate.best is None or not np.isfinite(evaluate.misfits[evaluate.best]):
+        raise RuntimeError("No successful executions were obtained within the provided bounds.")
+    points = np.array([ evaluate.point(key) for key in evaluate.misfits ])
+    misfits = np.array(list(evaluate.misfits.values()))
+    P, T = evaluate.point(evaluate.best)
+    return Inversion(float(P), float(T), float(evaluate.misfits[evaluate.best]), evaluate.best_results,
+                     points, misfits, len(misfits))
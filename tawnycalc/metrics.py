@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+In-process execution metrics.
+
+A `Metrics` object records counters, gauges and per-stage latency
+histograms for `thermocalc` executions. `Context.execute()` records the
+latency of each of its stages (`stage`, `run` and `parse`) where provided
+with a `Metrics` object, and `Runner` records overall throughput, failures,
+timeouts and worker utilisation:
+
+>>> runner = Runner(context, workers=8, metrics_path="/var/lib/node_exporter/tawnycalc.prom")
+>>> for outcome in runner.imap_unordered(tasks):
+...     pass
+>>> runner.metrics.snapshot()
+
+Where `metrics_path` (or the `TAWNYCALC_METRICS_PATH` environment variable)
+is set, metrics are periodically written to the file in the Prometheus
+text exposition format, suitable for collection by the node exporter
+textfile collector.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+
+# latency histogram bucket upper bounds (seconds)
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 25., 50., 100., 250., 500., 1000., float("inf"))
+
+
+class _histogram(object):
+    """
+    Fixed bucket latency histogram.
+    """
+    def __init__(self):
+        self.counts = [0]*len(BUCKETS)
+        self.count = 0
+        self.sum = 0.
+        self.max = 0.
+
+    def observe(self, value):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """
+        Estimates quantile `q` by interpolation within buckets.
+        """
+        if not self.count:
+            return None
+        rank = q*self.count
+        cumulative = 0
+        lower = 0.
+        for bound, count in zip(BUCKETS, self.counts):
+            if count and cumulative + count >= rank:
+                upper = min(bound, self.max)
+                return lower + (upper - lower)*(rank - cumulative)/count
+            cumulative += count
+            lower = bound
+        return self.max
+
+
+class stopwatch(object):
+    """
+    Records consecutive stage latencies into a `Metrics` object. Where
+    `metrics` is `None`, laps are not recorded.
+
+    >>> watch = stopwatch(metrics)
+    >>> ...
+    >>> watch.lap("stage")
+    """
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+        self.last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        if self.metrics is not None:
+            self.metrics.observe(stage, now - self.last)
+        self.last = now
+
+
+class Metrics(object):
+    """
+    Thread-safe store of counters, gauges and latency histograms.
+
+    Counters are monotonically increasing totals (eg `runs`, `failures`,
+    `timeouts`, `cache_hits`, `cache_misses`). Gauges record instantaneous
+    values, and may be provided as callables which are evaluated when
+    a snapshot is taken. Histograms record latencies per stage.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start = time.time()
+        self._counters = OrderedDict()
+        self._gauges = OrderedDict()
+        self._histograms = OrderedDict()
+
+    def increment(self, name, amount=1):
+        """
+        Increments counter `name` by `amount`.
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def set_gauge(self, name, value):
+        """
+        Sets gauge `name` to `value`, which may be a number or a callable
+        returning a number.
+        """
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, stage, seconds):
+        """
+        Records a latency of `seconds` for `stage`.
+        """
+        with self._lock:
+            if stage not in self._histograms:
+                self._histograms[stage] = _histogram()
+            self._histograms[stage].observe(seconds)
+
+    def snapshot(self):
+        """
+        Returns a snapshot of all metrics.
+
+        Returns
+        -------
+        snapshot: dict
+            Dictionary with `uptime`, `counters`, `rates` (per second since
+            creation), `gauges` and `latency` entries. Latency entries record
+            the `count`, `mean`, `p50`, `p90`, `p99` and `max` per stage.
+        """
+        with self._lock:
+            uptime = time.time() - self._start
+            counters = OrderedDict(self._counters)
+            gauges = OrderedDict((name, value() if callable(value) else value)
+                                 for name, value in self._gauges.items())
+            latency = OrderedDict()
+            for stage, hist in self._histograms.items():
+                latency[stage] = OrderedDict([
+                    ("count", hist.count),
+                    ("mean",  hist.sum/hist.count if hist.count else None),
+                    ("p50",   hist.quantile(0.50)),
+                    ("p90",   hist.quantile(0.90)),
+                    ("p99",   hist.quantile(0.99)),
+                    ("max",   hist.max),
+                ])
+        rates = OrderedDict((name, value/uptime if uptime > 0. else 0.) for name, value in counters.items())
+        return OrderedDict([("uptime", uptime), ("counters", counters), ("rates", rates),
+                            ("gauges", gauges), ("latency", latency)])
+
+    def prometheus(self, prefix="tawnycalc"):
+        """
+        Returns metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            counters = list(self._counters.items())
+            gauges = [ (name, value() if callable(value) else value) for name, value in self._gauges.items() ]
+            histograms = [ (stage, list(hist.counts), hist.sum, hist.count) for stage, hist in self._histograms.items() ]
+        lines = []
+        for name, value in counters:
+            lines.append("# TYPE {}_{}_total counter".format(prefix, name))
+            lines.append("{}_{}_total {}".format(prefix, name, value))
+        for name, value in gauges:
+            lines.append("# TYPE {}_{} gauge".format(prefix, name))
+            lines.append("{}_{} {}".format(prefix, name, value))
+        if histograms:
+            name = "{}_stage_seconds".format(prefix)
+            lines.append("# TYPE {} histogram".format(name))
+            for stage, counts, total, count in histograms:
+                cumulative = 0
+                for bound, bucket in zip(BUCKETS, counts):
+                    cumulative += bucket
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append('{}_bucket{{stage="{}",le="{}"}} {}'.format(name, stage, le, cumulative))
+                lines.append('{}_sum{{stage="{}"}} {}'.format(name, stage, total))
+                lines.append('{}_count{{stage="{}"}} {}'.format(name, stage, count))
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """
+        Atomically writes metrics to `path` in the Prometheus text format.
+        """
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp, 'w') as fp:
+            fp.write(self.prometheus())
+        os.replace(tmp, path)
+
+
+class PrometheusWriter(object):
+    """
+    Periodically writes metrics to a file from a background thread.
+
+    Params
+    ------
+    metrics: Metrics
+        The metrics to write.
+    path: str
+        The output file.
+    interval: float
+        Seconds between writes.
+    """
+    def __init__(self, metrics, path, interval=15.):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.metrics.write_prometheus(self.path)
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the writer, performing a final write.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.metrics.write_prometheus(self.path)
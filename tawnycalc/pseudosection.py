@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+"""
+Assemblage fields and isopleths from gridded results.
+
+A `pseudosection` places results calculated over a P-T grid onto regular
+axes, labels each point with its stable assemblage, and extracts field
+polygons and isopleths ready for plotting with `matplotlib`:
+
+>>> section = pseudosection.from_outcomes(points, runner.map(tasks))
+>>> for field in section.fields():
+...     ax.add_patch(matplotlib.patches.PathPatch(field.path(), fill=False))
+...     ax.text(*field.label_point, field.assemblage, ha="center")
+>>> for level, lines in section.isopleths("mode(g)", [0.05, 0.10]).items():
+...     for line in lines:
+...         ax.plot(*line.T)
+
+All coordinates are returned as `(T,P)` pairs, so that temperature lies
+along the horizontal axis. Fields are built from the cells of the grid,
+each cell extending halfway to neighbouring points. Isopleths are
+extracted by marching squares.
+"""
+from collections import namedtuple, OrderedDict
+import numpy as np
+
+from .runner import assemblage as _assemblage
+
+
+class Field(namedtuple("Field", ["assemblage", "rings", "label_point", "size"])):
+    """
+    A connected assemblage field.
+
+    Attributes
+    ----------
+    assemblage: str
+        The stable assemblage.
+    rings: list
+        Boundary rings, each an `(N,2)` array of closed `(T,P)` coordinates.
+        Outer boundaries are anticlockwise and holes are clockwise.
+    label_point: tuple
+        `(T,P)` of the grid point lying deepest within the field.
+    size: int
+        Number of grid points within the field.
+    """
+    __slots__ = ()
+
+    def path(self):
+        """
+        Returns the field boundary as a `matplotlib.path.Path`.
+        """
+        from matplotlib.path import Path
+        return Path.make_compound_path(*[ Path(ring, closed=True) for ring in self.rings ])
+
+
+# marching squares segments for each corner case, as pairs of cell edges
+# (0: bottom, 1: right, 2: top, 3: left). Saddles (5,10) are listed for a
+# low centre, with `_SADDLE_HIGH` used where the centre exceeds the level.
+_SEGMENTS = np.array([
+    [[-1,-1], [-1,-1]], [[3, 0], [-1,-1]], [[0, 1], [-1,-1]], [[3, 1], [-1,-1]],
+    [[1, 2], [-1,-1]], [[3, 0], [1, 2]],   [[0, 2], [-1,-1]], [[3, 2], [-1,-1]],
+    [[2, 3], [-1,-1]], [[0, 2], [-1,-1]], [[0, 1], [2, 3]],   [[1, 2], [-1,-1]],
+    [[1, 3], [-1,-1]], [[0, 1], [-1,-1]], [[3, 0], [-1,-1]], [[-1,-1], [-1,-1]],
+])
+_SADDLE_HIGH = {5: [[0, 1], [2, 3]], 10: [[3, 0], [1, 2]]}
+
+
+def _chains(segments):
+    """
+    Joins segments (pairs of integer node ids, each node shared by at most
+    two segments) into chains, returning lists of node ids. Closed chains
+    repeat their first node.
+    """
+    neighbours = {}
+    for a, b in segments:
+        neighbours.setdefault(a, []).append(b)
+        neighbours.setdefault(b, []).append(a)
+    chains = []
+    visited = set()
+    # open chains start from end nodes, remaining nodes lie on loops
+    starts = [ node for node, adjacent in neighbours.items() if len(adjacent) == 1 ]
+    starts += list(neighbours.keys())
+    for start in starts:
+        if start in visited:
+            continue
+        chain = [start,]
+        visited.add(start)
+        previous, node = None, start
+        while True:
+            following = [ item for item in neighbours[node] if item != previous ]
+            if not following:
+                break
+            previous, node = node, following[0]
+            chain.append(node)
+            if node in visited:
+                break
+            visited.add(node)
+        chains.append(chain)
+    return chains
+
+
+def _rings(directed):
+    """
+    Joins directed edges (pairs of vertex ids) into closed rings. Where
+    several edges leave a vertex, they are consumed in turn.
+    """
+    outgoing = {}
+    for a, b in directed:
+        outgoing.setdefault(a, []).append(b)
+    rings = []
+    for start in list(outgoing.keys()):
+        while outgoing.get(start):
+            ring = [start,]
+            node = start
+            while True:
+                node = outgoing[node].pop()
+                ring.append(node)
+                if node == start:
+                    break
+            rings.append(ring)
+    return rings
+
+
+def _propagate(values, same, combine, step=0):
+    """
+    Repeatedly combines `values` with those of their four neighbours where
+    `same` indicates neighbours belong to the same region, until unchanged.
+    """
+    shifts = ((np.s_[1:,:], np.s_[:-1,:]), (np.s_[:-1,:], np.s_[1:,:]),
+              (np.s_[:,1:], np.s_[:,:-1]), (np.s_[:,:-1], np.s_[:,1:]))
+    while True:
+        updated = values.copy()
+        for (target, source), mask in zip(shifts, same):
+            updated[target] = np.where(mask, combine(updated[target], values[source] + step), updated[target])
+        if np.array_equal(updated, values):
+            return values
+        values = updated
+
+
+class pseudosection(object):
+    """
+    Gridded results.
+
+    Params
+    ------
+    P, T: array_like
+        Pressure and temperature of each result. Points are placed on the
+        grid formed by the unique pressure and temperature values (rounded
+        to `decimals`), so results need not cover the full grid.
+    results: list
+        Results (for example from `Context.execute()`) for each point. `None`
+        entries, or results recording a `failure`, are treated as missing.
+    decimals: int
+        Precision to which coordinates are rounded before forming the grid.
+    """
+    def __init__(self, P, T, results, decimals=6):
+        P = np.round(np.asarray(P, dtype=float), decimals)
+        T = np.round(np.asarray(T, dtype=float), decimals)
+        if not (P.shape == T.shape == (len(results),)):
+            raise RuntimeError("P, T and results must have equal lengths.")
+        self.P, i = np.unique(P, return_inverse=True)
+        self.T, j = np.unique(T, return_inverse=True)
+        shape = (len(self.P), len(self.T))
+        self._flat = np.ravel_multi_index((i.ravel(), j.ravel()), shape)
+        self._results = [ results[k] if results[k] is not None and not results[k].get("failure") else None
+                          for k in range(len(results)) ]
+        labels = np.array([ (_assemblage(item) or "") if item is not None else "" for item in self._results ], dtype=object)
+        assemblages, inverse = np.unique(labels.astype(str), return_inverse=True)
+        valid = assemblages != ""
+        self.assemblages = [ str(item) for item in assemblages[valid] ]
+        ids = np.where(valid[inverse], np.cumsum(valid)[inverse] - 1, -1)
+        self.field_ids = np.full(shape, -1, dtype=int)
+        self.field_ids.flat[self._flat] = ids.ravel()
+        self._values = {}
+
+    @classmethod
+    def from_outcomes(cls, points, outcomes, **kwargs):
+        """
+        Constructs a pseudosection from runner outcomes.
+
+        Params
+        ------
+        points: list
+            `(P,T)` for each task.
+        outcomes: iterable
+            `tawnycalc.runner.Outcome` objects, whose `index` refers to `points`.
+        """
+        results = [None]*len(points)
+        for outcome in outcomes:
+            results[outcome.index] = outcome.results
+        P, T = np.array(points, dtype=float).reshape(-1, 2).T
+        return cls(P, T, results, **kwargs)
+
+    def assemblage_grid(self):
+        """
+        Returns the assemblage at each grid point as an object array, with
+        `None` for missing points.
+        """
+        names = np.array(self.assemblages + [None,], dtype=object)
+        return names[self.field_ids]
+
+    def values(self, key):
+        """
+        Returns the values of a result quantity at each grid point, with
+        NaN for missing points.
+
+        Params
+        ------
+        key: str, callable
+            Either `"mode(<phase>)"` for modes (phases absent from a point
+            contribute zero), an `xyz` key such as `"x(g)"`, a site fraction
+            such as `"xMgX(g)"`, or a function accepting results and returning
+            a float.
+
+        Returns
+        -------
+        values: numpy.ndarray
+            Array of shape `(len(P), len(T))`.
+        """
+        if not callable(key) and key in self._values:
+            return self._values[key]
+        flat = np.full(len(self._results), np.nan)
+        for k, item in enumerate(self._results):
+            if item is not None:
+                value = self._lookup(item, key)
+                if value is not None:
+                    flat[k] = value
+        values = np.full(self.field_ids.shape, np.nan)
+        values.flat[self._flat] = flat
+        if not callable(key):
+            self._values[key] = values
+        return values
+
+    @staticmethod
+    def _lookup(results, key):
+        if callable(key):
+            return key(results)
+        if key.startswith("mode(") and key.endswith(")"):
+            return (results.get("modes") or {}).get(key[5:-1], 0.)
+        xyz = results.get("xyz") or {}
+        if key in xyz:
+            return xyz[key]
+        if key.endswith(")") and "(" in key:
+            site, phase = key[:-1].split("(", 1)
+            value = (results.get("site_fractions") or {}).get(phase, {}).get(site)
+            return float(value) if value is not None else None
+        return None
+
+    def isopleths(self, key, levels):
+        """
+        Extracts contours of a result quantity by marching squares.
+
+        Params
+        ------
+        key: str, callable
+            Quantity to contour (refer to `values`), or an array of shape
+            `(len(P), len(T))`.
+        levels: float, list
+            Contour levels.
+
+        Returns
+        -------
+        isopleths: OrderedDict
+            For each level, a list of `(N,2)` arrays of `(T,P)` coordinates.
+            Closed contours repeat their first point.
+        """
+        z = key if isinstance(key, np.ndarray) else self.values(key)
+        nP, nT = z.shape
+        if nP < 2 or nT < 2:
+            return OrderedDict( (level, []) for level in np.atleast_1d(levels) )
+        TT, PP = np.meshgrid(self.T, self.P)
+        offset = nP*(nT - 1)                 # horizontal edges first, then vertical
+        i, j = np.mgrid[0:nP-1, 0:nT-1]
+        # edge ids for cell edges (bottom, right, top, left)
+        edges = np.stack([ i*(nT - 1) + j, offset + i*nT + j + 1, (i + 1)*(nT - 1) + j, offset + i*nT + j ], axis=-1)
+        corners = np.stack([ z[:-1,:-1], z[:-1,1:], z[1:,1:], z[1:,:-1] ], axis=-1)
+        finite = np.all(np.isfinite(corners), axis=-1)
+        centre = np.nanmean(np.where(finite[...,np.newaxis], corners, 0.), axis=-1)
+
+        isopleths = OrderedDict()
+        for level in np.atleast_1d(levels):
+            level = float(level)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                # crossing points along horizontal and vertical grid edges
+                th = np.clip((level - z[:,:-1])/(z[:,1:] - z[:,:-1]), 0., 1.)
+                tv = np.clip((level - z[:-1,:])/(z[1:,:] - z[:-1,:]), 0., 1.)
+            points = np.concatenate([
+                np.stack([ TT[:,:-1] + th*(TT[:,1:] - TT[:,:-1]), PP[:,:-1] ], axis=-1).reshape(-1, 2),
+                np.stack([ TT[:-1,:], PP[:-1,:] + tv*(PP[1:,:] - PP[:-1,:]) ], axis=-1).reshape(-1, 2) ])
+            case = np.sum((corners > level) << np.arange(4), axis=-1)
+            case = np.where(finite, case, 0)
+            table = _SEGMENTS[case]
+            for saddle, segments in _SADDLE_HIGH.items():
+                table[(case == saddle) & (centre > level)] = segments
+            segments = []
+            for slot in range(2):
+                pair = table[..., slot, :]
+                present = pair[...,0] >= 0
+                cell_edges = edges[present]
+                chosen = pair[present]
+                segments.append(np.stack([ np.take_along_axis(cell_edges, chosen[:,:1], axis=1)[:,0],
+                                           np.take_along_axis(cell_edges, chosen[:,1:], axis=1)[:,0] ], axis=-1))
+            segments = np.concatenate(segments)
+            isopleths[level] = [ points[chain] for chain in _chains(segments.tolist()) ]
+        return isopleths
+
+    def _components(self):
+        """
+        Labels connected regions of equal field id, returning component
+        labels (-1 for missing points) and the neighbour masks used.
+        """
+        ids = self.field_ids
+        same = (ids[1:,:] == ids[:-1,:], ids[:-1,:] == ids[1:,:],
+                ids[:,1:] == ids[:,:-1], ids[:,:-1] == ids[:,1:])
+        try:
+            from scipy import ndimage
+            labels = np.full(ids.shape, -1)
+            count = 0
+            for field in range(len(self.assemblages)):
+                component, n = ndimage.label(ids == field)
+                labels = np.where(component > 0, component - 1 + count, labels)
+                count += n
+        except ImportError:
+            labels = _propagate(np.arange(ids.size).reshape(ids.shape), same, np.minimum)
+            labels = np.where(ids >= 0, labels, -1)
+        return labels, same
+
+    def fields(self):
+        """
+        Returns the connected assemblage fields.
+
+        Returns
+        -------
+        fields: list
+            List of `Field` objects, ordered by decreasing size.
+        """
+        labels, same = self._components()
+        nP, nT = labels.shape
+        # cell boundaries lie halfway between grid points, and on the outer points
+        Tb = np.concatenate([ self.T[:1], 0.5*(self.T[1:] + self.T[:-1]), self.T[-1:] ])
+        Pb = np.concatenate([ self.P[:1], 0.5*(self.P[1:] + self.P[:-1]), self.P[-1:] ])
+        # depth of each point within its component, for label placement
+        boundary = np.ones(labels.shape, dtype=bool)
+        boundary[1:-1,1:-1] = False
+        for mask, target in zip(same, (np.s_[1:,:], np.s_[:-1,:], np.s_[:,1:], np.s_[:,:-1])):
+            boundary[target] |= ~mask
+        depth = _propagate(np.where(boundary, 0, labels.size), same, np.minimum, step=1)
+
+        padded = np.pad(labels, 1, constant_values=-1)
+        fields = []
+        for component in np.unique(labels[labels >= 0]):
+            member = padded == component
+            edges = []
+            # horizontal boundaries at P = Pb[r], oriented with the field on the left
+            r, c = np.nonzero(member[1:,1:-1] != member[:-1,1:-1])
+            above = member[1:,1:-1][r, c]
+            for rr, cc, up in zip(r.tolist(), c.tolist(), above.tolist()):
+                a, b = (rr, cc), (rr, cc + 1)
+                edges.append((a, b) if up else (b, a))
+            # vertical boundaries at T = Tb[c]
+            r, c = np.nonzero(member[1:-1,1:] != member[1:-1,:-1])
+            right = member[1:-1,1:][r, c]
+            for rr, cc, is_right in zip(r.tolist(), c.tolist(), right.tolist()):
+                a, b = (rr + 1, cc), (rr, cc)
+                edges.append((a, b) if is_right else (b, a))
+            rings = []
+            for ring in _rings(edges):
+                index = np.array(ring)
+                rings.append(np.stack([ Tb[index[:,1]], Pb[index[:,0]] ], axis=-1))
+            inside = labels == component
+            k = np.argmax(np.where(inside, depth, -1))
+            pi, ti = np.unravel_index(k, labels.shape)
+            field_id = self.field_ids.flat[k]
+            fields.append(Field(self.assemblages[field_id], rings, (float(self.T[ti]), float(self.P[pi])),
+                                int(inside.sum())))
+        fields.sort(key=lambda field: -field.size)
+        return fields
@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel execution of many `thermocalc` calculations.
+
+A `Runner` executes a collection of tasks against a base `Context`. Each
+task is a dictionary of script entries which is applied to a copy of the
+base script before execution:
+
+>>> runner = tawnycalc.runner.Runner(context, workers=8)
+>>> tasks  = [ runner.pt_task(P,T) for P in (9,10,11) for T in (580,600) ]
+>>> for outcome in runner.imap_unordered(tasks):
+...     print(outcome.index, outcome.results.phases)
+
+"""
+import os
+import time
+import threading
+from collections import namedtuple, OrderedDict
+
+from .metrics import Metrics, PrometheusWriter
+from .failures import TIMEOUT
+
+Outcome = namedtuple("Outcome", ["index", "results", "error"])
+Outcome.__doc__ = """
+The outcome of a single task. `results` is `None` (and `error` records
+the raised exception) where execution raised an exception. Executions
+aborted by failure detection return results with their `failure` entry set.
+"""
+
+
+def pt_task(P, T, **entries):
+    """
+    Returns a task for a calculation at a single pressure and temperature.
+
+    Params
+    ------
+    P: float
+        Pressure (kbar).
+    T: float
+        Temperature (°C).
+    entries:
+        Any further script entries for the task.
+
+    Returns
+    -------
+    task: dict
+        Dictionary of script entries.
+    """
+    task = OrderedDict()
+    task["setPwindow"] = "{} {}".format(P,P)
+    task["setTwindow"] = "{} {}".format(T,T)
+    task.update(entries)
+    return task
+
+
+def apply_task(script, task):
+    """
+    Returns a copy of `script` updated with the entries of `task`. Entries
+    with `None` values are removed.
+
+    Params
+    ------
+    script: dict
+        The base script, for example `Context._script`.
+    task: dict
+        Dictionary of script entries.
+
+    Returns
+    -------
+    script: OrderedDict
+        The updated script. Values are shared with `script`, not copied.
+    """
+    script = OrderedDict(script)
+    for key, value in task.items():
+        if value is None:
+            script.pop(key, None)
+        else:
+            script[key] = value
+    return script
+
+
+def assemblage(results):
+    """
+    Returns the stable assemblage recorded in the provided results,
+    stripped of the additional information `thermocalc` reports in
+    parentheses. For example `"g bi mu pa ru q H2O"`.
+
+    Params
+    ------
+    results: dict
+        Results returned from `Context.execute()`.
+
+    Returns
+    -------
+    assemblage: str
+        The assemblage, or `None` if unavailable.
+    """
+    phases = results.get("phases")
+    if not phases:
+        return None
+    return " ".join(phases.split("(", 1)[0].split())
+
+
+class Runner(object):
+    """
+    Executes tasks in parallel against copies of a base `Context`.
+
+    Each worker holds its own copy of the context (see `Context.copy()`),
+    so that no two concurrent executions share a temporary location. Worker
+    contexts are created as required and reused by subsequent calls, and
+    their temporary locations are removed by `close()` (or on leaving a
+    `with` block):
+
+    >>> with Runner(context, workers=8) as runner:
+    ...     outcomes = runner.map(tasks)
+
+    Tasks
+    are dictionaries of script entries. Entries are set on a copy of the
+    base script, with `None` values removing the corresponding entry.
+
+    Params
+    ------
+    context: tawnycalc.Context
+        The base context. Its configuration is captured at the beginning
+        of each call to `imap_unordered` or `map`.
+    workers: int
+        Number of concurrent `thermocalc` executions. Defaults to the number
+        of CPUs available to the process (refer to 
+        `tawnycalc.scheduler.available_cpus()`).
+    metrics: tawnycalc.metrics.Metrics
+        Object to which execution metrics are recorded. A new object is 
+        created if not provided, and is available via the `metrics` attribute.
+    metrics_path: str
+        If provided, metrics are periodically written to this file in the 
+        Prometheus text format while tasks are executing. Defaults to the 
+        `TAWNYCALC_METRICS_PATH` environment variable where set.
+    metrics_interval: float
+        Seconds between writes to `metrics_path`.
+    guess_library: tawnycalc.guesses.GuessLibrary
+        If provided, each task is warm started from the nearest compatible
+        library entry, and converged results are added to the library. 
+        Library hits and misses are recorded as `cache_hits` and 
+        `cache_misses` metrics.
+    scheduler: tawnycalc.scheduler.Scheduler
+        If provided, determines the default number of workers, throttles
+        admission of tasks when memory is low, and applies core pinning and
+        resource limits to each `thermocalc` process.
+    strategy: tawnycalc.strategy.Adaptive
+        If provided, executions are performed via this strategy (refer to
+        `tawnycalc.strategy`), with the guess library entry for each task
+        (where available) provided as the neighbouring result.
+    """
+    pt_task = staticmethod(pt_task)
+
+    def __init__(self, context, workers=None, metrics=None, metrics_path=None, metrics_interval=15.,
+                 guess_library=None, scheduler=None, strategy=None):
+        from .scheduler import available_cpus
+        self.context = context
+        self.guess_library = guess_library
+        self.scheduler = scheduler
+        self.strategy = strategy
+        if not workers:
+            workers = scheduler.workers if scheduler is not None else available_cpus()
+        self.workers = int(workers)
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.metrics_path = metrics_path or os.environ.get("TAWNYCALC_METRICS_PATH")
+        self.metrics_interval = metrics_interval
+
+        self._lock = threading.Lock()
+        self._contexts = []
+        self._idle = []
+        self._inflight = {}
+        self._busy = 0.
+        self._started = time.time()
+        self.metrics.set_gauge("workers", self.workers)
+        self.metrics.set_gauge("busy_workers", lambda: len(self._inflight))
+        self.metrics.set_gauge("oldest_inflight_seconds", self._oldest_inflight)
+        self.metrics.set_gauge("worker_utilisation", self._utilisation)
+
+    def _oldest_inflight(self):
+        with self._lock:
+            starts = list(self._inflight.values())
+        return time.time() - min(starts) if starts else 0.
+
+    def _utilisation(self):
+        now = time.time()
+        with self._lock:
+            busy = self._busy + sum(now - start for start in self._inflight.values())
+        elapsed = (now - self._started)*self.workers
+        return busy/elapsed if elapsed > 0. else 0.
+
+    def _checkout(self):
+        """
+        Returns an idle worker context (creating one where none are idle),
+        configured with the current `prefs` of the base context.
+        """
+        import copy
+        with self._lock:
+            ctx = self._idle.pop() if self._idle else None
+        if ctx is None:
+            ctx = self.context.copy()
+            with self._lock:
+                self._contexts.append(ctx)
+        else:
+            ctx.prefs = copy.deepcopy(self.context.prefs)
+            ctx.exec = self.context.exec
+            ctx.scripts_dir = self.context.scripts_dir
+        return ctx
+
+    def _checkin(self, ctx):
+        with self._lock:
+            if ctx in self._contexts:
+                self._idle.append(ctx)
+
+    def close(self):
+        """
+        Removes the temporary locations of the worker contexts. The runner
+        may still be used afterwards, in which case new worker contexts are
+        created.
+        """
+        with self._lock:
+            contexts, self._contexts, self._idle = self._contexts, [], []
+        for ctx in contexts:
+            ctx.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _apply(self, ctx, base, task):
+        """
+        Configures worker context `ctx` with base script `base` updated with `task`.
+        """
+        ctx._script = apply_task(base, task)
+
+    def _execute(self, ctx, base, index, task, execute_kwargs, slot=0):
+        """
+        Executes a single task on worker context `ctx`, occupying worker `slot`.
+        """
+        token = object()
+        start = None
+        try:
+            # failures configuring the execution are also recorded as outcomes
+            self._apply(ctx, base, task)
+            entry = None
+            if self.guess_library is not None:
+                entry = self.guess_library.apply(ctx)
+                self.metrics.increment("cache_hits" if entry is not None else "cache_misses")
+            if self.scheduler is not None:
+                self.scheduler.admit(self.metrics)
+                hook = self.scheduler.spawn_hook(slot)
+                if hook is not None:
+                    execute_kwargs = dict(execute_kwargs, on_spawn=hook)
+            start = time.time()
+            with self._lock:
+                self._inflight[token] = start
+            if self.strategy is not None:
+                results = self.strategy.execute(ctx, entry, metrics=self.metrics, **execute_kwargs)
+            else:
+                results = ctx.execute(metrics=self.metrics, **execute_kwargs)
+            outcome = Outcome(index, results, None)
+            failure = outcome.results.get("failure")
+            if failure:
+                self.metrics.increment("failures")
+                self.metrics.increment("failures_{}".format(failure))
+                if failure == TIMEOUT:
+                    self.metrics.increment("timeouts")
+        except Exception as e:
+            outcome = Outcome(index, None, e)
+            self.metrics.increment("failures")
+        finally:
+            end = time.time()
+            if start is None:
+                start = end
+            with self._lock:
+                self._inflight.pop(token, None)
+                self._busy += end - start
+        self.metrics.increment("runs")
+        self.metrics.observe("execute", end - start)
+        if self.guess_library is not None and outcome.results is not None:
+            self.guess_library.add(outcome.results, ctx.script)
+        return outcome
+
+    def imap_unordered(self, tasks, window=None, **execute_kwargs):
+        """
+        Executes tasks, yielding `Outcome` objects as tasks complete. Outcomes
+        are therefore not necessarily ordered, and the `index` attribute records
+        the position of the corresponding task within `tasks`.
+
+        `tasks` is consumed lazily, with at most `window` tasks in flight at
+        any time. Generators may therefore be used to describe very large
+        collections of tasks without holding them in memory.
+
+        Params
+        ------
+        tasks: iterable
+            Iterable of task dictionaries.
+        window: int
+            Maximum number of tasks submitted but not yet yielded. Defaults
+            to twice the number of workers.
+        execute_kwargs:
+            Further arguments are passed through to `Context.execute()`.
+
+        Returns
+        -------
+        outcomes: generator
+            Generator of `Outcome` objects.
+        """
+        import copy, queue
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+        if not window:
+            window = 2*self.workers
+        window = max(int(window), 1)
+
+        base = copy.deepcopy(self.context._script)
+        contexts = queue.Queue()
+        workers = []
+        for slot in range(self.workers):
+            workers.append(self._checkout())
+            contexts.put((slot, workers[-1]))
+
+        def run(index, task):
+            slot, ctx = contexts.get()
+            try:
+                return self._execute(ctx, base, index, task, execute_kwargs, slot)
+            finally:
+                contexts.put((slot, ctx))
+
+        writer = None
+        if self.metrics_path:
+            writer = PrometheusWriter(self.metrics, self.metrics_path, self.metrics_interval).start()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                pending = set()
+                try:
+                    for index, task in enumerate(tasks):
+                        pending.add(pool.submit(run, index, task))
+                        if len(pending) >= window:
+                            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                            for future in done:
+                                yield future.result()
+                    while pending:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            yield future.result()
+                finally:
+                    for future in pending:
+                        future.cancel()
+                    if writer is not None:
+                        writer.stop()
+        finally:
+            # worker contexts are returned once no executions remain
+            for ctx in workers:
+                self._checkin(ctx)
+
+    def map(self, tasks, **execute_kwargs):
+        """
+        Executes tasks, returning a list of `Outcome` objects ordered as per
+        `tasks`. Refer to `imap_unordered` for parameters.
+
+        Returns
+        -------
+        outcomes: list
+            List of `Outcome` objects.
+        """
+        outcomes = list(self.imap_unordered(tasks, **execute_kwargs))
+        outcomes.sort(key=lambda outcome: outcome.index)
+        return outcomes
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Resource-aware scheduling of `thermocalc` executions on shared nodes.
+
+A `Scheduler` sizes the number of concurrent executions from the cores
+actually available to the process (CPU affinity and cgroup quotas), and
+optionally constrains each `thermocalc` child process:
+
+>>> scheduler = Scheduler(pin=True, nice=10, memory_limit="2G", min_free_memory="4G")
+>>> runner = Runner(context, scheduler=scheduler)
+
+Children may be pinned to a single core, run at reduced priority, and
+have their address space limited (`RLIMIT_AS`). Where `min_free_memory` is
+provided, new executions are only admitted while at least this much
+memory remains available to the host (or the enclosing cgroup). Limits are
+applied from the parent immediately after each child is spawned, as
+`preexec_fn` is not safe to use from threads. Pinning and memory limits
+are only supported on Linux.
+"""
+import os
+import math
+import time
+import threading
+
+_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_size(size):
+    """
+    Parses a memory size such as `"512M"` or `"4G"` (binary units), returning
+    the size in bytes. Integers are returned unchanged.
+    """
+    if size is None or isinstance(size, (int, float)):
+        return size
+    text = str(size).strip().upper().rstrip("IB")
+    unit = text[-1] if text and text[-1] in _SIZE_UNITS else ""
+    try:
+        return int(float(text[:len(text)-len(unit)])*_SIZE_UNITS[unit])
+    except ValueError:
+        raise RuntimeError("Unable to parse memory size '{}'.".format(size))
+
+
+def _read(path):
+    try:
+        with open(path, 'r') as fp:
+            return fp.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def _cgroup_dirs(controller):
+    """
+    Returns candidate directories for the cgroup `controller` of this process,
+    for both cgroup v2 (`controller=None`) and v1 hierarchies. The mount root
+    is included as containers commonly mount their own cgroup there.
+    """
+    text = _read("/proc/self/cgroup") or ""
+    dirs = []
+    for line in text.splitlines():
+        parts = line.split(":", 2)
+        if len(parts) != 3:
+            continue
+        if controller is None and parts[0] == "0":
+            mounts = ["/sys/fs/cgroup", "/sys/fs/cgroup/unified"]
+        elif controller is not None and controller in parts[1].split(","):
+            mounts = ["/sys/fs/cgroup/{}".format(parts[1]), "/sys/fs/cgroup/{}".format(controller)]
+        else:
+            continue
+        for mount in mounts:
+            for path in (mount + parts[2].rstrip("/"), mount):
+                if os.path.isdir(path) and path not in dirs:
+                    dirs.append(path)
+    return dirs
+
+
+def cpu_quota():
+    """
+    Returns the number of CPUs permitted by cgroup CPU quotas, or `None`
+    where no quota applies.
+    """
+    quotas = []
+    for path in _cgroup_dirs(None):
+        value = _read(os.path.join(path, "cpu.max"))
+        if value and not value.startswith("max"):
+            quota, period = value.split()[:2]
+            quotas.append(float(quota)/float(period))
+    for path in _cgroup_dirs("cpu"):
+        quota = _read(os.path.join(path, "cpu.cfs_quota_us"))
+        period = _read(os.path.join(path, "cpu.cfs_period_us"))
+        if quota and period and int(quota) > 0:
+            quotas.append(float(quota)/float(period))
+    return min(quotas) if quotas else None
+
+
+def allowed_cpus():
+    """
+    Returns the sorted list of CPUs this process may run on.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def available_cpus():
+    """
+    Returns the number of CPUs available to this process, accounting for
+    CPU affinity and cgroup CPU quotas.
+    """
+    cpus = len(allowed_cpus())
+    quota = cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, int(math.ceil(quota)))
+    return max(cpus, 1)
+
+
+def memory_available():
+    """
+    Returns the memory (bytes) available for new processes, being the lesser
+    of the host `MemAvailable` and any remaining cgroup memory allowance.
+    Returns `None` where this cannot be determined.
+    """
+    available = []
+    for line in (_read("/proc/meminfo") or "").splitlines():
+        if line.startswith("MemAvailable:"):
+            available.append(int(line.split()[1])*1024)
+    for path in _cgroup_dirs(None):
+        limit = _read(os.path.join(path, "memory.max"))
+        current = _read(os.path.join(path, "memory.current"))
+        if limit and current and limit != "max":
+            available.append(int(limit) - int(current))
+    for path in _cgroup_dirs("memory"):
+        limit = _read(os.path.join(path, "memory.limit_in_bytes"))
+        usage = _read(os.path.join(path, "memory.usage_in_bytes"))
+        # unlimited cgroups report a limit near the maximum 64 bit value
+        if limit and usage and int(limit) < 2**60:
+            available.append(int(limit) - int(usage))
+    return max(min(available), 0) if available else None
+
+
+class Scheduler(object):
+    """
+    Resource controls for concurrent `thermocalc` executions.
+
+    Params
+    ------
+    workers: int
+        Number of concurrent executions. Defaults to `available_cpus()`.
+    pin: bool
+        If `True`, the child of each worker is pinned to a single core from
+        those allowed for this process.
+    nice: int
+        Niceness increment applied to each child.
+    memory_limit: int, str
+        Address space limit (`RLIMIT_AS`) applied to each child, in bytes or
+        as a size string such as `"2G"`.
+    min_free_memory: int, str
+        If provided, executions are only admitted while at least this much
+        memory is available (refer to `memory_available()`). Where
+        `memory_limit` is also set, this much additional memory is required.
+    poll_interval: float
+        Seconds between memory checks while admission is throttled.
+    """
+    def __init__(self, workers=None, pin=False, nice=None, memory_limit=None, min_free_memory=None,
+                 poll_interval=1.):
+        self.workers = int(workers) if workers else available_cpus()
+        self.pin = bool(pin)
+        self.nice = int(nice) if nice else None
+        self.memory_limit = parse_size(memory_limit)
+        self.min_free_memory = parse_size(min_free_memory)
+        self.poll_interval = float(poll_interval)
+        if self.pin and not hasattr(os, "sched_setaffinity"):
+            raise RuntimeError("Core pinning is not supported on this platform.")
+        if self.memory_limit is not None:
+            try:
+                import resource
+                resource.prlimit
+            except (ImportError, AttributeError):
+                raise RuntimeError("Memory limits are not supported on this platform.")
+        self.cores = allowed_cpus()
+        self._admission = threading.Lock()
+
+    def __repr__(self):
+        return "Scheduler(workers={}, pin={}, nice={}, memory_limit={}, min_free_memory={})".format(
+                self.workers, self.pin, self.nice, self.memory_limit, self.min_free_memory)
+
+    def admit(self, metrics=None):
+        """
+        Blocks until sufficient memory is available to start a new execution.
+        Admissions are serialised, so that concurrent workers do not all
+        start against the same reading. Time spent waiting is recorded as
+        `admission` latency, and each throttled admission increments the
+        `throttled` counter of `metrics`.
+        """
+        if self.min_free_memory is None:
+            return
+        start = time.time()
+        throttled = False
+        with self._admission:
+            while True:
+                available = memory_available()
+                if available is None or available >= self.min_free_memory + (self.memory_limit or 0):
+                    break
+                throttled = True
+                time.sleep(self.poll_interval)
+        if metrics is not None:
+            metrics.observe("admission", time.time() - start)
+            if throttled:
+                metrics.increment("throttled")
+
+    def apply(self, pid, slot=0):
+        """
+        Applies core pinning, niceness and memory limits to process `pid`.
+
+        Params
+        ------
+        pid: int
+            Process id of the child.
+        slot: int
+            Worker slot. The child is pinned to core `slot` (modulo the number
+            of allowed cores).
+        """
+        if self.pin:
+            os.sched_setaffinity(pid, {self.cores[slot % len(self.cores)]})
+        if self.nice:
+            os.setpriority(os.PRIO_PROCESS, pid, os.getpriority(os.PRIO_PROCESS, 0) + self.nice)
+        if self.memory_limit is not None:
+            import resource
+            resource.prlimit(pid, resource.RLIMIT_AS, (self.memory_limit, self.memory_limit))
+
+    def spawn_hook(self, slot):
+        """
+        Returns a callable suitable for the `on_spawn` argument of
+        `Context.execute()`, applying this scheduler's controls for `slot`.
+        """
+        if not (self.pin or self.nice or self.memory_limit is not None):
+            return None
+        return lambda process: self.apply(process.pid, slot)
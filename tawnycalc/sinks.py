@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming execution with pluggable result sinks.
+
+For very large sweeps, results should be consumed as they complete rather
+than collected into a list. `stream()` executes tasks via
+`Runner.imap_unordered()`, passing each outcome to one or more sinks and
+then yielding it:
+
+>>> sinks = [ csv_output("gtfrac.csv", context), jsonl_output("gtfrac.jsonl") ]
+>>> for outcome in stream(runner, tasks, sinks, window=32):
+...     pass
+
+Tasks are consumed lazily and at most `window` tasks are in flight, with
+only the tasks of in-flight points retained. Each sink converts results to
+compact records as they arrive and writes these in batches of `batch_size`
+records (or after `interval` seconds), so that peak memory depends on the
+window and batch sizes rather than on the number of points. Sinks are
+flushed and closed when the stream finishes or is interrupted. A yielded
+outcome may therefore still be buffered, and is only guaranteed to be
+written once the stream has finished.
+
+Custom sinks may be created by subclassing `Sink` and implementing
+`prepare()` and `_write()`.
+"""
+import os
+import csv
+import json
+import time
+from collections import OrderedDict
+
+
+class Sink(object):
+    """
+    Base class of result sinks. Records are buffered and written in batches.
+
+    Params
+    ------
+    batch_size: int
+        Number of records buffered before they are written.
+    interval: float
+        Seconds after which buffered records are written regardless of
+        `batch_size`. `None` to only write full batches.
+    """
+    def __init__(self, batch_size=100, interval=5.):
+        self.batch_size = max(int(batch_size), 1)
+        self.interval = interval
+        self._pending = []
+        self._last = time.time()
+
+    def open(self, append=False):
+        """
+        Prepares the sink for writing, returning itself.
+
+        Params
+        ------
+        append: bool
+            If `True`, records are appended to any existing output.
+        """
+        return self
+
+    def prepare(self, index, results, error=None, task=None):
+        """
+        Returns the record buffered for a single outcome.
+
+        Params
+        ------
+        index: int
+            Index of the point.
+        results: Results
+            Results returned from `Context.execute()`, or `None` where
+            execution raised an exception.
+        error: Exception
+            The exception raised, where `results` is `None`.
+        task: dict
+            The task executed (refer to `tawnycalc.runner.Runner`).
+        """
+        raise NotImplementedError
+
+    def _write(self, records):
+        """
+        Writes a batch of records returned by `prepare()`.
+        """
+        raise NotImplementedError
+
+    def write(self, index, results, error=None, task=None):
+        """
+        Buffers a single outcome, writing the buffered records where the
+        batch is full. Refer to `prepare()` for parameters.
+        """
+        self._pending.append(self.prepare(index, results, error, task))
+        if len(self._pending) >= self.batch_size or \
+           (self.interval is not None and time.time() - self._last >= self.interval):
+            self.flush()
+
+    def flush(self):
+        """
+        Writes any buffered records.
+        """
+        if self._pending:
+            records, self._pending = self._pending, []
+            self._write(records)
+        self._last = time.time()
+
+    def close(self):
+        """
+        Writes any buffered records and releases the output.
+        """
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _point(results, task):
+    """
+    Returns the requested pressure and temperature of a point, taken from
+    `task` where available, otherwise from `results`.
+    """
+    from .guesses import script_point
+    P, T = script_point(task)[:2] if task is not None else (None, None)
+    if P is None and results is not None:
+        P = results.get("P")
+    if T is None and results is not None:
+        T = results.get("T")
+    return P, T
+
+
+class csv_output(Sink):
+    """
+    Appends results to a CSV file, one row per point.
+
+    Mode and `xyz` columns are derived from the context script. Any values
+    not covered by these columns are recorded as JSON in the `extra` column.
+
+    Params
+    ------
+    path: str
+        The CSV file.
+    context: tawnycalc.Context
+        The context whose script determines the columns.
+    batch_size, interval:
+        Refer to `Sink`.
+    """
+    def __init__(self, path, context, batch_size=100, interval=5.):
+        super(csv_output, self).__init__(batch_size, interval)
+        self.path = path
+        self._fp = None
+        phases = []
+        for key in ("which", "inexcess", "samecoding"):
+            values = context.script.get(key) or []
+            if not isinstance(values, list):
+                values = [values,]
+            for value in values:
+                phases.extend(phase for phase in str(value).split() if phase not in phases)
+        self.phases = phases
+        self.xyz = list(context.script.get("xyzguess", {}).keys())
+        self.columns = ["index", "P", "T", "status", "error", "phases"] + \
+                       [ "mode({})".format(phase) for phase in self.phases ] + self.xyz + ["extra",]
+
+    def completed(self, statuses=("ok",)):
+        """
+        Returns the set of point indices already recorded with one of the
+        provided `statuses`. By default only successful points are returned,
+        so that failed points are retried when resuming. Where a point is
+        recorded more than once, its last row supersedes earlier rows.
+        """
+        if not os.path.isfile(self.path):
+            return set()
+        latest = {}
+        with open(self.path, 'r', newline='') as fp:
+            for row in csv.DictReader(fp):
+                if row.get("index"):
+                    latest[int(row["index"])] = row.get("status")
+        return set( index for index, status in latest.items() if status in statuses )
+
+    def open(self, append=False):
+        exists = append and os.path.isfile(self.path) and os.path.getsize(self.path) > 0
+        self._fp = open(self.path, 'a' if append else 'w', newline='')
+        self._writer = csv.DictWriter(self._fp, fieldnames=self.columns)
+        if not exists:
+            self._writer.writeheader()
+        return self
+
+    def prepare(self, index, results, error=None, task=None):
+        P, T = _point(results, task)
+        row = OrderedDict([("index", index), ("P", P), ("T", T)])
+        extra = OrderedDict()
+        if results is None:
+            row["status"] = "failed"
+            row["error"] = "{}: {}".format(type(error).__name__, error)
+        else:
+            row["status"] = results.get("failure") or "ok"
+            row["phases"] = results.get("phases")
+            if results.get("strategy"):
+                extra["strategy"] = results["strategy"]
+            for phase, mode in (results.get("modes") or {}).items():
+                if phase in self.phases:
+                    row["mode({})".format(phase)] = mode
+                else:
+                    extra["mode({})".format(phase)] = mode
+            for key, value in (results.get("xyz") or {}).items():
+                if key in self.xyz:
+                    row[key] = value
+                else:
+                    extra[key] = value
+        if extra:
+            row["extra"] = json.dumps(extra)
+        return row
+
+    def _write(self, records):
+        if self._fp is None:
+            self.open(append=True)
+        self._writer.writerows(records)
+        self._fp.flush()
+
+    def close(self):
+        super(csv_output, self).close()
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+
+class jsonl_output(Sink):
+    """
+    Appends results to a JSON lines file, one object per point, with the
+    `index`, `P`, `T`, `status` and `error` of the point and the scalar,
+    `modes`, `xyz` and `bulk_composition` entries of its results.
+
+    Params
+    ------
+    path: str
+        The JSON lines file.
+    batch_size, interval:
+        Refer to `Sink`.
+    """
+    _scalar_keys = ("phases", "failure", "strategy", "config_hash")
+    _table_keys = ("modes", "xyz", "bulk_composition")
+
+    def __init__(self, path, batch_size=100, interval=5.):
+        super(jsonl_output, self).__init__(batch_size, interval)
+        self.path = path
+        self._fp = None
+
+    def open(self, append=False):
+        self._fp = open(self.path, 'a' if append else 'w')
+        return self
+
+    def prepare(self, index, results, error=None, task=None):
+        P, T = _point(results, task)
+        record = OrderedDict([("index", index), ("P", P), ("T", T)])
+        if results is None:
+            record["status"] = "failed"
+            record["error"] = "{}: {}".format(type(error).__name__, error)
+        else:
+            record["status"] = results.get("failure") or "ok"
+            for key in self._scalar_keys:
+                if results.get(key) is not None:
+                    record[key] = results[key]
+            for key in self._table_keys:
+                if results.get(key):
+                    record[key] = OrderedDict( (name, float(value)) for name, value in results[key].items() )
+        return json.dumps(record, separators=(",",":"))
+
+    def _write(self, records):
+        if self._fp is None:
+            self.open(append=True)
+        self._fp.write("\n".join(records) + "\n")
+        self._fp.flush()
+
+    def close(self):
+        super(jsonl_output, self).close()
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+
+class archive_output(Sink):
+    """
+    Appends serialised results (refer to `Results.to_bytes()`) to an
+    archive, one segment per point containing the file `results.bin`.
+    Segments are keyed by the `config_hash` of the results where recorded,
+    otherwise by `index:<index>`, with the index, pressure, temperature and
+    failure recorded as segment metadata.
+
+    Params
+    ------
+    archive: tawnycalc.archive.Archive or str
+        The archive, or its path.
+    raw: bool
+        If `True`, the raw `output_` entries are included.
+    batch_size, interval:
+        Refer to `Sink`.
+    """
+    def __init__(self, archive, raw=False, batch_size=100, interval=5.):
+        super(archive_output, self).__init__(batch_size, interval)
+        if not hasattr(archive, "append"):
+            from .archive import Archive
+            archive = Archive(archive)
+        self.archive = archive
+        self.raw = raw
+
+    def prepare(self, index, results, error=None, task=None):
+        P, T = _point(results, task)
+        meta = OrderedDict([("index", index), ("P", P), ("T", T)])
+        files = OrderedDict()
+        if results is None:
+            meta["failure"] = "error: {}".format(type(error).__name__)
+            meta["error"] = str(error)
+        else:
+            meta["failure"] = results.get("failure")
+            files["results.bin"] = results.to_bytes(raw=self.raw)
+        config_hash = results.get("config_hash") if results is not None else None
+        return (config_hash or "index:{}".format(index), files, meta)
+
+    def _write(self, records):
+        for config_hash, files, meta in records:
+            self.archive.append(config_hash, files, meta)
+
+
+class store_output(Sink):
+    """
+    Records results to a result store, inserting each batch within a single
+    transaction (refer to `tawnycalc.store.ResultStore.add_many()`).
+
+    Params
+    ------
+    store: tawnycalc.store.ResultStore or str
+        The store, or its path. Where a path is provided, the store is
+        closed with the sink.
+    batch_size, interval:
+        Refer to `Sink`.
+    """
+    def __init__(self, store, batch_size=100, interval=5.):
+        super(store_output, self).__init__(batch_size, interval)
+        self._owned = not hasattr(store, "add_many")
+        if self._owned:
+            from .store import ResultStore
+            store = ResultStore(store)
+        self.store = store
+
+    def prepare(self, index, results, error=None, task=None):
+        return (results, task, error)
+
+    def _write(self, records):
+        self.store.add_many(records)
+
+    def close(self):
+        super(store_output, self).close()
+        if self._owned:
+            self.store.close()
+
+
+def stream(runner, tasks, sinks=(), window=None, indices=None, append=False, **execute_kwargs):
+    """
+    Executes tasks, passing outcomes to `sinks` and yielding them as they
+    complete. Sinks buffer outcomes (refer to `Sink`), so yielded outcomes
+    are not necessarily written until the stream finishes.
+
+    Params
+    ------
+    runner: tawnycalc.runner.Runner
+        Runner used for executions.
+    tasks: iterable
+        Iterable of task dictionaries, consumed lazily.
+    sinks: sequence
+        `Sink` objects to which each outcome is written. Sinks are opened
+        before the first task is submitted, and flushed and closed when the
+        stream finishes, including where it is interrupted or closed early.
+    window: int
+        Maximum number of tasks in flight (refer to `Runner.imap_unordered()`).
+    indices: sequence
+        If provided, the point index recorded by sinks for each task, for
+        example where `tasks` is a subset of a larger sweep. Defaults to the
+        position of the task within `tasks`.
+    append: bool
+        Passed to `Sink.open()`.
+    execute_kwargs:
+        Further arguments are passed through to `Context.execute()`.
+
+    Returns
+    -------
+    outcomes: generator
+        Generator of `tawnycalc.runner.Outcome` objects, in completion
+        order, with `index` the position of the task within `tasks`.
+    """
+    inflight = {}
+    def submitted():
+        for index, task in enumerate(tasks):
+            inflight[index] = task
+            yield task
+
+    opened = []
+    try:
+        for sink in sinks:
+            opened.append(sink.open(append=append))
+        for outcome in runner.imap_unordered(submitted(), window=window, **execute_kwargs):
+            task = inflight.pop(outcome.index, None)
+            index = indices[outcome.index] if indices is not None else outcome.index
+            for sink in opened:
+                sink.write(index, outcome.results, outcome.error, task)
+            yield outcome
+    finally:
+        for sink in opened:
+            sink.close()
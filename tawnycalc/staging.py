@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+Trimmed dataset and a-x files for faster `thermocalc` start-up.
+
+`thermocalc` reads the entire dataset (for example `tc-ds62.txt`) and a-x
+file (for example `tc-mb50NCKFMASHTO.txt`) on every execution, although a
+script only requires the phases reachable from its `which`, `inexcess`
+and `samecoding` entries. Where trimming is enabled, minimal files are
+staged instead:
+
+>>> results = context.execute(trim=True)
+
+The trimmed a-x file retains only the blocks of reachable phases, and the
+trimmed dataset only the end-members referenced by those blocks or by the
+script, along with the corresponding rows and columns of the uncertainty
+matrix. Trimmed files are cached on disk per source file contents and
+phase set, so are generated once for a given model. As trimming relies on
+the layout of the source files, `trim="verify"` executes both the trimmed
+and full files and raises an exception where their results differ (refer
+to `compare()`).
+"""
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+_NAME = re.compile(r"[A-Za-z]\w*")
+_SEPARATOR = re.compile(r"^\s*%\s*=+")
+
+_parsed = {}
+_lock = threading.Lock()
+
+
+def _tokens(line):
+    return line.split("%", 1)[0].split()
+
+
+def _is_phase_header(tokens):
+    """
+    Returns `True` for a-x phase block headers such as `g  4  1`.
+    """
+    return (len(tokens) == 3 and tokens[0] != "check" and _NAME.fullmatch(tokens[0]) is not None
+            and tokens[1].isdigit() and tokens[2].isdigit())
+
+
+class axfile(object):
+    """
+    Phase blocks of an a-x file.
+
+    Params
+    ------
+    path: str
+        The a-x file.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'r', encoding="cp437") as fp:
+            self.lines = fp.read().splitlines()
+        starts, names = [], []
+        quoted = None
+        end = len(self.lines)
+        for i, line in enumerate(self.lines):
+            tokens = _tokens(line)
+            if tokens[:1] in (["header"], ["verbatim"]):
+                quoted = None if quoted == tokens[0] else (quoted or tokens[0])
+                continue
+            if quoted:
+                continue
+            if tokens[:1] == ["*"]:
+                end = i
+                break
+            if _is_phase_header(tokens):
+                starts.append(i)
+                names.append(tokens[0])
+        if not starts:
+            raise RuntimeError("No phases found in a-x file '{}'.".format(path))
+        # anything after the separator closing the final block (such as the
+        # list of pure phases) is retained regardless of the selected phases
+        tail = end
+        for i in range(end - 1, starts[-1], -1):
+            if _SEPARATOR.match(self.lines[i]):
+                tail = i + 1
+                break
+        self._references = {}
+        self.preamble = (0, starts[0])
+        self.tail = (tail, len(self.lines))
+        self.blocks = OrderedDict()
+        for name, start, stop in zip(names, starts, starts[1:] + [tail]):
+            self.blocks[name] = (start, stop)
+
+    def _names(self, span):
+        """
+        Returns the names referenced by the uncommented lines of `span`.
+        """
+        names = set()
+        quoted = None
+        for line in self.lines[span[0]:span[1]]:
+            tokens = _tokens(line)
+            if tokens[:1] in (["header"], ["verbatim"]):
+                quoted = None if quoted == tokens[0] else (quoted or tokens[0])
+                continue
+            if not quoted:
+                names.update(_NAME.findall(" ".join(tokens)))
+        return names
+
+    def references(self, phases):
+        """
+        Returns the names referenced by the blocks of `phases` and by the
+        retained tail of the file. This includes end-members, and those
+        referenced by `make` definitions.
+        """
+        key = frozenset(phases)
+        if key not in self._references:
+            names = self._names(self.tail)
+            for phase in key:
+                if phase in self.blocks:
+                    names.update(self._names(self.blocks[phase]))
+            self._references[key] = frozenset(names)
+        return set(self._references[key])
+
+    def text(self, phases):
+        """
+        Returns the contents of an a-x file containing only the blocks of
+        `phases`.
+        """
+        lines = self.lines[slice(*self.preamble)]
+        for name, span in self.blocks.items():
+            if name in phases:
+                lines.extend(self.lines[slice(*span)])
+        lines.extend(self.lines[slice(*self.tail)])
+        return "\n".join(lines) + "\n"
+
+    def write(self, path, phases):
+        """
+        Writes an a-x file containing only the blocks of `phases`.
+        """
+        with open(path, 'w', encoding="cp437") as fp:
+            fp.write(self.text(phases))
+
+
+class dataset(object):
+    """
+    End-member entries and uncertainty matrix of a dataset file.
+
+    Params
+    ------
+    path: str
+        The dataset file.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'r', encoding="cp437") as fp:
+            self.lines = fp.read().splitlines()
+        try:
+            count = int(self.lines[0].split()[0])
+        except (IndexError, ValueError):
+            raise RuntimeError("Unable to parse dataset header of '{}'.".format(path))
+        self.entries = OrderedDict()
+        i = 3
+        while len(self.entries) < count:
+            if i >= len(self.lines):
+                raise RuntimeError("Dataset '{}' ended before all {} end-members were read.".format(path, count))
+            if not self.lines[i].split():
+                i += 1
+                continue
+            self.entries[self.lines[i].split()[0]] = i
+            i += 4
+        self.first = min(self.entries.values())
+        self.matrix_start = i
+        values = []
+        while i < len(self.lines):
+            tokens = self.lines[i].split()
+            try:
+                [ float(token) for token in tokens ]
+            except ValueError:
+                break
+            values.extend(tokens)
+            i += 1
+        self.trailer = i
+        # a leading scalar, followed by the rows of the upper triangle
+        if len(values) != 1 + count*(count + 1)//2:
+            raise RuntimeError("Unrecognised uncertainty matrix layout in dataset '{}'.".format(path))
+        self.scalar = values[0]
+        self.rows = []
+        start = 1
+        for row in range(count):
+            self.rows.append(values[start:start + count - row])
+            start += count - row
+
+    def text(self, names):
+        """
+        Returns the contents of a dataset containing only the end-members
+        `names`.
+        """
+        keep = [ index for index, name in enumerate(self.entries) if name in names ]
+        header = re.sub(r"^\s*\d+", lambda match: str(len(keep)).rjust(len(match.group(0))), self.lines[0])
+        lines = [header,] + self.lines[1:self.first]
+        for index, line in enumerate(self.entries.values()):
+            if index in keep:
+                lines.extend(self.lines[line:line+4])
+        blank = self.matrix_start
+        while blank < len(self.lines) and not self.lines[blank].split():
+            blank += 1
+        lines.extend(self.lines[self.matrix_start:blank])
+        values = [self.scalar,]
+        for row, index in enumerate(keep):
+            values.extend( self.rows[index][column - index] for column in keep[row:] )
+        for start in range(0, len(values), 30):
+            lines.append(" " + " ".join(values[start:start+30]))
+        lines.append("")
+        lines.extend(self.lines[self.trailer:])
+        return "\n".join(lines) + "\n"
+
+    def write(self, path, names):
+        """
+        Writes a dataset containing only the end-members `names`.
+        """
+        with open(path, 'w', encoding="cp437") as fp:
+            fp.write(self.text(names))
+
+
+def _parse(cls, path):
+    """
+    Returns the parsed file, cached by path and contents.
+    """
+    from .sweep import _digests
+    key = (cls, path, _digests(path))
+    with _lock:
+        if key not in _parsed:
+            _parsed[key] = cls(path)
+        return _parsed[key]
+
+
+def required(dataset_path, axfile_path, script):
+    """
+    Returns the a-x phases and dataset end-members required by `script`.
+
+    Params
+    ------
+    dataset_path, axfile_path: str
+        The full dataset and a-x files.
+    script: dict
+        The script, for example `Context.script`.
+
+    Returns
+    -------
+    phases: set
+        Names of the a-x phases reachable from the `which`, `inexcess` and
+        `samecoding` entries.
+    endmembers: set
+        Names of the dataset end-members referenced by these phases or by
+        any script entry.
+    """
+    from .guesses import script_phases
+    from .sweep import _value_text
+    ds = _parse(dataset, dataset_path)
+    ax = _parse(axfile, axfile_path)
+    phases = script_phases(script) & set(ax.blocks)
+    names = ax.references(phases)
+    for value in script.values():
+        names.update(_NAME.findall(_value_text(value)))
+    return phases, names & set(ds.entries)
+
+
+def trimmed(dataset_path, axfile_path, script, cache_dir=None):
+    """
+    Returns trimmed dataset and a-x files for `script`, generating these
+    where not already cached.
+
+    Params
+    ------
+    dataset_path, axfile_path: str
+        The full dataset and a-x files.
+    script: dict
+        The script, for example `Context.script`.
+    cache_dir: str
+        Location of cached files. Defaults to the `TAWNYCALC_TRIM_CACHE`
+        environment variable where set, otherwise a standard temporary
+        location.
+
+    Returns
+    -------
+    dataset_path, axfile_path: str
+        The trimmed files, with the same names as the full files.
+    """
+    from .sweep import _digests, _digest
+    phases, names = required(dataset_path, axfile_path, script)
+    key = _digest("\n".join([_digests(dataset_path), _digests(axfile_path),
+                             " ".join(sorted(phases)), " ".join(sorted(names))]))
+    if not cache_dir:
+        cache_dir = os.environ.get("TAWNYCALC_TRIM_CACHE") or os.path.join(tempfile.gettempdir(), "tawnycalc_trimmed")
+    directory = os.path.join(cache_dir, key)
+    outputs = (os.path.join(directory, os.path.basename(dataset_path)),
+               os.path.join(directory, os.path.basename(axfile_path)))
+    if not all(os.path.isfile(path) for path in outputs):
+        os.makedirs(directory, exist_ok=True)
+        for path, source, keep in zip(outputs, (dataset, axfile), (names, phases)):
+            temp = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+            _parse(source, dataset_path if source is dataset else axfile_path).write(temp, keep)
+            os.replace(temp, path)
+    return outputs
+
+
+def compare(results, reference, tol=1e-6):
+    """
+    Compares the results of trimmed and full executions.
+
+    Params
+    ------
+    results, reference: dict
+        Results returned from `Context.execute()`.
+    tol: float
+        Absolute tolerance of numeric values.
+
+    Returns
+    -------
+    differences: list
+        Descriptions of each difference. Empty where the results agree.
+    """
+    differences = []
+    for key in ("failure", "phases"):
+        if results.get(key) != reference.get(key):
+            differences.append("{}: {!r} != {!r}".format(key, results.get(key), reference.get(key)))
+    for key in ("P", "T"):
+        a, b = results.get(key), reference.get(key)
+        if (a is None) != (b is None) or (a is not None and abs(a - b) > tol):
+            differences.append("{}: {!r} != {!r}".format(key, a, b))
+    for key in ("modes", "xyz"):
+        a, b = results.get(key) or {}, reference.get(key) or {}
+        for name in sorted(set(a) | set(b)):
+            if name not in a or name not in b or abs(a[name] - b[name]) > tol:
+                differences.append("{}[{}]: {!r} != {!r}".format(key, name, a.get(name), b.get(name)))
+    return differences
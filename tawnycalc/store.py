@@ -0,0 +1,475 @@
+# -*- coding: utf-8 -*-
+"""
+Indexed store of execution results.
+
+Results are recorded to an SQLite database with one row per execution in
+the `runs` table, and its phases, modes, `xyz` values and bulk composition
+in the `phases`, `modes`, `xyz` and `bulk` tables respectively. Runs are
+indexed on pressure, temperature, assemblage and configuration hash, so
+that sweeps may be queried without loading every result:
+
+>>> store = ResultStore("gtfrac.sqlite")
+>>> for outcome in store.record(runner.imap_unordered(tasks), tasks):
+...     pass
+>>> found = store.query(P=(10,12), contains=("g","bi"), modes={"g":(0.05,None)},
+...                     columns=("mode(g)", "x(g)"))
+>>> found["P"], found["T"], found["mode(g)"]
+
+Queries return dictionaries of NumPy arrays. Outcomes are inserted in
+batches, each within a single transaction. As with
+`tawnycalc.guesses.GuessLibrary`, the database may be shared between
+threads and processes.
+"""
+import re
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from .runner import assemblage as _assemblage
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    P REAL, T REAL, assemblage TEXT, phases TEXT, failure TEXT,
+    config_hash TEXT, strategy TEXT, time REAL, data BLOB);
+CREATE TABLE IF NOT EXISTS phases (
+    phase TEXT, run INTEGER, PRIMARY KEY (phase, run)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS modes (
+    run INTEGER, phase TEXT, value REAL, PRIMARY KEY (run, phase)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS xyz (
+    run INTEGER, name TEXT, value REAL, PRIMARY KEY (run, name)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS bulk (
+    run INTEGER, oxide TEXT, value REAL, PRIMARY KEY (run, oxide)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS runs_P ON runs (P);
+CREATE INDEX IF NOT EXISTS runs_T ON runs (T);
+CREATE INDEX IF NOT EXISTS runs_assemblage ON runs (assemblage);
+CREATE INDEX IF NOT EXISTS runs_config_hash ON runs (config_hash);
+CREATE INDEX IF NOT EXISTS modes_phase ON modes (phase, run, value);
+CREATE INDEX IF NOT EXISTS xyz_name ON xyz (name, run, value);
+CREATE INDEX IF NOT EXISTS bulk_oxide ON bulk (oxide, run, value);
+"""
+
+# run columns which may be requested from `query`, of which text columns
+# are cached as integer codes
+_RUN_COLUMNS = ("id", "P", "T", "assemblage", "phases", "failure", "config_hash", "strategy", "time")
+_TEXT_COLUMNS = ("assemblage", "phases", "failure", "config_hash", "strategy")
+_COLUMN = re.compile(r"^(mode|bulk)\((.+)\)$")
+_CHILD_TABLES = ("phases", "modes", "xyz", "bulk")
+
+
+class _numeric(object):
+    """
+    Cached numeric column.
+    """
+    def __init__(self):
+        self.values = np.zeros(0)
+
+    def append(self, values):
+        self.values = np.concatenate([self.values, np.array(values, dtype=np.float64)])
+
+    def take(self, indices):
+        return self.values[indices]
+
+
+class _encoded(object):
+    """
+    Cached text column, recorded as integer codes into the list of distinct
+    values. `None` is recorded as code `-1`.
+    """
+    def __init__(self):
+        self.codes = np.zeros(0, dtype=np.int32)
+        self.names = []
+        self._index = {}
+
+    def _code(self, value):
+        if value is None:
+            return -1
+        if value not in self._index:
+            self._index[value] = len(self.names)
+            self.names.append(value)
+        return self._index[value]
+
+    def append(self, values):
+        codes = np.array([ self._code(value) for value in values ], dtype=np.int32)
+        self.codes = np.concatenate([self.codes, codes])
+
+    def take(self, indices):
+        return np.array(self.names + [None,], dtype=object)[self.codes[indices]]
+
+
+def canonical(assemblage):
+    """
+    Returns the assemblage with phases sorted, as recorded in the store.
+    For example `"H2O bi g mu q"`.
+    """
+    if assemblage is None:
+        return None
+    if not isinstance(assemblage, str):
+        assemblage = " ".join(assemblage)
+    return " ".join(sorted(assemblage.split()))
+
+
+class ResultStore(object):
+    """
+    Persistent, indexed store of execution results.
+
+    Params
+    ------
+    path: str
+        SQLite database file. Created if it does not exist.
+    keep_results: bool
+        If `True`, the complete results (refer to `Results.to_bytes()`) are
+        also recorded, and may be retrieved with `results()`.
+    """
+    def __init__(self, path, keep_results=False):
+        self.path = path
+        self.keep_results = bool(keep_results)
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, timeout=60., check_same_thread=False)
+        with self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(_SCHEMA)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._last = 0
+        self._run_columns = OrderedDict()
+        self._child_columns = OrderedDict()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT count(*) FROM runs").fetchone()[0]
+
+    def _insert(self, results, task=None, error=None, children=None):
+        """
+        Inserts a single run within the current transaction, returning its
+        id. Rows of the `phases`, `modes`, `xyz` and `bulk` tables are
+        appended to the lists of `children` (keyed by table) for insertion
+        with `_insert_children`.
+        """
+        P = T = None
+        if results is not None and "P" in results and "T" in results:
+            P, T = float(results["P"]), float(results["T"])
+        elif task is not None:
+            from .guesses import script_point
+            P, T = script_point(task)[:2]
+        if results is None:
+            failure = "error: {}".format(type(error).__name__ if error is not None else "unknown")
+            results = {}
+        else:
+            failure = results.get("failure")
+        assemblage = _assemblage(results)
+        data = None
+        if self.keep_results and hasattr(results, "to_bytes"):
+            data = sqlite3.Binary(results.to_bytes())
+        cursor = self._db.execute("INSERT INTO runs (P, T, assemblage, phases, failure, config_hash, strategy, time, data) "
+                                  "VALUES (?,?,?,?,?,?,?,?,?)",
+                                  (P, T, canonical(assemblage), results.get("phases"), failure,
+                                   results.get("config_hash"), results.get("strategy"), time.time(), data))
+        run = cursor.lastrowid
+        if assemblage:
+            children["phases"].extend( (phase, run) for phase in set(assemblage.split()) )
+        for table, key in (("modes", "modes"), ("xyz", "xyz"), ("bulk", "bulk_composition")):
+            values = results.get(key)
+            if values:
+                children[table].extend( (run, name, float(value)) for name, value in values.items() )
+        return run
+
+    def _insert_children(self, children):
+        self._db.executemany("INSERT OR IGNORE INTO phases (phase, run) VALUES (?,?)", children["phases"])
+        for table, column in (("modes", "phase"), ("xyz", "name"), ("bulk", "oxide")):
+            self._db.executemany("INSERT OR REPLACE INTO {} (run, {}, value) VALUES (?,?,?)".format(table, column),
+                                 children[table])
+
+    def add(self, results, task=None):
+        """
+        Adds the results of a single execution.
+
+        Params
+        ------
+        results: dict
+            Results returned from `Context.execute()`.
+        task: dict
+            The task executed (refer to `tawnycalc.runner.Runner`). Where
+            the results do not record a pressure and temperature, these are
+            taken from the task.
+
+        Returns
+        -------
+        id: int
+            The id of the recorded run.
+        """
+        return self.add_many([(results, task)])[0]
+
+    def add_many(self, items):
+        """
+        Adds the results of many executions within a single transaction.
+
+        Params
+        ------
+        items: iterable
+            Results, `(results, task)` pairs (refer to `add`), or
+            `(results, task, error)` triples. Results may be `None` for
+            executions which raised an exception, in which case a run is
+            recorded with its `failure` set.
+
+        Returns
+        -------
+        ids: list
+            The ids of the recorded runs.
+        """
+        ids = []
+        children = { table:[] for table in _CHILD_TABLES }
+        with self._lock, self._db:
+            for item in items:
+                if isinstance(item, tuple):
+                    ids.append(self._insert(*item, children=children))
+                else:
+                    ids.append(self._insert(item, children=children))
+            self._insert_children(children)
+        return ids
+
+    def record(self, outcomes, tasks=None, batch_size=1000):
+        """
+        Records outcomes as they are yielded, in batches.
+
+        Params
+        ------
+        outcomes: iterable
+            `tawnycalc.runner.Outcome` objects, for example as returned by
+            `Runner.imap_unordered()`.
+        tasks: sequence
+            The tasks executed, indexed by `Outcome.index`. Used where
+            results do not record a pressure and temperature.
+        batch_size: int
+            Number of outcomes inserted per transaction.
+
+        Returns
+        -------
+        outcomes: generator
+            The provided outcomes, yielded once recorded. Where the generator
+            is closed early, outcomes received but not yet recorded are
+            recorded.
+        """
+        batch = []
+        try:
+            for outcome in outcomes:
+                batch.append(outcome)
+                if len(batch) >= batch_size:
+                    # reset before yielding, so a batch is never recorded twice
+                    recorded, batch = batch, []
+                    self._record(recorded, tasks)
+                    for item in recorded:
+                        yield item
+        finally:
+            if batch:
+                self._record(batch, tasks)
+        for item in batch:
+            yield item
+
+    def _record(self, batch, tasks):
+        children = { table:[] for table in _CHILD_TABLES }
+        with self._lock, self._db:
+            for outcome in batch:
+                task = tasks[outcome.index] if tasks is not None else None
+                self._insert(outcome.results, task, outcome.error, children)
+            self._insert_children(children)
+
+    def _refresh(self):
+        """
+        Appends runs recorded since the last call (possibly by other
+        processes) to the cached columns. Runs are never removed and ids
+        only increase, so cached columns remain aligned with `_ids`.
+        """
+        last = self._db.execute("SELECT max(id) FROM runs").fetchone()[0] or 0
+        if last == self._last:
+            return
+        names = list(self._run_columns)
+        rows = self._db.execute("SELECT {} FROM runs WHERE id > ? AND id <= ? ORDER BY id".format(
+                                ", ".join(["id",] + names)), (self._last, last)).fetchall()
+        columns = list(zip(*rows))
+        ids = np.array(columns[0], dtype=np.int64)
+        for name, values in zip(names, columns[1:]):
+            self._run_columns[name].append(values)
+        for key, column in self._child_columns.items():
+            column.append(self._load_child(key, ids, self._last, last))
+        self._ids = np.concatenate([self._ids, ids])
+        self._last = last
+
+    def _load_child(self, key, ids, first, last):
+        """
+        Returns the values of child column `key` for runs `ids` (with ids
+        in `(first,last]`), being `nan` where absent.
+        """
+        table, column, name = key
+        values = np.full(len(ids), np.nan)
+        rows = self._db.execute("SELECT run, value FROM {} WHERE {} = ? AND run > ? AND run <= ?".format(table, column),
+                                (name, first, last)).fetchall()
+        if rows:
+            runs, found = (np.array(items) for items in zip(*rows))
+            values[np.searchsorted(ids, runs.astype(np.int64))] = found.astype(np.float64)
+        return values
+
+    def _run_column(self, name):
+        """
+        Returns the cached run column `name`, loading it where necessary.
+        """
+        if name not in self._run_columns:
+            column = _encoded() if name in _TEXT_COLUMNS else _numeric()
+            rows = self._db.execute("SELECT {} FROM runs WHERE id <= ? ORDER BY id".format(name), (self._last,))
+            column.append([ row[0] for row in rows ])
+            self._run_columns[name] = column
+        return self._run_columns[name]
+
+    def _child_column(self, table, column, name):
+        """
+        Returns the cached values of `name` from child `table`, loading them
+        where necessary.
+        """
+        key = (table, column, name)
+        if key not in self._child_columns:
+            self._child_columns[key] = _numeric()
+            self._child_columns[key].append(self._load_child(key, self._ids, 0, self._last))
+        return self._child_columns[key].values
+
+    def query(self, P=None, T=None, assemblage=None, contains=None, modes=None, xyz=None, config_hash=None,
+              include_failed=False, columns=(), limit=None):
+        """
+        Returns the recorded runs satisfying all provided constraints.
+
+        Ranges are provided as `(min, max)` pairs, with `None` for open
+        bounds, or as a single value for equality.
+
+        Constraints are evaluated by SQLite, using the indexes of the run
+        and child tables. Returned columns are taken from columns cached in
+        memory, which are loaded on first use and thereafter only extended
+        with new runs.
+
+        Params
+        ------
+        P, T: tuple
+            Pressure and temperature ranges.
+        assemblage: str
+            Only runs of exactly this assemblage (in any order).
+        contains: iterable
+            Only runs whose assemblage contains all of these phases.
+        modes: dict
+            Ranges of modes keyed by phase. Runs are only selected where
+            the phase has a recorded mode.
+        xyz: dict
+            Ranges of `xyz` values keyed by name, for example `"x(g)"`.
+        config_hash: str
+            Only runs of this configuration hash.
+        include_failed: bool
+            If `True`, runs recording a `failure` are also returned.
+        columns: iterable
+            Further columns to return. These may be `"mode(<phase>)"`,
+            `"bulk(<oxide>)"`, an `xyz` name, or one of the run columns
+            `assemblage`, `phases`, `failure`, `config_hash`, `strategy`
+            and `time`.
+        limit: int
+            Maximum number of runs returned.
+
+        Returns
+        -------
+        found: OrderedDict
+            Arrays keyed by column, always including `id`, `P` and `T`,
+            ordered by id. Numeric values absent for a run are `nan`. Text
+            columns are returned as object arrays.
+        """
+        def within(column, value):
+            low, high = value if isinstance(value, (tuple, list)) else (value, value)
+            clauses, params = [], []
+            if low is not None:
+                clauses.append("{} >= ?".format(column))
+                params.append(float(low))
+            if high is not None:
+                clauses.append("{} <= ?".format(column))
+                params.append(float(high))
+            return clauses or ["{} IS NOT NULL".format(column)], params
+
+        def child(name):
+            match = _COLUMN.match(name)
+            if match and match.group(1) == "mode":
+                return self._child_column("modes", "phase", match.group(2))
+            if match:
+                return self._child_column("bulk", "oxide", match.group(2))
+            return self._child_column("xyz", "name", name)
+
+        with self._lock:
+            clauses, params = [], []
+            if not include_failed:
+                clauses.append("failure IS NULL")
+            for name, value in (("P", P), ("T", T)):
+                if value is not None:
+                    found = within(name, value)
+                    clauses.extend(found[0])
+                    params.extend(found[1])
+            if assemblage is not None:
+                clauses.append("assemblage = ?")
+                params.append(canonical(assemblage))
+            if contains:
+                for phase in sorted(set([contains,] if isinstance(contains, str) else contains)):
+                    clauses.append("id IN (SELECT run FROM phases WHERE phase = ?)")
+                    params.append(phase)
+            if config_hash is not None:
+                clauses.append("config_hash = ?")
+                params.append(config_hash)
+            for table, column, values in (("modes", "phase", modes), ("xyz", "name", xyz)):
+                for name, value in (values or {}).items():
+                    found = within("value", value)
+                    clauses.append("id IN (SELECT run FROM {} WHERE {} = ? AND {})".format(
+                                   table, column, " AND ".join(found[0])))
+                    params.extend([name,] + found[1])
+            sql = "SELECT id FROM runs WHERE {} ORDER BY id".format(" AND ".join(clauses or ["1",]))
+            if limit is not None:
+                sql += " LIMIT ?"
+                params.append(int(limit))
+            ids = np.array([ row[0] for row in self._db.execute(sql, params) ], dtype=np.int64)
+            # runs recorded after the query are absent from `ids`, so cached columns cover all selected runs
+            self._refresh()
+            selected = np.searchsorted(self._ids, ids)
+            found = OrderedDict([("id", self._ids[selected])])
+            for name in ["P", "T"] + [ column for column in columns if column not in ("id", "P", "T") ]:
+                if name in _RUN_COLUMNS:
+                    found[name] = self._run_column(name).take(selected)
+                else:
+                    found[name] = child(name)[selected]
+        return found
+
+    def count(self, **constraints):
+        """
+        Returns the number of runs satisfying the constraints of `query`.
+        """
+        return len(self.query(**constraints)["id"])
+
+    def assemblages(self, include_failed=False):
+        """
+        Returns the number of runs of each recorded assemblage, most
+        frequent first.
+        """
+        sql = "SELECT assemblage, count(*) FROM runs WHERE assemblage IS NOT NULL"
+        if not include_failed:
+            sql += " AND failure IS NULL"
+        sql += " GROUP BY assemblage ORDER BY count(*) DESC"
+        with self._lock:
+            return OrderedDict(self._db.execute(sql).fetchall())
+
+    def results(self, id):
+        """
+        Returns the complete results of run `id`, where recorded with
+        `keep_results` enabled.
+        """
+        from .data_objects import Results
+        with self._lock:
+            row = self._db.execute("SELECT data FROM runs WHERE id = ?", (int(id),)).fetchone()
+        if row is None:
+            raise KeyError(id)
+        if row[0] is None:
+            raise RuntimeError("Complete results were not recorded for run {}.".format(id))
+        return Results.from_bytes(bytes(row[0]))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
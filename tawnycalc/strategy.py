@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+"""
+Adaptive escalation between targeted calculations and `dogmin`.
+
+Scripts such as `tc-gtfrac.txt` enable Gibbs energy minimisation over all
+candidate assemblages (`dogmin yes`) for every calculation. Across a grid
+most points lie within a field whose assemblage has already been
+established at a neighbouring point, and a calculation of that assemblage
+alone is much cheaper. The `Adaptive` strategy first attempts such a
+targeted calculation, escalating to the original `dogmin` script only
+where the targeted result fails or is inconsistent:
+
+>>> strategy = Adaptive()
+>>> runner = Runner(context, strategy=strategy)
+
+The expected assemblage is taken from the nearest converged neighbour,
+either the entry provided by a guess library (refer to
+`tawnycalc.guesses.GuessLibrary`) or otherwise from results previously
+established by `dogmin`. The path taken by each execution is recorded in
+the `strategy` entry of its results:
+
+* `targeted`: the targeted calculation was accepted.
+* `confirmed`: the targeted calculation was checked against `dogmin`,
+  which found the same assemblage.
+* `escalated`: the targeted calculation was rejected (or not attempted
+  near a field boundary) and `dogmin` used.
+* `direct`: no neighbour was available (or the script does not use
+  `dogmin`), so the script was executed unchanged.
+
+A targeted calculation converges to the expected assemblage even where it
+is metastable, and so cannot itself detect a phase entering the
+assemblage. The stability of targeted results is therefore established as
+follows:
+
+* Only assemblages found by `dogmin` are used as neighbours, so a
+  metastable targeted result is never propagated to further points.
+* A targeted calculation is only attempted where the point is bracketed
+  by `dogmin` neighbours within `max_distance` (it lies within their convex
+  hull in scaled pressure and temperature) which all agree on the
+  assemblage. Otherwise, for example near a field boundary or beyond the
+  points calculated so far, `dogmin` is used.
+* Every `confirm_every`-th targeted calculation is repeated with `dogmin`,
+  and the `dogmin` results used.
+* Targeted results with modes below `min_mode` are rejected, escalating
+  points approaching a field boundary from within the field of higher
+  variance.
+
+A targeted result can therefore only be metastable within a field lying
+entirely between agreeing `dogmin` neighbours, which are no more than
+`max_distance` away. Reduce `max_distance` where fields narrower than this
+are expected.
+
+As points are only bracketed once surrounding points have been calculated,
+tasks should be ordered from coarse to fine (refer to `coarse_to_fine()`).
+Where tasks are executed in grid order, most points are calculated with
+`dogmin`.
+"""
+import threading
+from collections import deque, OrderedDict
+import numpy as np
+
+from .runner import assemblage as _assemblage
+
+TARGETED = "targeted"
+CONFIRMED = "confirmed"
+ESCALATED = "escalated"
+DIRECT = "direct"
+
+
+def uses_dogmin(script):
+    """
+    Returns `True` where `script` enables Gibbs energy minimisation.
+    """
+    value = script.get("dogmin")
+    return value is not None and str(value).split()[:1] == ["yes"]
+
+
+def targeted_script(script, assemblage):
+    """
+    Returns a copy of `script` configured to calculate `assemblage` alone,
+    with `dogmin` disabled. Phases listed in the `inexcess` entry are not
+    included in the `which` entry.
+
+    Params
+    ------
+    script: dict
+        The script, for example `Context._script`.
+    assemblage: str
+        The assemblage, for example `"g bi mu pa ru q H2O"`.
+
+    Returns
+    -------
+    script: OrderedDict
+        The targeted script. Values are shared with `script`, not copied.
+    """
+    excess = set(str(script.get("inexcess") or "").split())
+    script = OrderedDict(script)
+    script["which"] = " ".join( phase for phase in assemblage.split() if phase not in excess )
+    script["dogmin"] = "no"
+    return script
+
+
+def coarse_to_fine(points):
+    """
+    Returns an ordering of grid `points` from coarse to fine, such that each
+    successively finer level lies between the points of the levels before it.
+
+    Params
+    ------
+    points: list
+        Pressure and temperature of each point.
+
+    Returns
+    -------
+    order: list
+        Indices into `points`.
+    """
+    def level(i, count):
+        # number of times the grid index can be halved, with the first and
+        # last indices belonging to the coarsest level
+        return 64 if i in (0, count - 1) else (i & -i).bit_length() - 1
+    axes = [ sorted(set(values)) for values in zip(*points) ] if points else []
+    position = [ { value:i for i, value in enumerate(values) } for values in axes ]
+    levels = [ min( level(position[axis][value], len(axes[axis])) for axis, value in enumerate(point) )
+               for point in points ]
+    return sorted(range(len(points)), key=lambda i: -levels[i])
+
+
+def _bracketed(offsets):
+    """
+    Returns `True` where the origin lies within the convex hull of the
+    two-dimensional `offsets`.
+    """
+    offsets = np.asarray(offsets, dtype=np.float64).reshape(-1, 2)
+    if len(offsets) and np.any(np.all(np.abs(offsets) < 1e-12, axis=1)):
+        return True
+    if len(offsets) < 2:
+        return False
+    angles = np.sort(np.arctan2(offsets[:,1], offsets[:,0]))
+    gaps = np.append(np.diff(angles), 2.*np.pi - (angles[-1] - angles[0]))
+    return bool(np.max(gaps) <= np.pi + 1e-9)
+
+
+class _neighbours(object):
+    """
+    Bounded memory of accepted results, queried by scaled pressure and
+    temperature distance among results of the same bulk composition.
+    """
+    def __init__(self, scale, max_entries):
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self._groups = {}
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+
+    def _key(self, bulk):
+        return None if bulk is None else tuple(np.round(bulk, 6).tolist())
+
+    def add(self, results, bulk):
+        entry = { "P":float(results["P"]), "T":float(results["T"]), "assemblage":_assemblage(results),
+                  "xyz":OrderedDict(results.get("xyz") or {}) }
+        with self._lock:
+            group = self._groups.setdefault(self._key(bulk), deque(maxlen=self._max_entries))
+            group.append(entry)
+
+    def nearest(self, P, T, bulk, max_distance=None):
+        """
+        Returns entries within `max_distance`, nearest first, or only the
+        nearest entry where `max_distance` is `None`.
+        """
+        with self._lock:
+            entries = list(self._groups.get(self._key(bulk), ()))
+        if not entries:
+            return []
+        points = np.array([ (entry["P"], entry["T"]) for entry in entries ])
+        distances = np.linalg.norm((points - (P, T))/self.scale, axis=1)
+        order = np.argsort(distances, kind="stable")
+        if max_distance is None:
+            order = order[:1]
+        else:
+            order = order[distances[order] <= max_distance]
+        return [ dict(entries[i], distance=float(distances[i])) for i in order ]
+
+
+class Adaptive(object):
+    """
+    Execution strategy which attempts a targeted calculation of the expected
+    assemblage before escalating to `dogmin`.
+
+    Params
+    ------
+    max_distance: float
+        Neighbours further than this (in units of `scale`) are not used to
+        determine the expected assemblage, and the script is executed
+        directly.
+    min_mode: float
+        Targeted results with any mode below this value are rejected.
+    confirm_every: int
+        Every `confirm_every`-th accepted targeted calculation is repeated
+        with `dogmin`, and the `dogmin` results used. If `None`, targeted
+        calculations are not confirmed.
+    validate: callable
+        If provided, called with targeted results, returning a reason for
+        rejection or `None` where the results are acceptable.
+    scale: tuple
+        Pressure and temperature scales of neighbour distances, as per
+        `tawnycalc.guesses.GuessLibrary`.
+    max_entries: int
+        Number of accepted results retained per bulk composition as
+        neighbours.
+    """
+    def __init__(self, max_distance=1., min_mode=1e-3, confirm_every=10, validate=None, scale=(1., 50.),
+                 max_entries=10000):
+        self.max_distance = max_distance
+        self.min_mode = min_mode
+        self.confirm_every = confirm_every
+        self.validate = validate
+        self._neighbours = _neighbours(scale, max_entries)
+        self._targeted = 0
+        self._lock = threading.Lock()
+
+    def expected(self, script, entry=None):
+        """
+        Returns the neighbour from which the expected assemblage is taken,
+        or `None` where no suitable neighbour exists.
+
+        Params
+        ------
+        script: dict
+            The script to be executed.
+        entry: dict
+            A guess library entry (refer to `GuessLibrary.nearest()`) or
+            results from a neighbouring point. If not provided, results
+            previously established by `dogmin` are searched.
+        """
+        return self._expected(script, entry)[0]
+
+    def _expected(self, script, entry=None):
+        """
+        Returns the neighbour from which the expected assemblage is taken
+        and `None`, or `None` and the reason for executing `dogmin` where
+        the assemblage is not established by neighbouring `dogmin` results.
+        """
+        from .guesses import script_point
+        P, T, bulk = script_point(script)
+        nearby = []
+        if P is not None and T is not None:
+            nearby = self._neighbours.nearest(P, T, bulk, self.max_distance)
+            if entry is None and nearby:
+                entry = nearby[0]
+        if entry is None or not (entry.get("assemblage") or _assemblage(entry)):
+            return None, None
+        if self.max_distance is not None and entry.get("distance", 0.) > self.max_distance:
+            return None, None
+        expected = set((entry.get("assemblage") or _assemblage(entry)).split())
+        if any( set(other["assemblage"].split()) != expected for other in nearby ):
+            return None, "boundary"
+        offsets = [ ((other["P"] - P)/self._neighbours.scale[0], (other["T"] - T)/self._neighbours.scale[1])
+                    for other in nearby ]
+        if not _bracketed(offsets):
+            return None, "unbracketed"
+        return entry, None
+
+    def rejection(self, results, assemblage):
+        """
+        Returns the reason for rejecting targeted `results` of the expected
+        `assemblage`, or `None` where they are acceptable.
+        """
+        if results.get("failure"):
+            return "failure"
+        if "P" not in results or "T" not in results or not results.get("phases"):
+            return "incomplete"
+        if set(_assemblage(results).split()) != set(assemblage.split()):
+            return "assemblage"
+        modes = results.get("modes") or {}
+        if any( float(mode) < self.min_mode for mode in modes.values() ):
+            return "modes"
+        if self.validate is not None:
+            return self.validate(results)
+        return None
+
+    def execute(self, context, entry=None, metrics=None, **execute_kwargs):
+        """
+        Executes `context`, first attempting a targeted calculation.
+
+        Params
+        ------
+        context: tawnycalc.Context
+            The context to execute. Its script is restored before returning.
+        entry: dict
+            Neighbour from which the expected assemblage is taken (refer to
+            `expected()`).
+        metrics: tawnycalc.metrics.Metrics
+            If provided, the path taken is counted as `strategy_<path>`, and
+            the reason for each escalation as `escalations_<reason>`.
+        execute_kwargs:
+            Further arguments are passed through to `Context.execute()`.
+
+        Returns
+        -------
+        results: Results
+            Results of the accepted execution, with the `strategy` entry set.
+        """
+        from .guesses import script_point
+        original = context._script
+        dogmin = uses_dogmin(original)
+        entry, reason = self._expected(original, entry) if dogmin else (None, None)
+        path = ESCALATED if reason else DIRECT
+        results = None
+        if entry is not None:
+            expected = entry.get("assemblage") or _assemblage(entry)
+            context._script = targeted_script(original, expected)
+            try:
+                context.set_guesses(entry)
+                results = context.execute(metrics=metrics, **execute_kwargs)
+            finally:
+                context._script = original
+            reason = self.rejection(results, expected)
+            if reason is None:
+                path = TARGETED
+                if self._confirm():
+                    confirmation = context.execute(metrics=metrics, **execute_kwargs)
+                    if self.rejection(confirmation, expected) in (None, "modes"):
+                        path = CONFIRMED
+                    else:
+                        path = ESCALATED
+                        reason = "confirmation"
+                    results = confirmation
+            else:
+                path = ESCALATED
+                results = None
+        if reason is not None and metrics is not None:
+            metrics.increment("escalations_{}".format(reason))
+        if results is None:
+            results = context.execute(metrics=metrics, **execute_kwargs)
+        results["strategy"] = path
+        if metrics is not None:
+            metrics.increment("strategy_{}".format(path))
+        # only assemblages established by dogmin are used as neighbours
+        if dogmin and path != TARGETED and \
+           not results.get("failure") and results.get("phases") and "P" in results and "T" in results:
+            self._neighbours.add(results, script_point(original)[2])
+        return results
+
+    def _confirm(self):
+        """
+        Returns `True` where the current targeted calculation is to be
+        confirmed with `dogmin`.
+        """
+        if not self.confirm_every:
+            return False
+        with self._lock:
+            self._targeted += 1
+            return self._targeted % self.confirm_every == 0
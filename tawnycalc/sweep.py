@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+"""
+Stored sweeps with incremental recomputation.
+
+A `Sweep` records, for each task, the results obtained and a fingerprint
+of every configuration entry the calculation depended on: each `prefs`
+entry, each script entry (after the task is applied), the parts of the
+dataset and a-x files used by the script, and the `Context.execute()`
+arguments which affect results (such as `trim`, `detectors` and
+`timeout`). When the sweep is run again, only points whose dependencies
+have changed are recomputed, with the remaining results reused from the
+stored sweep:
+
+>>> sweep = tawnycalc.sweep.run(context, tasks, "gtfrac.sweep")
+>>> context.script["which"] = "g bi mu chl"   # invalidates every point
+>>> sweep = tawnycalc.sweep.run(context, tasks, "gtfrac.sweep")
+
+Changing the `setPwindow` entry of a single task only invalidates that
+point, while changing base script entries such as `which` or `rbi`
+invalidates all points. Starting guesses (`xyzguess`) for phases which
+are not considered by a point, and a-x file phase blocks or dataset
+end-members which its script does not use (refer to
+`tawnycalc.staging.required()`), do not invalidate it. Stored sweeps are
+matched by their dependencies rather than position, so tasks may also be
+added, removed or reordered.
+"""
+import os
+import pickle
+import hashlib
+from collections import OrderedDict
+
+from .runner import Runner, apply_task
+from .data_objects import rbi
+
+VERSION = 1
+
+# entries which do not affect results
+DEFAULT_IGNORE = ("prefs:scriptfile",)
+
+# `Context.execute()` arguments which do not affect results
+EXECUTE_IGNORE = ("print_output", "copy_new_files", "datasets_dir", "metrics", "on_spawn", "archive")
+
+
+def _value_text(value):
+    """
+    Returns the script text for an entry value, with whitespace normalised.
+    """
+    if isinstance(value, rbi):
+        text = str(value)
+    elif isinstance(value, list):
+        text = "\n".join(" ".join(str(part) for part in item) if isinstance(item, list) else str(item) for item in value)
+    elif isinstance(value, dict):
+        text = "\n".join("{} {}".format(key, " ".join(str(part) for part in item) if isinstance(item, list) else item)
+                         for key, item in value.items())
+    else:
+        text = str(value)
+    return "\n".join(" ".join(line.split()) for line in text.splitlines())
+
+
+def _digest(text):
+    if isinstance(text, str):
+        text = text.encode()
+    return hashlib.sha1(text).hexdigest()[:16]
+
+
+class _file_digests(object):
+    """
+    Caches digests of file contents by path, size and modification time.
+    """
+    def __init__(self):
+        self._cache = {}
+
+    def __call__(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        if key not in self._cache:
+            with open(path, 'rb') as fp:
+                self._cache[key] = _digest(fp.read())
+        return self._cache[key]
+
+
+_digests = _file_digests()
+
+# digests of the parts of files used, keyed by file digest and selection
+_partial = {}
+
+
+def _execute_text(value):
+    """
+    Returns text identifying an `execute()` argument value, for example a
+    list of failure detectors.
+    """
+    from .failures import detector
+    if isinstance(value, (list, tuple)):
+        return "\n".join(_execute_text(item) for item in value)
+    if isinstance(value, detector):
+        test = value.pattern.pattern if value.pattern is not None else _execute_text(value.predicate)
+        return "{} {} {}".format(value.reason, test, value.count)
+    if callable(value):
+        return "{}.{}".format(getattr(value, "__module__", ""), getattr(value, "__qualname__", repr(value)))
+    return str(value)
+
+
+def _file_dependencies(script, dataset_path, axfile_path):
+    """
+    Returns digests of the parts of the dataset and a-x files used by
+    `script`, or of the entire files where these cannot be parsed.
+    """
+    from .staging import required, dataset, axfile, _parse
+    try:
+        phases, names = required(dataset_path, axfile_path, script)
+    except (RuntimeError, ValueError, IndexError, UnicodeDecodeError):
+        return _digests(dataset_path), _digests(axfile_path)
+    found = []
+    for cls, path, keep in ((dataset, dataset_path, names), (axfile, axfile_path, phases)):
+        key = (_digests(path), frozenset(keep))
+        if key not in _partial:
+            _partial[key] = _digest(_parse(cls, path).text(keep))
+        found.append(_partial[key])
+    return tuple(found)
+
+
+def _find(context, filename, datasets_dir=None):
+    for directory in (datasets_dir, context.scripts_dir, os.path.join(os.path.dirname(__file__), "datasets")):
+        if directory and os.path.isfile(os.path.join(directory, filename)):
+            return os.path.join(directory, filename)
+    return None
+
+
+def dependencies(context, task=None, ignore=DEFAULT_IGNORE, datasets_dir=None, execute_kwargs=None):
+    """
+    Returns the fingerprints of the configuration entries a calculation
+    depends on.
+
+    Params
+    ------
+    context: tawnycalc.Context
+        The model configuration.
+    task: dict
+        Script entries applied to the context script (refer to
+        `tawnycalc.runner.Runner`).
+    ignore: tuple
+        Dependency keys (as returned) to exclude.
+    datasets_dir: str
+        Location of datasets, as per `Context.execute()`.
+    execute_kwargs: dict
+        Arguments passed to `Context.execute()`. Those affecting results
+        (all except `EXECUTE_IGNORE`) are included, unless `None` or `False`.
+
+    Returns
+    -------
+    dependencies: OrderedDict
+        Digests keyed by `prefs:<key>`, `script:<key>`, `file:<name>` and
+        `execute:<argument>`. `xyzguess` entries are keyed individually as
+        `script:xyzguess:<name>`.
+    """
+    from .guesses import script_phases
+    script = apply_task(context._script, task or {})
+    phases = script_phases(script)
+    found = OrderedDict()
+    for key, value in context.prefs.items():
+        found["prefs:" + key] = _digest(_value_text(value))
+    for key, value in script.items():
+        if key == "xyzguess" and isinstance(value, dict):
+            for name, guess in value.items():
+                phase = name[name.find("(")+1:-1] if name.endswith(")") and "(" in name else None
+                if phase is None or phase in phases:
+                    found["script:xyzguess:" + name] = _digest(_value_text(guess))
+        else:
+            found["script:" + key] = _digest(_value_text(value))
+    names = []
+    if context.prefs.get("dataset"):
+        names.append("tc-ds{}.txt".format(context.prefs["dataset"]))
+    if script.get("axfile"):
+        names.append("tc-{}.txt".format(script["axfile"]))
+    paths = [ _find(context, name, datasets_dir) for name in names ]
+    if len(paths) == 2 and all(paths):
+        digests = _file_dependencies(script, *paths)
+    else:
+        digests = [ _digests(path) if path else None for path in paths ]
+    for name, digest in zip(names, digests):
+        found["file:" + name] = digest
+    for key, value in sorted((execute_kwargs or {}).items()):
+        if key not in EXECUTE_IGNORE and value is not None and value is not False:
+            found["execute:" + key] = _digest(_execute_text(value))
+    for key in ignore or ():
+        found.pop(key, None)
+    return found
+
+
+def fingerprint(dependencies):
+    """
+    Returns a single digest of `dependencies` (refer to `dependencies`).
+    """
+    return _digest("\n".join("{}={}".format(key, value) for key, value in sorted(dependencies.items())))
+
+
+class Sweep(object):
+    """
+    Tasks, results and dependencies of a stored sweep.
+
+    Params
+    ------
+    tasks: list
+        Task dictionaries.
+    results: list
+        Results for each task, or `None` where unavailable.
+    dependencies: list
+        Dependencies for each task (refer to `dependencies`).
+    """
+    def __init__(self, tasks, results=None, dependencies=None):
+        self.tasks = list(tasks)
+        self.results = list(results) if results is not None else [None]*len(self.tasks)
+        self.dependencies = list(dependencies) if dependencies is not None else [None]*len(self.tasks)
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def __repr__(self):
+        done = sum(1 for item in self.results if item is not None)
+        return "Sweep({} tasks, {} results)".format(len(self.tasks), done)
+
+    def save(self, path):
+        """
+        Saves the sweep to `path`. The file is replaced atomically.
+        """
+        state = { "version":VERSION, "tasks":self.tasks, "results":self.results,
+                  "dependencies":self.dependencies }
+        temp = "{}.{}.tmp".format(path, os.getpid())
+        with open(temp, 'wb') as fp:
+            pickle.dump(state, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a sweep saved with `save`.
+        """
+        with open(path, 'rb') as fp:
+            state = pickle.load(fp)
+        if not isinstance(state, dict) or state.get("version") != VERSION:
+            raise RuntimeError("'{}' is not a compatible stored sweep.".format(path))
+        return cls(state["tasks"], state["results"], state["dependencies"])
+
+    def changes(self, context, ignore=DEFAULT_IGNORE, datasets_dir=None, execute_kwargs=None):
+        """
+        Compares the stored dependencies of each task against those of
+        `context` (refer to `dependencies()`).
+
+        Returns
+        -------
+        changes: OrderedDict
+            For each invalidated task index, the sorted list of changed
+            dependency keys. Tasks without stored results are listed with
+            an empty list.
+        """
+        changes = OrderedDict()
+        for index, task in enumerate(self.tasks):
+            current = dependencies(context, task, ignore, datasets_dir, execute_kwargs)
+            stored = self.dependencies[index]
+            if stored is None or self.results[index] is None:
+                changes[index] = []
+                continue
+            keys = set(current) | set(stored)
+            changed = sorted( key for key in keys if current.get(key) != stored.get(key) )
+            if changed:
+                changes[index] = changed
+        return changes
+
+
+def run(context, tasks, path=None, previous=None, workers=None, runner=None, retry_failed=True,
+        ignore=DEFAULT_IGNORE, save_every=100, **execute_kwargs):
+    """
+    Executes a sweep, reusing stored results whose dependencies are unchanged.
+
+    Params
+    ------
+    context: tawnycalc.Context
+        The model configuration.
+    tasks: list
+        Task dictionaries (refer to `tawnycalc.runner.Runner`).
+    path: str
+        If provided, the stored sweep is loaded from this file where it
+        exists, and the updated sweep is saved to it.
+    previous: Sweep
+        Alternatively, a previous sweep from which results may be reused.
+    workers: int
+        Number of concurrent executions.
+    runner: tawnycalc.runner.Runner
+        Runner used for executions. Created from `context` if not provided.
+    retry_failed: bool
+        If `True`, stored results recording a `failure` are recomputed.
+    ignore: tuple
+        Dependency keys which do not invalidate results.
+    save_every: int
+        Number of completed executions between saves to `path`.
+    execute_kwargs:
+        Further arguments are passed through to `Context.execute()`.
+
+    Returns
+    -------
+    sweep: Sweep
+        The completed sweep. The `recomputed` attribute lists the indices
+        of tasks which were executed.
+    """
+    tasks = [ OrderedDict(task) for task in tasks ]
+    if previous is None and path and os.path.isfile(path):
+        previous = Sweep.load(path)
+    datasets_dir = execute_kwargs.get("datasets_dir")
+    current = [ dependencies(context, task, ignore, datasets_dir, execute_kwargs) for task in tasks ]
+
+    stored = {}
+    if previous is not None:
+        for deps, results in zip(previous.dependencies, previous.results):
+            if deps is None or results is None:
+                continue
+            if retry_failed and results.get("failure"):
+                continue
+            deps = OrderedDict( (key, value) for key, value in deps.items() if key not in (ignore or ()) )
+            stored[fingerprint(deps)] = results
+
+    sweep = Sweep(tasks, dependencies=current)
+    pending = []
+    for index, deps in enumerate(current):
+        results = stored.get(fingerprint(deps))
+        if results is None:
+            pending.append(index)
+        else:
+            sweep.results[index] = results
+    sweep.recomputed = pending
+
+    if pending:
+        owned = runner is None
+        if owned:
+            runner = Runner(context, workers)
+        completed = 0
+        try:
+            for outcome in runner.imap_unordered((tasks[index] for index in pending), **execute_kwargs):
+                sweep.results[pending[outcome.index]] = outcome.results
+                completed += 1
+                if path and save_every and completed % save_every == 0:
+                    sweep.save(path)
+        finally:
+            if path:
+                sweep.save(path)
+            if owned:
+                runner.close()
+    elif path:
+        sweep.save(path)
+    return sweep
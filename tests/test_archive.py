@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from tawnycalc.archive import Archive
+
+from . import fakes
+
+
+class ArchiveTestSuite(unittest.TestCase):
+    """Appending to and reading back from an archive."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "outputs.tcar")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_append_and_read(self):
+        archive = Archive(self.path)
+        archive.append("a", {"tc-log.txt":"first log", "stdout":b"\x00\x01"}, {"failure":None})
+        archive.append("b", {"tc-log.txt":"other"})
+        archive.append("a", {"tc-log.txt":"second log"})
+        self.assertEqual(len(archive), 3)
+        self.assertEqual(archive.hashes(), ["a", "b"])
+        self.assertEqual(archive.read("a", "tc-log.txt"), b"second log")
+        self.assertEqual(archive.read("a", "tc-log.txt", which=0), b"first log")
+        self.assertEqual(list(archive.read("a", which=0).items()),
+                         [("tc-log.txt", b"first log"), ("stdout", b"\x00\x01")])
+        self.assertIsNone(archive.meta("a", which=0)["failure"])
+        with self.assertRaises(KeyError):
+            archive.read("c")
+        with self.assertRaises(KeyError):
+            archive.read("b", "stdout")
+
+        # a separate reader sees appended segments
+        reader = Archive(self.path)
+        self.assertIn("b", reader)
+        archive.append("c", {"tc-log.txt":"third"})
+        self.assertEqual(reader.read("c", "tc-log.txt"), b"third")
+
+    def test_rebuild_index(self):
+        archive = Archive(self.path)
+        for name in ("a", "b"):
+            archive.append(name, {"tc-log.txt":name*100})
+        # an interrupted append leaves a truncated segment and no index entry
+        with open(self.path, 'ab') as fp:
+            fp.write(b"TCAR\x01\x00")
+        os.remove(archive.index_path)
+        rebuilt = Archive(self.path)
+        self.assertEqual(rebuilt.rebuild_index(), 2)
+        self.assertEqual(rebuilt.read("b", "tc-log.txt"), b"b"*100)
+
+    def test_rebuild_index_resynchronises(self):
+        archive = Archive(self.path)
+        archive.append("a", {"tc-log.txt":"a"*100})
+        # an append interrupted part way through its payload, followed by further appends
+        interrupted = Archive(os.path.join(self.directory, "other.tcar"))
+        interrupted.append("lost", {"tc-log.txt":os.urandom(1000)})
+        with open(interrupted.path, 'rb') as fp:
+            partial = fp.read()[:-200]
+        with open(self.path, 'ab') as fp:
+            fp.write(partial)
+        archive.append("b", {"tc-log.txt":"b"*100})
+        # a corrupt segment, and trailing garbage which mimics a segment marker
+        archive.append("c", {"tc-log.txt":"c"*100})
+        with open(self.path, 'r+b') as fp:
+            fp.seek(archive.entries("c")[0]["offset"] + 30)
+            fp.write(b"\xff"*8)
+        archive.append("d", {"tc-log.txt":"d"*100})
+        with open(self.path, 'ab') as fp:
+            fp.write(b"TCARTCAR\x01")
+        os.remove(archive.index_path)
+
+        rebuilt = Archive(self.path)
+        self.assertEqual(rebuilt.rebuild_index(), 3)
+        self.assertEqual(rebuilt.hashes(), ["a", "b", "d"])
+        for name in ("a", "b", "d"):
+            self.assertEqual(rebuilt.read(name, "tc-log.txt"), name.encode()*100)
+        # further appends are indexed and readable
+        rebuilt.append("e", {"tc-log.txt":"e"})
+        self.assertEqual(Archive(self.path).read("e", "tc-log.txt"), b"e")
+        self.assertEqual(Archive(os.path.join(self.directory, "empty.tcar")).rebuild_index(), 0)
+
+    def test_execute(self):
+        archive = Archive(self.path)
+        context = fakes.context(self.directory)
+        try:
+            results = context.execute(archive=archive)
+            self.assertIn(results["config_hash"], archive)
+            files = archive.read(results["config_hash"])
+            self.assertEqual(files["tc-log.txt"].decode("cp437"), results["output_tc_log"])
+            self.assertEqual(files["stdout"].decode("cp437"), results["output_stdout"])
+        finally:
+            context.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from tawnycalc import boundary
+from tawnycalc.core import Context
+
+from . import fakes
+
+
+class BoundaryTestSuite(unittest.TestCase):
+    """Boundary tracing against the fake garnet-in line `T = 600 + 10*P`."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.context = fakes.context(self.directory)
+
+    def tearDown(self):
+        self.context.cleanup()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_trace_garnet_in(self):
+        calls = []
+        execute = Context.execute
+        def counted(ctx, *args, **kwargs):
+            calls.append(ctx)
+            return execute(ctx, *args, **kwargs)
+        with mock.patch.object(Context, "execute", counted):
+            line = boundary.trace(self.context, (2., 580.), (2., 660.), bounds=((0., 6.), (550., 700.)))
+        self.assertEqual(line.assemblages, ("chl bi mu q H2O", "g bi mu q H2O"))
+        self.assertEqual(line.executions, len(calls))
+        # a grid resolving T to the same tolerance over the bounds would need
+        # thousands of executions
+        self.assertLess(line.executions, 100)
+        P, T = line.points[:,0], line.points[:,1]
+        np.testing.assert_allclose(T, 600. + 10.*P, atol=0.3)
+        # traced in order along the boundary, across the full bounds
+        self.assertTrue(np.all(np.diff(P) > 0.) or np.all(np.diff(P) < 0.))
+        self.assertLess(P.min(), 0.5)
+        self.assertGreater(P.max(), 5.)
+        # the boundary is followed in steps of the requested (scaled) length
+        steps = np.linalg.norm(np.diff(line.points, axis=0)/(1., 50.), axis=1)
+        np.testing.assert_allclose(steps, 0.5, atol=0.05)
+        # the supplied context is not modified
+        self.assertEqual(self.context._script["setTwindow"], "600 600")
+        self.assertNotIn(self.context, calls)
+
+    def test_same_assemblage(self):
+        with self.assertRaises(RuntimeError):
+            boundary.trace(self.context, (2., 580.), (2., 600.))
+
+
+if __name__ == '__main__':
+    unittest.main()
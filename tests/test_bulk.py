@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import numpy as np
+
+from tawnycalc import bulk, rbi
+
+
+class BulkTestSuite(unittest.TestCase):
+    """Bulk composition conversions, fractionation and rendering."""
+
+    def test_wt_mol_known_values(self):
+        # forsterite, Mg2SiO4, is 2:1 MgO:SiO2 on a molar basis
+        wt = bulk.mol_to_wt([1., 2.], "SiO2 MgO")
+        MgO = 2.*40.3044/(2.*40.3044 + 60.0843)
+        np.testing.assert_allclose(wt, [100.*(1. - MgO), 100.*MgO])
+        np.testing.assert_allclose(bulk.wt_to_mol(wt, ["SiO2", "MgO"]), [100./3., 200./3.])
+        np.testing.assert_allclose(bulk.wt_to_mol([1., 2.], "SiO2 MgO", total=1.).sum(), 1.)
+
+    def test_wt_mol_round_trip(self):
+        oxides = list(bulk.OXIDE_MOLAR_MASSES)
+        comp = np.random.default_rng(1).uniform(0.1, 10., (50, len(oxides)))
+        found = bulk.mol_to_wt(bulk.wt_to_mol(comp, oxides), oxides)
+        self.assertEqual(found.shape, comp.shape)
+        np.testing.assert_allclose(found, bulk.normalise(comp))
+        with self.assertRaises(RuntimeError):
+            bulk.molar_masses("SiO2 Unobtainium")
+        with self.assertRaises(RuntimeError):
+            bulk.normalise([0., 0.])
+
+    def rbi(self, garnet=0.2):
+        item = rbi("SiO2 FeO MgO")
+        item.add_phase("g", garnet, [3., 2., 1.])
+        item.add_phase("q", 0.5, [1., 0., 0.])
+        item.add_phase("opx", 0.3, [2., 0., 2.])
+        return item
+
+    def test_from_rbi(self):
+        # one-oxide modes weighted by compositions per oxide
+        expected = 0.2*np.array([3., 2., 1.])/6. + 0.5*np.array([1., 0., 0.]) + 0.3*np.array([2., 0., 2.])/4.
+        np.testing.assert_allclose(bulk.from_rbi(self.rbi()), 100.*expected/expected.sum())
+        removed = bulk.from_rbi(self.rbi(), remove={"g":1.})
+        np.testing.assert_allclose(removed, bulk.from_rbi(self.rbi(garnet=0.)))
+        self.assertEqual(removed[1], 0.)
+        # batches, with a fraction per rbi
+        batch = bulk.from_rbi([self.rbi(), self.rbi()], remove={"g":np.array([0., 1.])})
+        self.assertEqual(batch.shape, (2, 3))
+        np.testing.assert_allclose(batch[0], bulk.from_rbi(self.rbi()))
+        np.testing.assert_allclose(batch[1], removed)
+        with self.assertRaises(RuntimeError):
+            bulk.from_rbi([self.rbi(), rbi("SiO2 MgO")])
+
+    def test_fractionate(self):
+        comp = bulk.fractionate([50., 30., 20.], [0., 1., 0.], 0.1)
+        np.testing.assert_allclose(comp, 100.*np.array([0.5, 0.2, 0.2])/0.9)
+        # removal beyond availability is clipped
+        comp = bulk.fractionate([50., 30., 20.], [0., 1., 0.], 0.5)
+        np.testing.assert_allclose(comp, [5./7.*100., 0., 2./7.*100.])
+        batch = bulk.fractionate([[50., 30., 20.]]*3, [0., 1., 0.], [0., 0.1, 0.5])
+        np.testing.assert_allclose(batch[0], [50., 30., 20.])
+        np.testing.assert_allclose(batch[2], comp)
+
+    def test_setbulk(self):
+        self.assertEqual(bulk.setbulk([50., 33.333333, 16.666667]), "yes 50.0000 33.3333 16.6667")
+        self.assertEqual(bulk.setbulk([[1., 2.], [3., 4.]], precision=1), ["yes 1.0 2.0", "yes 3.0 4.0"])
+
+
+if __name__ == '__main__':
+    unittest.main()
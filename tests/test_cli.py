@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import os
+import csv
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from tawnycalc import cli
+from tawnycalc.sinks import csv_output
+
+from . import fakes
+
+
+class CliTestSuite(unittest.TestCase):
+    """Headless sweeps against a fake thermocalc."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.executable, self.scripts_dir = fakes.install(self.directory)
+        self.spec = os.path.join(self.directory, "spec.json")
+        with open(self.spec, 'w') as fp:
+            json.dump({ "scripts_dir":"scripts", "output":"out.csv", "workers":2, "executable":self.executable,
+                        "grid":{ "P":[2., 4.], "T":{ "start":580., "stop":660., "num":3 } } }, fp)
+        self.output = os.path.join(self.directory, "out.csv")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def rows(self):
+        with open(self.output, 'r', newline='') as fp:
+            return list(csv.DictReader(fp))
+
+    def test_sweep(self):
+        status = cli.main(["sweep", self.spec, "-q", "-o", self.output])
+        self.assertEqual(status, cli.EXIT_OK)
+        rows = self.rows()
+        self.assertEqual(sorted(int(row["index"]) for row in rows), list(range(6)))
+        self.assertTrue(all(row["status"] == "ok" for row in rows))
+
+    def test_resume_retries_failed_points(self):
+        context = fakes.context(self.directory)
+        sink = csv_output(self.output, context).open(append=False)
+        sink.write(0, None, RuntimeError("crashed"), {"setPwindow":"2. 2.", "setTwindow":"580. 580."})
+        sink.close()
+        context.cleanup()
+        self.assertEqual(csv_output(self.output, context).completed(), set())
+
+        status = cli.main(["sweep", self.spec, "-q", "-o", self.output, "--resume"])
+        self.assertEqual(status, cli.EXIT_OK)
+        rows = self.rows()
+        self.assertEqual([ row["status"] for row in rows if row["index"] == "0" ], ["failed", "ok"])
+        self.assertEqual(csv_output(self.output, context).completed(), set(range(6)))
+
+        # nothing remains to be executed
+        status = cli.main(["sweep", self.spec, "-q", "-o", self.output, "--resume"])
+        self.assertEqual(status, cli.EXIT_OK)
+        self.assertEqual(len(self.rows()), 7)
+
+    def test_array_shards(self):
+        environ = { "SLURM_ARRAY_TASK_COUNT":"3", "SLURM_ARRAY_TASK_MIN":"1" }
+        for task_id in ("1", "2", "3"):
+            with mock.patch.dict(os.environ, environ, SLURM_ARRAY_TASK_ID=task_id):
+                status = cli.main(["sweep", self.spec, "-q", "-o", self.output])
+            self.assertEqual(status, cli.EXIT_OK)
+        self.assertFalse(os.path.exists(self.output))
+        for index in range(3):
+            with open(cli.shard_path(self.output, index, 3), 'r', newline='') as fp:
+                indices = [ int(row["index"]) for row in csv.DictReader(fp) ]
+            self.assertEqual(sorted(indices), [index, index + 3])
+
+        # each shard resumes from its own output only
+        with mock.patch.dict(os.environ, environ, SLURM_ARRAY_TASK_ID="2"):
+            status = cli.main(["sweep", self.spec, "-q", "-o", self.output, "--resume"])
+        self.assertEqual(status, cli.EXIT_OK)
+        with open(cli.shard_path(self.output, 1, 3), 'r', newline='') as fp:
+            self.assertEqual(len(list(csv.DictReader(fp))), 2)
+
+        status = cli.main(["merge", self.output])
+        self.assertEqual(status, cli.EXIT_OK)
+        rows = self.rows()
+        self.assertEqual([ int(row["index"]) for row in rows ], list(range(6)))
+        self.assertTrue(all(row["status"] == "ok" for row in rows))
+        self.assertEqual(cli.main(["merge", os.path.join(self.directory, "missing.csv")]), cli.EXIT_USAGE)
+
+    def test_shard_path(self):
+        self.assertEqual(cli.shard_path("out.csv", 0, 1), "out.csv")
+        self.assertEqual(cli.shard_path("runs/out.csv", 2, 4), "runs/out.shard2.csv")
+        self.assertEqual(cli.shard_path("out-{shard}.csv", 2, 4), "out-2.csv")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from tawnycalc import Context
+
+from . import fakes
+
+
+class ContextTestSuite(unittest.TestCase):
+    """Concurrent execution of a single context against a fake thermocalc."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.context = fakes.context(self.directory)
+
+    def tearDown(self):
+        self.context.cleanup()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_concurrent_execute(self):
+        points = [ (P, T) for P in (1., 2., 3.) for T in (590., 630., 670.) ]
+        found = {}
+        errors = []
+        in_use = set()
+        overlap = [0]
+        collisions = []
+        guard = threading.Lock()
+        snapshot, release = Context._snapshot, Context._release
+
+        def checked_snapshot(context):
+            copy = snapshot(context)
+            with guard:
+                if copy.temp_dir in in_use:
+                    collisions.append(copy.temp_dir)
+                in_use.add(copy.temp_dir)
+                overlap[0] = max(overlap[0], len(in_use))
+            return copy
+
+        def checked_release(context, copy):
+            with guard:
+                in_use.discard(copy.temp_dir)
+            release(context, copy)
+
+        # the configuration is captured before `thermocalc` is spawned, so
+        # `gate` pairs each `set_pt()` with its execution, which then overlap
+        gate = threading.Lock()
+        def execute(P, T):
+            gate.acquire()
+            try:
+                self.context.set_pt(P, T)
+                results = self.context.execute(on_spawn=lambda process: gate.release())
+                found[(P, T)] = results
+            except Exception as e:
+                errors.append(e)
+                if gate.locked():
+                    gate.release()
+
+        with mock.patch.object(Context, "_snapshot", checked_snapshot), \
+             mock.patch.object(Context, "_release", checked_release), \
+             mock.patch.dict(os.environ, {"FAKE_SLEEP":"0.2"}):
+            threads = [ threading.Thread(target=execute, args=point) for point in points ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(60.)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(found), sorted(points))
+        for (P, T), results in found.items():
+            self.assertIsNone(results["failure"])
+            self.assertEqual((results["P"], results["T"]), (P, T))
+            self.assertEqual(results["phases"].startswith("g"), T > 600. + 10.*P)
+        self.assertEqual(collisions, [])
+        self.assertGreater(overlap[0], 1)
+        # every scratch directory has been returned to the pool
+        self.assertEqual(in_use, set())
+        self.assertEqual(len(self.context._scratch), self.context._scratch_count)
+        self.assertEqual(len(set(self.context._scratch)), self.context._scratch_count)
+
+        scratch = [ path for path in self.context._scratch if path != self.context.temp_dir ]
+        self.context.cleanup()
+        self.assertEqual(self.context._scratch, [self.context.temp_dir])
+        self.assertFalse(any(os.path.isdir(path) for path in scratch))
+
+    def test_cleanup_keeps_user_temp_dir(self):
+        self.context.execute()
+        self.context.cleanup()
+        self.assertTrue(os.path.isdir(self.context.temp_dir))
+        copy = self.context.copy()
+        copy.execute()
+        copy.cleanup()
+        self.assertFalse(os.path.isdir(copy.temp_dir))
+        # temporary locations are recreated where executed again
+        self.assertIsNone(copy.execute()["failure"])
+        copy.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
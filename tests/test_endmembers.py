@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import warnings
+
+import numpy as np
+
+from tawnycalc import endmembers
+
+
+class EndmembersTestSuite(unittest.TestCase):
+    """
+    End-member thermodynamics from the provided ds62 dataset.
+
+    No `thermocalc` outputs are available to compare against, so values are
+    checked against the dataset reference properties and against published
+    experimental and ds62 equilibria, with tolerances reflecting these.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.ds = endmembers.dataset(62)
+
+    def test_reference_properties(self):
+        for name in ("ky", "py", "gr", "q", "sill"):
+            params = self.ds.endmembers[name]
+            found = self.ds.properties([name], P=endmembers.PR, T=endmembers.TR - 273.15)
+            self.assertAlmostEqual(float(found["H"][0]), params["H"] + params["V"]*endmembers.PR, places=2)
+            self.assertAlmostEqual(float(found["S"][0]), params["S"], places=5)
+            self.assertAlmostEqual(float(found["V"][0]), params["V"], places=4)
+
+    def test_broadcast_shape(self):
+        P, T = np.meshgrid([2., 4., 6.], [500., 600.], indexing="ij")
+        G = self.ds.gibbs(["ky", "sill", "and"], P=P, T=T)
+        self.assertEqual(G.shape, (3, 2, 3))
+
+    def test_aluminosilicate_triple_point(self):
+        # the ky=sill and and=sill reactions intersect near 4.4 kbar, 550 °C
+        P = np.linspace(3., 6., 151)
+        difference = (self.ds.reaction_temperature({"ky":-1, "sill":1}, P) -
+                      self.ds.reaction_temperature({"and":-1, "sill":1}, P))
+        crossing = np.nonzero(np.diff(np.sign(difference)))[0]
+        self.assertEqual(len(crossing), 1)
+        low = P[crossing[0]]
+        T = float(self.ds.reaction_temperature({"ky":-1, "sill":1}, low))
+        self.assertAlmostEqual(low, 4.4, delta=0.4)
+        self.assertAlmostEqual(T, 550., delta=25.)
+
+    def test_kyanite_sillimanite(self):
+        T = self.ds.reaction_temperature({"ky":-1, "sill":1}, [4., 6., 8.])
+        self.assertTrue(np.all(np.diff(T) > 0.))
+        self.assertAlmostEqual(float(T[1]), 620., delta=30.)
+
+    def test_quartz_coesite(self):
+        # experimentally ~30 kbar at ~900 °C (Bose & Ganguly 1995)
+        T = float(self.ds.reaction_temperature({"q":-1, "coe":1}, 30.))
+        self.assertAlmostEqual(T, 900., delta=100.)
+
+    def test_brucite_dehydration(self):
+        T = self.ds.reaction_temperature({"br":-1, "per":1, "H2O":1}, [1., 5.])
+        self.assertTrue(T[1] > T[0])
+        self.assertAlmostEqual(float(T[0]), 610., delta=40.)
+
+    def test_zero_pressure(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            G = self.ds.gibbs(["q", "ky", "cc"], P=[0., 1e-9], T=500.)
+            V = self.ds.properties(["q"], P=0., T=500.)["V"]
+        self.assertTrue(np.all(np.isfinite(G)))
+        np.testing.assert_allclose(G[0], G[1], atol=1e-6)
+        self.assertTrue(np.all(np.isfinite(V)))
+        with self.assertRaises(RuntimeError):
+            self.ds.gibbs(["H2O"], P=0., T=500.)
+        with self.assertRaises(RuntimeError):
+            self.ds.gibbs(["q"], P=-1., T=500.)
+
+
+if __name__ == '__main__':
+    unittest.main()
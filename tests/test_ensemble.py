@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from tawnycalc import ensemble
+
+from . import fakes
+
+
+class EnsembleTestSuite(unittest.TestCase):
+    """Bulk composition sampling and streaming ensemble statistics."""
+
+    bulk = np.array([50., 30., 15., 5., 0.])
+
+    def test_sample_bulk(self):
+        for distribution in ("normal", "lognormal"):
+            samples = ensemble.sample_bulk(self.bulk, 10., 2000, distribution, rng=1)
+            self.assertEqual(samples.shape, (2000, 5))
+            # closure and positivity
+            np.testing.assert_allclose(samples.sum(axis=1), self.bulk.sum())
+            self.assertTrue(np.all(samples >= 0.))
+            np.testing.assert_array_equal(samples, ensemble.sample_bulk(self.bulk, 10., 2000, distribution, rng=1))
+        # oxides absent from the bulk remain absent under multiplicative perturbation
+        self.assertTrue(np.all(samples[:,-1] == 0.))
+        samples = ensemble.sample_bulk(self.bulk, [0.5, 0.5, 0.5, 0.5, 0.], 20000, rng=2)
+        np.testing.assert_allclose(samples.mean(axis=0), self.bulk, atol=0.05)
+        with self.assertRaises(RuntimeError):
+            ensemble.sample_bulk(self.bulk, 1., 10, "uniform")
+
+    def results(self, g, bi):
+        modes = { "bi":bi }
+        if g > 0.:
+            modes["g"] = g
+        return { "phases":"g bi" if g > 0. else "bi", "modes":modes }
+
+    def test_statistics(self):
+        rng = np.random.default_rng(3)
+        g = np.clip(rng.normal(0.1, 0.05, 5000), 0., None)
+        bi = rng.uniform(0.2, 0.4, 5000)
+        stats = ensemble.statistics(bins=1000)
+        for values in zip(g, bi):
+            stats.add(self.results(*values))
+        stats.add(None)
+        self.assertEqual((stats.count, stats.failures), (5000, 1))
+        self.assertAlmostEqual(stats.mean()["g"], g.mean())
+        self.assertAlmostEqual(stats.mean()["bi"], bi.mean())
+        self.assertAlmostEqual(stats.std()["bi"], bi.std())
+        q = (0.05, 0.5, 0.95)
+        for phase, values in (("g", g), ("bi", bi)):
+            np.testing.assert_allclose(stats.quantiles(q)[phase], np.quantile(values, q), atol=2e-3)
+        self.assertAlmostEqual(stats.assemblages()["g bi"], np.mean(g > 0.))
+
+    def test_merge(self):
+        first, second, combined = (ensemble.statistics(bins=100) for i in range(3))
+        for i, g in enumerate(np.linspace(0., 0.3, 40)):
+            results = self.results(g, 0.3)
+            (first if i % 2 else second).add(results)
+            combined.add(results)
+        second.add(None)
+        first.merge(second)
+        self.assertEqual((first.count, first.failures), (40, 1))
+        for phase, mean in combined.mean().items():
+            self.assertAlmostEqual(first.mean()[phase], mean)
+        np.testing.assert_array_equal(first.quantiles()["g"], combined.quantiles()["g"])
+        self.assertEqual(first.assemblages(), combined.assemblages())
+        with self.assertRaises(RuntimeError):
+            first.merge(ensemble.statistics(bins=10))
+
+    def test_run(self):
+        directory = tempfile.mkdtemp()
+        try:
+            context = fakes.context(directory)
+            stats = ensemble.run(context, [1., 2.], 0.1, 12, path=[(2., 580.), (2., 660.)], seed=1, workers=2)
+            context.cleanup()
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        self.assertEqual([ item.count for item in stats ], [12, 12])
+        self.assertEqual(list(stats[0].assemblages()), ["chl bi mu q H2O"])
+        self.assertAlmostEqual(stats[1].mean()["g"], 0.04)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from tawnycalc import failures
+
+from . import fakes
+
+
+class ExecuteTestSuite(unittest.TestCase):
+    """Execution and failure detection against a fake thermocalc."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.context = fakes.context(self.directory)
+
+    def tearDown(self):
+        self.context.cleanup()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def execute(self, **kwargs):
+        # guard against a deadlocked execution hanging the test suite
+        found = []
+        worker = threading.Thread(target=lambda: found.append(self.context.execute(**kwargs)))
+        worker.daemon = True
+        worker.start()
+        worker.join(30.)
+        self.assertFalse(worker.is_alive(), "execution did not complete")
+        return found[0]
+
+    def test_parses_outputs(self):
+        self.context.set_pt(2., 640.)
+        results = self.execute()
+        self.assertIsNone(results["failure"])
+        self.assertEqual(results["phases"], "g bi mu q H2O (fluid)")
+        self.assertAlmostEqual(results["modes"]["g"], 0.02)
+        self.assertAlmostEqual(results["xyz"]["x(g)"], 0.28)
+        self.assertEqual(results["site_fractions"]["bi"]["xMgM3"], "0.2")
+
+    def test_large_stderr_does_not_block(self):
+        with mock.patch.dict(os.environ, {"FAKE_STDERR_BYTES":str(1 << 20)}):
+            results = self.execute()
+        self.assertIsNone(results["failure"])
+        self.assertEqual(len(results["output_stderr"]), 1 << 20)
+
+    def test_detectors_are_opt_in(self):
+        lines = "|".join(["failed to converge"]*3)
+        with mock.patch.dict(os.environ, {"FAKE_STDOUT":lines}):
+            self.assertIsNone(self.execute()["failure"])
+            results = self.execute(detectors=failures.DEFAULT_DETECTORS)
+        self.assertEqual(results["failure"], failures.BAD_GUESS)
+
+    def test_copy_new_files(self):
+        output = os.path.join(self.directory, "generated")
+        before = sorted(os.listdir(self.context.scripts_dir))
+        self.execute(copy_new_files=output)
+        self.assertIn("tc-log.txt", os.listdir(output))
+        self.assertEqual(sorted(os.listdir(self.context.scripts_dir)), before)
+        with self.assertRaises(RuntimeError):
+            self.context.execute(copy_new_files=self.context.scripts_dir)
+
+    def test_classify(self):
+        self.assertIsNone(failures.classify("THERMOCALC 3.50\nfailed to converge\n"))
+        self.assertEqual(failures.classify("no stable assemblage found\n"*3), failures.NO_ASSEMBLAGE)
+        self.assertEqual(failures.classify("cannot open tc-ds62.txt\n"), failures.DATASET_ERROR)
+
+
+if __name__ == '__main__':
+    unittest.main()
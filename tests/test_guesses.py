@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from tawnycalc.guesses import GuessLibrary, _group
+from tawnycalc.runner import Runner, pt_task
+
+from . import fakes
+
+
+def results(P, T, phases="g bi mu q H2O"):
+    return { "P":P, "T":T, "phases":phases, "modes":{ phase:0.1 for phase in phases.split() },
+             "xyz":{ "x(bi)":0.5 + P/100., "x(g)":0.9 - 0.001*T } }
+
+
+class GuessLibraryTestSuite(unittest.TestCase):
+    """Persistent nearest neighbour library of starting guesses."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "guesses.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_nearest(self):
+        library = GuessLibrary(self.path)
+        for P, T in ((2., 600.), (4., 650.), (8., 700.)):
+            self.assertTrue(library.add(results(P, T)))
+        self.assertTrue(library.add(results(4., 600., "chl bi mu q H2O")))
+        self.assertFalse(library.add(dict(results(4., 700.), failure="timeout")))
+        entry = library.nearest(4.2, 640.)
+        self.assertEqual((entry["P"], entry["T"]), (4., 650.))
+        # 1 kbar is equivalent to 50 degrees by default
+        self.assertAlmostEqual(entry["distance"], np.hypot(0.2, 10./50.))
+        self.assertAlmostEqual(entry["xyz"]["x(bi)"], 0.54)
+        self.assertEqual(library.nearest(4., 610.)["assemblage"], "chl bi mu q H2O")
+        self.assertEqual(library.nearest(4., 610., assemblage="g bi mu q H2O")["T"], 650.)
+        self.assertEqual(library.nearest(4., 610., phases={"g", "bi", "mu", "q", "H2O"})["T"], 650.)
+        self.assertIsNone(library.nearest(4., 610., phases={"bi"}))
+        library.max_distance = 0.1
+        self.assertIsNone(library.nearest(6., 610.))
+        library.close()
+
+    def test_bulk(self):
+        library = GuessLibrary(self.path, bulk_weight=10.)
+        library.add(results(4., 650.), { "setbulk":"yes 1 1" })
+        library.add(results(4., 600.), { "setbulk":"yes 1 3" })
+        # bulk differences outweigh the temperature difference
+        self.assertEqual(library.nearest(4., 650., bulk=[0.25, 0.75])["T"], 600.)
+        self.assertEqual(library.nearest(4., 650.)["T"], 650.)
+        library.close()
+
+    def test_eviction(self):
+        library = GuessLibrary(self.path, max_entries=5)
+        for T in range(600, 605):
+            library.add(results(2., float(T)))
+        # using the oldest entry keeps it from eviction
+        self.assertEqual(library.nearest(2., 600.)["T"], 600.)
+        for T in range(700, 703):
+            library.add(results(2., float(T)))
+        self.assertEqual(len(library), 5)
+        # the least recently used entries are evicted
+        remaining = [ library.nearest(2., T)["T"] for T in (600., 601., 603., 604., 700., 701., 702.) ]
+        self.assertEqual(remaining, [600., 600., 604., 604., 700., 701., 702.])
+        library.close()
+
+    def test_refresh_across_processes(self):
+        first = GuessLibrary(self.path, max_entries=3)
+        second = GuessLibrary(self.path, max_entries=3)
+        first.add(results(2., 600.))
+        self.assertEqual(second.nearest(2., 700.)["T"], 600.)
+        # new entries are picked up incrementally
+        first.add(results(2., 690.))
+        self.assertEqual(second.nearest(2., 700.)["T"], 690.)
+        # evictions by another process rebuild the index
+        for T in (610., 620., 630.):
+            first.add(results(2., T))
+        self.assertEqual(second.nearest(2., 700.)["T"], 630.)
+        self.assertEqual(len(second), 3)
+        first.close()
+        second.close()
+
+    def test_runner(self):
+        context = fakes.context(self.directory)
+        library = GuessLibrary(self.path)
+        try:
+            with Runner(context, workers=1, guess_library=library) as runner:
+                runner.map([ pt_task(2., 660.) ])
+                outcome = runner.map([ pt_task(2., 650.) ])[0]
+        finally:
+            context.cleanup()
+        counters = runner.metrics.snapshot()["counters"]
+        self.assertEqual((counters["cache_misses"], counters["cache_hits"]), (1, 1))
+        self.assertEqual(len(library), 2)
+        self.assertIsNone(outcome.error)
+        library.close()
+
+
+class GroupTestSuite(unittest.TestCase):
+    """Nearest neighbour index over entries appended incrementally."""
+
+    def test_matches_brute_force(self):
+        rng = np.random.default_rng(0)
+        group = _group()
+        points = rng.uniform(size=(1000, 4))
+        for i, point in enumerate(points):
+            group.append(i, point)
+            if i % 97 == 0:
+                query = rng.uniform(size=4)
+                distances = np.linalg.norm(points[:i+1] - query, axis=1)
+                distance, id = group.query(query)
+                self.assertEqual(id, int(np.argmin(distances)))
+                self.assertAlmostEqual(distance, distances.min())
+        # capacity grows geometrically
+        self.assertEqual(len(group._array), 1024)
+
+    def test_mixed_widths(self):
+        group = _group()
+        group.append(0, [1., 1.])
+        group.append(1, [1., 1.2, 0.5, 0.5])
+        group.append(2, [3., 3., 0.5, 0.5])
+        # shorter features are padded with zeros, and shorter queries consider leading dimensions only
+        self.assertEqual(group.query(np.array([1., 1., 0., 0.]))[1], 0)
+        self.assertEqual(group.query(np.array([1., 1.1, 0.5, 0.5]))[1], 1)
+        self.assertEqual(group.query(np.array([2.9, 3.]))[1], 2)
+        self.assertEqual(group.query(np.array([1., 1.15]))[1], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from tawnycalc import inputs
+
+from . import fakes
+
+
+class InputsTestSuite(unittest.TestCase):
+    """Process-wide caching of parsed inputs."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.executable, self.scripts_dir = fakes.install(self.directory)
+        self.script = os.path.join(self.scripts_dir, "tc-test.txt")
+        inputs.clear()
+
+    def tearDown(self):
+        inputs.clear()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def counters(self):
+        counters = inputs.metrics.snapshot()["counters"]
+        return counters.get("parse_hits", 0), counters.get("parse_misses", 0)
+
+    def test_load_cached(self):
+        hits, misses = self.counters()
+        first = inputs.load("script", self.script)
+        second = inputs.load("script", self.script)
+        self.assertEqual(self.counters(), (hits + 1, misses + 1))
+        self.assertEqual(first, second)
+        # each caller receives its own copy
+        first["xyzguess"]["x(g)"] = "0.1"
+        self.assertEqual(inputs.load("script", self.script)["xyzguess"]["x(g)"], second["xyzguess"]["x(g)"])
+
+    def test_modified_file_parsed_again(self):
+        self.assertEqual(inputs.load("script", self.script)["dogmin"], "no")
+        with open(self.script, 'w') as fp:
+            fp.write(fakes.SCRIPT.replace("dogmin no", "dogmin yes 0"))
+        stat = os.stat(self.script)
+        os.utime(self.script, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        hits, misses = self.counters()
+        self.assertEqual(inputs.load("script", self.script)["dogmin"], "yes 0")
+        self.assertEqual(self.counters(), (hits, misses + 1))
+
+    def test_loads(self):
+        hits, misses = self.counters()
+        self.assertEqual(inputs.loads("prefs", fakes.PREFS)["dataset"], "62")
+        self.assertEqual(inputs.loads("prefs", fakes.PREFS)["scriptfile"], "test")
+        self.assertEqual(inputs.loads("prefs", fakes.PREFS.replace("62", "63"))["dataset"], "63")
+        self.assertEqual(self.counters(), (hits + 1, misses + 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from tawnycalc import inversion
+from tawnycalc.guesses import script_point
+from tawnycalc.runner import Outcome
+
+from . import fakes
+
+
+class surface(object):
+    """
+    Stub runner returning results of a synthetic misfit surface, with its
+    minimum at 10 kbar, 600 °C.
+    """
+    def __init__(self):
+        self.executed = []
+
+    def map(self, tasks, **execute_kwargs):
+        outcomes = []
+        for index, task in enumerate(tasks):
+            P, T = script_point(task)[:2]
+            self.executed.append((P, T))
+            results = { "P":P, "T":T, "failure":None, "modes":{ "g":0.05 + 0.01*(P - 10.) },
+                        "xyz":{ "x(g)":0.85 + 0.002*(T - 600.) } }
+            outcomes.append(Outcome(index, results, None))
+        return outcomes
+
+
+class InversionTestSuite(unittest.TestCase):
+    """P-T inversion against a synthetic misfit surface."""
+
+    targets = { "modes":{ "g":(0.05, 0.01) }, "xyz":{ "x(g)":(0.85, 0.02) } }
+
+    def test_converges(self):
+        runner = surface()
+        fit = inversion.invert(None, ((8., 12.), (550., 650.)), runner=runner, tol=(0.01, 0.5), **self.targets)
+        self.assertAlmostEqual(fit.P, 10., delta=0.02)
+        self.assertAlmostEqual(fit.T, 600., delta=1.)
+        self.assertLess(fit.misfit, 1e-3)
+        self.assertEqual(fit.results["P"], fit.P)
+        self.assertEqual(len(fit.points), fit.executions)
+        self.assertTrue(np.all(fit.misfits >= fit.misfit))
+
+    def test_repeated_points_cached(self):
+        runner = surface()
+        fit = inversion.invert(None, ((8., 12.), (550., 650.)), runner=runner, **self.targets)
+        self.assertEqual(len(runner.executed), fit.executions)
+        self.assertEqual(len(set(runner.executed)), len(runner.executed))
+
+    def test_max_executions(self):
+        runner = surface()
+        fit = inversion.invert(None, ((8., 12.), (550., 650.)), runner=runner, initial=3, max_executions=12,
+                               **self.targets)
+        self.assertEqual(len(runner.executed), 12)
+        self.assertEqual(fit.executions, 12)
+
+    def test_owned_runner_closed(self):
+        directory = tempfile.mkdtemp()
+        scratch = os.path.join(directory, "tmp")
+        os.makedirs(scratch)
+        try:
+            context = fakes.context(directory)
+            with mock.patch.object(tempfile, "tempdir", scratch):
+                fit = inversion.invert(context, ((1., 3.), (630., 690.)), modes={ "g":(0.04, 0.005) },
+                                       xyz={ "x(g)":(0.26, 0.01) }, initial=3, max_executions=20, workers=2)
+            self.assertLess(fit.misfit, 1.)
+            self.assertEqual(os.listdir(scratch), [])
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
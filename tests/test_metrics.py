@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from tawnycalc.metrics import BUCKETS, Metrics, PrometheusWriter, _histogram
+
+
+class MetricsTestSuite(unittest.TestCase):
+    """Counters, gauges, latency histograms and their Prometheus export."""
+
+    def test_histogram_buckets(self):
+        hist = _histogram()
+        for value in (0.005, 0.01, 0.02, 0.3, 7., 2000.):
+            hist.observe(value)
+        counts = dict(zip(BUCKETS, hist.counts))
+        # bucket bounds are inclusive upper bounds
+        self.assertEqual(counts[0.01], 2)
+        self.assertEqual(counts[0.025], 1)
+        self.assertEqual(counts[0.5], 1)
+        self.assertEqual(counts[10.], 1)
+        self.assertEqual(counts[float("inf")], 1)
+        self.assertEqual(sum(hist.counts), hist.count)
+        self.assertAlmostEqual(hist.sum, 2007.335)
+        self.assertEqual(hist.max, 2000.)
+
+    def test_histogram_quantiles(self):
+        hist = _histogram()
+        self.assertIsNone(hist.quantile(0.5))
+        # uniform within a single bucket interpolates linearly
+        for i in range(100):
+            hist.observe(1. + 1.5*(i + 0.5)/100)
+        self.assertAlmostEqual(hist.quantile(0.5), 1.75, delta=0.02)
+        self.assertAlmostEqual(hist.quantile(0.9), 2.35, delta=0.02)
+        # interpolation is capped by the largest observation
+        self.assertLessEqual(hist.quantile(1.), hist.max)
+        hist = _histogram()
+        for i in range(99):
+            hist.observe(0.02)
+        hist.observe(30.)
+        self.assertLessEqual(hist.quantile(0.5), 0.025)
+        self.assertGreater(hist.quantile(0.999), 25.)
+
+    def test_snapshot(self):
+        metrics = Metrics()
+        metrics.increment("runs")
+        metrics.increment("runs", 2)
+        metrics.increment("failures")
+        metrics.set_gauge("workers", 4)
+        metrics.set_gauge("inflight", lambda: 3)
+        for value in (0.1, 0.2, 0.3):
+            metrics.observe("run", value)
+        snapshot = metrics.snapshot()
+        self.assertEqual(list(snapshot), ["uptime", "counters", "rates", "gauges", "latency"])
+        self.assertEqual(snapshot["counters"], {"runs":3, "failures":1})
+        self.assertEqual(snapshot["gauges"], {"workers":4, "inflight":3})
+        self.assertAlmostEqual(snapshot["rates"]["runs"]*snapshot["uptime"], 3., places=3)
+        latency = snapshot["latency"]["run"]
+        self.assertEqual(latency["count"], 3)
+        self.assertAlmostEqual(latency["mean"], 0.2)
+        self.assertEqual(latency["max"], 0.3)
+        self.assertTrue(latency["p50"] <= latency["p90"] <= latency["p99"] <= latency["max"])
+
+    def test_prometheus(self):
+        metrics = Metrics()
+        metrics.increment("runs", 5)
+        metrics.set_gauge("workers", lambda: 2)
+        metrics.observe("parse", 0.02)
+        metrics.observe("parse", 3.)
+        lines = metrics.prometheus(prefix="tc").splitlines()
+        self.assertIn("# TYPE tc_runs_total counter", lines)
+        self.assertIn("tc_runs_total 5", lines)
+        self.assertIn("# TYPE tc_workers gauge", lines)
+        self.assertIn("tc_workers 2", lines)
+        self.assertIn("# TYPE tc_stage_seconds histogram", lines)
+        buckets = [ line for line in lines if line.startswith("tc_stage_seconds_bucket") ]
+        self.assertEqual(len(buckets), len(BUCKETS))
+        # buckets are cumulative
+        self.assertIn('tc_stage_seconds_bucket{stage="parse",le="0.01"} 0', lines)
+        self.assertIn('tc_stage_seconds_bucket{stage="parse",le="0.025"} 1', lines)
+        self.assertIn('tc_stage_seconds_bucket{stage="parse",le="2.5"} 1', lines)
+        self.assertIn('tc_stage_seconds_bucket{stage="parse",le="5.0"} 2', lines)
+        self.assertIn('tc_stage_seconds_bucket{stage="parse",le="+Inf"} 2', lines)
+        self.assertIn('tc_stage_seconds_sum{stage="parse"} 3.02', lines)
+        self.assertIn('tc_stage_seconds_count{stage="parse"} 2', lines)
+
+    def test_textfile(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "tawnycalc.prom")
+            metrics = Metrics()
+            metrics.increment("runs")
+            metrics.write_prometheus(path)
+            with open(path) as fp:
+                self.assertEqual(fp.read(), metrics.prometheus())
+            writer = PrometheusWriter(metrics, path, interval=60.).start()
+            metrics.increment("runs")
+            # stopping performs a final write
+            writer.stop()
+            with open(path) as fp:
+                self.assertIn("tawnycalc_runs_total 2\n", fp.read())
+            self.assertEqual(os.listdir(directory), ["tawnycalc.prom"])
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import numpy as np
+
+from tawnycalc.pseudosection import pseudosection
+from tawnycalc.runner import Outcome
+
+
+def results(P, T):
+    # garnet is stable where T > 600 + 10P, as for the fake thermocalc
+    if T > 600. + 10.*P:
+        return { "P":P, "T":T, "phases":"g bi mu q H2O (fluid)", "modes":{ "g":0.001*(T - 600. - 10.*P), "bi":0.1 },
+                 "xyz":{ "x(g)":0.9 - 0.001*T + 0.01*P } }
+    return { "P":P, "T":T, "phases":"chl bi mu q H2O (fluid)", "modes":{ "chl":0.05, "bi":0.1 }, "xyz":{} }
+
+
+class PseudosectionTestSuite(unittest.TestCase):
+    """Fields and isopleths of a synthetic grid with a garnet-in boundary."""
+
+    def setUp(self):
+        self.points = [ (P, T) for P in np.arange(1., 5.01, 0.5) for T in np.arange(560., 700.01, 10.) ]
+        self.section = pseudosection.from_outcomes(self.points,
+                                                   [ Outcome(i, results(P, T), None) for i, (P, T) in enumerate(self.points) ])
+
+    def test_grid(self):
+        self.assertEqual(self.section.field_ids.shape, (9, 15))
+        self.assertEqual(self.section.assemblages, ["chl bi mu q H2O", "g bi mu q H2O"])
+        grid = self.section.assemblage_grid()
+        self.assertEqual(grid[0, 0], "chl bi mu q H2O")
+        self.assertEqual(grid[0, -1], "g bi mu q H2O")
+        x = self.section.values("x(g)")
+        self.assertTrue(np.isnan(x[0, 0]))
+        self.assertAlmostEqual(x[0, -1], 0.9 - 0.7 + 0.01)
+        self.assertEqual(self.section.values("mode(g)")[0, 0], 0.)
+
+    def test_fields(self):
+        fields = self.section.fields()
+        self.assertEqual(len(fields), 2)
+        self.assertEqual(sum(field.size for field in fields), len(self.points))
+        for field in fields:
+            T, P = field.label_point
+            self.assertEqual(field.assemblage.startswith("g"), T > 600. + 10.*P)
+            self.assertEqual(len(field.rings), 1)
+            ring = field.rings[0]
+            np.testing.assert_array_equal(ring[0], ring[-1])
+            # outer boundaries are anticlockwise
+            area = 0.5*np.sum(ring[:-1,0]*ring[1:,1] - ring[1:,0]*ring[:-1,1])
+            self.assertGreater(area, 0.)
+        self.assertAlmostEqual(sum( 0.5*np.sum(ring[:-1,0]*ring[1:,1] - ring[1:,0]*ring[:-1,1])
+                                    for field in fields for ring in field.rings ), 140.*4.)
+
+    def test_missing_points(self):
+        found = [ results(P, T) for P, T in self.points ]
+        found[0] = None
+        found[1] = dict(found[1], failure="timeout")
+        P, T = np.array(self.points).T
+        section = pseudosection(P, T, found)
+        self.assertEqual(list(section.field_ids[0, :2]), [-1, -1])
+        self.assertEqual(sum(field.size for field in section.fields()), len(self.points) - 2)
+
+    def test_isopleths(self):
+        isopleths = self.section.isopleths("mode(g)", [0.05, 1.])
+        self.assertEqual(list(isopleths), [0.05, 1.])
+        self.assertEqual(isopleths[1.], [])
+        lines = isopleths[0.05]
+        self.assertEqual(len(lines), 1)
+        T, P = lines[0].T
+        # linear within the garnet field, so the contour is exact
+        np.testing.assert_allclose(T, 650. + 10.*P)
+        self.assertAlmostEqual(P.min(), 1.)
+        self.assertAlmostEqual(P.max(), 5.)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from tawnycalc import Results
+
+from . import fakes
+
+
+class ResultsTestSuite(unittest.TestCase):
+    """Serialisation of execution results."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        context = fakes.context(cls.directory)
+        context.set_pt(2., 640.)
+        cls.results = context.execute()
+        cls.results["strategy"] = "direct"
+        context.cleanup()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory, ignore_errors=True)
+
+    def test_pickle(self):
+        copy = pickle.loads(pickle.dumps(self.results))
+        self.assertIsInstance(copy, Results)
+        self.assertEqual(copy, self.results)
+        self.assertEqual(copy.output_tc_log, self.results.output_tc_log)
+
+    def test_to_bytes(self):
+        copy = Results.from_bytes(self.results.to_bytes(raw=True))
+        self.assertEqual(copy, self.results)
+        self.assertEqual(copy.modes, self.results.modes)
+        self.assertEqual(copy.xyz, self.results.xyz)
+        self.assertEqual(copy.site_fractions["bi"]["xFeM3"], "0.5")
+        self.assertEqual(copy.bulk_composition, self.results.bulk_composition)
+
+        compact = Results.from_bytes(self.results.to_bytes())
+        self.assertNotIn("output_tc_log", compact)
+        self.assertEqual(compact["phases"], self.results["phases"])
+        self.assertEqual(compact.xyz, self.results.xyz)
+        with self.assertRaises(RuntimeError):
+            Results.from_bytes(b"not results")
+
+    def test_mapping_interface(self):
+        # results are no longer a `dict` subclass, but support its read interface
+        self.assertNotIsInstance(self.results, dict)
+        self.assertEqual(self.results["P"], self.results.P)
+        self.assertEqual(dict(self.results.to_dict())["T"], 640.)
+        self.assertEqual(set(self.results), set(self.results.keys()))
+        self.assertIsNone(self.results.get("rbi"))
+        with self.assertRaises(KeyError):
+            self.results["rbi"]
+        with self.assertRaises(KeyError):
+            self.results["unknown"] = 1.
+
+
+if __name__ == '__main__':
+    unittest.main()
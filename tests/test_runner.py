@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from tawnycalc.failures import TIMEOUT
+from tawnycalc.runner import Runner, pt_task
+
+from . import fakes
+
+
+class RunnerTestSuite(unittest.TestCase):
+    """Parallel execution against a fake thermocalc."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.context = fakes.context(self.directory)
+
+    def tearDown(self):
+        self.context.cleanup()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_map_orders_outcomes(self):
+        tasks = [ pt_task(2., T) for T in (580., 600., 620., 640.) ]
+        with Runner(self.context, workers=2) as runner:
+            outcomes = runner.map(tasks)
+        self.assertEqual([ outcome.index for outcome in outcomes ], [0, 1, 2, 3])
+        self.assertEqual([ outcome.results["T"] for outcome in outcomes ], [580., 600., 620., 640.])
+        self.assertTrue(outcomes[0].results["phases"].startswith("chl"))
+        self.assertTrue(outcomes[-1].results["phases"].startswith("g"))
+
+    def test_worker_contexts_reused_and_removed(self):
+        runner = Runner(self.context, workers=2)
+        for repeat in range(3):
+            runner.map([ pt_task(10., T) for T in (580., 600., 620.) ])
+        self.assertEqual(len(runner._contexts), 2)
+        temp_dirs = [ ctx.temp_dir for ctx in runner._contexts ]
+        self.assertTrue(all(os.path.isdir(path) for path in temp_dirs))
+        runner.close()
+        self.assertFalse(any(os.path.isdir(path) for path in temp_dirs))
+        # the runner remains usable after closing
+        outcomes = runner.map([ pt_task(10., 580.) ])
+        self.assertIsNone(outcomes[0].error)
+        runner.close()
+
+    def test_worker_contexts_returned_on_early_close(self):
+        runner = Runner(self.context, workers=2)
+        outcomes = runner.imap_unordered([ pt_task(10., T) for T in range(560, 660, 10) ])
+        next(outcomes)
+        outcomes.close()
+        self.assertEqual(len(runner._idle), 2)
+        runner.close()
+
+    def test_configuration_errors_recorded(self):
+        class failing(object):
+            def apply(self, ctx):
+                raise RuntimeError("unavailable")
+        runner = Runner(self.context, workers=2, guess_library=failing())
+        with runner:
+            outcomes = runner.map([ pt_task(2., T) for T in (580., 600., 620.) ])
+        self.assertEqual([ str(outcome.error) for outcome in outcomes ], ["unavailable"]*3)
+        self.assertTrue(all(outcome.results is None for outcome in outcomes))
+        self.assertEqual(runner.metrics.snapshot()["counters"]["failures"], 3)
+
+    def test_timeouts_counted(self):
+        os.environ["FAKE_SLEEP"] = "2"
+        try:
+            with Runner(self.context, workers=2) as runner:
+                outcomes = runner.map([ pt_task(2., T) for T in (580., 600.) ], timeout=0.2)
+        finally:
+            del os.environ["FAKE_SLEEP"]
+        self.assertEqual([ outcome.results["failure"] for outcome in outcomes ], [TIMEOUT]*2)
+        counters = runner.metrics.snapshot()["counters"]
+        self.assertEqual((counters["timeouts"], counters["failures"]), (2, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
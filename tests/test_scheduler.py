@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import resource
+import subprocess
+import unittest
+from unittest import mock
+
+from tawnycalc import scheduler
+from tawnycalc.metrics import Metrics
+from tawnycalc.scheduler import Scheduler, parse_size
+
+V1 = "12:cpu,cpuacct:/slurm/job_1\n11:memory:/slurm/job_1\n"
+V2 = "0::/slurm/job_1\n"
+V1_DIR = "/sys/fs/cgroup/cpu,cpuacct/slurm/job_1"
+V2_DIR = "/sys/fs/cgroup/slurm/job_1"
+
+
+def files(contents=None, **kwargs):
+    """
+    Returns a replacement for `scheduler._read` serving `contents`, keyed by path.
+    """
+    return dict(contents or {}, **kwargs).get
+
+
+class SchedulerTestSuite(unittest.TestCase):
+    """Resource detection and controls, against mocked affinity and cgroup files."""
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size("512M"), 512*1024**2)
+        self.assertEqual(parse_size("4G"), 4*1024**3)
+        self.assertEqual(parse_size("1.5GiB"), int(1.5*1024**3))
+        self.assertEqual(parse_size("2gb"), 2*1024**3)
+        self.assertEqual(parse_size(" 100 "), 100)
+        self.assertEqual(parse_size(4096), 4096)
+        self.assertIsNone(parse_size(None))
+        with self.assertRaises(RuntimeError):
+            parse_size("lots")
+
+    def test_cgroup_dirs(self):
+        with mock.patch.object(scheduler, "_read", files({ "/proc/self/cgroup":V1 })), \
+             mock.patch("os.path.isdir", return_value=True):
+            self.assertEqual(scheduler._cgroup_dirs("cpu"),
+                             ["/sys/fs/cgroup/cpu,cpuacct/slurm/job_1", "/sys/fs/cgroup/cpu,cpuacct",
+                              "/sys/fs/cgroup/cpu/slurm/job_1", "/sys/fs/cgroup/cpu"])
+            self.assertEqual(scheduler._cgroup_dirs(None), [])
+        with mock.patch.object(scheduler, "_read", files({ "/proc/self/cgroup":V2 })), \
+             mock.patch("os.path.isdir", lambda path: not path.startswith("/sys/fs/cgroup/unified")):
+            self.assertEqual(scheduler._cgroup_dirs(None), ["/sys/fs/cgroup/slurm/job_1", "/sys/fs/cgroup"])
+            self.assertEqual(scheduler._cgroup_dirs("memory"), [])
+
+    def available(self, affinity, contents=None):
+        with mock.patch.object(scheduler, "_read", files(contents)), \
+             mock.patch("os.path.isdir", return_value=True), \
+             mock.patch("os.sched_getaffinity", return_value=set(affinity), create=True):
+            return scheduler.available_cpus()
+
+    def test_available_cpus(self):
+        self.assertEqual(self.available({0, 2, 5}), 3)
+        # cgroup v2 quota of 2.5 cpus rounds up
+        v2 = { "/proc/self/cgroup":V2 }
+        self.assertEqual(self.available(range(8), dict(v2, **{V2_DIR + "/cpu.max":"250000 100000"})), 3)
+        self.assertEqual(self.available(range(8), dict(v2, **{V2_DIR + "/cpu.max":"max 100000"})), 8)
+        self.assertEqual(self.available({0}, dict(v2, **{V2_DIR + "/cpu.max":"10000 100000"})), 1)
+        # cgroup v1 quota, where unlimited quotas are reported as -1
+        v1 = { "/proc/self/cgroup":V1, V1_DIR + "/cpu.cfs_period_us":"100000" }
+        self.assertEqual(self.available(range(8), dict(v1, **{V1_DIR + "/cpu.cfs_quota_us":"400000"})), 4)
+        self.assertEqual(self.available(range(8), dict(v1, **{V1_DIR + "/cpu.cfs_quota_us":"-1"})), 8)
+        # affinity narrower than the quota
+        self.assertEqual(self.available({3}, dict(v1, **{V1_DIR + "/cpu.cfs_quota_us":"400000"})), 1)
+        with mock.patch("os.sched_getaffinity", return_value={1, 3}, create=True), \
+             mock.patch.object(scheduler, "cpu_quota", return_value=None):
+            self.assertEqual(Scheduler().workers, 2)
+
+    def test_memory_available(self):
+        meminfo = { "/proc/meminfo":"MemTotal:       16000000 kB\nMemAvailable:    8000000 kB\n" }
+        with mock.patch.object(scheduler, "_read", files(meminfo, **{ "/proc/self/cgroup":V2,
+                                                                      V2_DIR + "/memory.max":str(4*1024**3),
+                                                                      V2_DIR + "/memory.current":str(1024**3) })), \
+             mock.patch("os.path.isdir", return_value=True):
+            self.assertEqual(scheduler.memory_available(), 3*1024**3)
+        memory = "/sys/fs/cgroup/memory/slurm/job_1"
+        with mock.patch.object(scheduler, "_read", files(meminfo, **{ "/proc/self/cgroup":V1,
+                                                                      memory + "/memory.limit_in_bytes":str(2**63 - 4096),
+                                                                      memory + "/memory.usage_in_bytes":"4096" })), \
+             mock.patch("os.path.isdir", return_value=True):
+            # unlimited v1 cgroups are ignored
+            self.assertEqual(scheduler.memory_available(), 8000000*1024)
+        with mock.patch.object(scheduler, "_read", files()):
+            self.assertIsNone(scheduler.memory_available())
+
+    def test_admit(self):
+        readings = [ 1024**3, 2*1024**3, 5*1024**3 ]
+        metrics = Metrics()
+        with mock.patch.object(scheduler, "memory_available", side_effect=readings), \
+             mock.patch.object(scheduler.time, "sleep") as sleep:
+            Scheduler(workers=1, memory_limit="1G", min_free_memory="3G", poll_interval=2.).admit(metrics)
+        # throttled until the free memory covers the threshold and the child limit
+        self.assertEqual(sleep.call_args_list, [mock.call(2.), mock.call(2.)])
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot["counters"]["throttled"], 1)
+        self.assertEqual(snapshot["latency"]["admission"]["count"], 1)
+
+        with mock.patch.object(scheduler, "memory_available", return_value=None), \
+             mock.patch.object(scheduler.time, "sleep") as sleep:
+            Scheduler(workers=1, min_free_memory="3G").admit(metrics)
+        sleep.assert_not_called()
+        with mock.patch.object(scheduler, "memory_available") as available:
+            Scheduler(workers=1).admit(metrics)
+        available.assert_not_called()
+        self.assertEqual(metrics.snapshot()["counters"]["throttled"], 1)
+
+    def test_pinning(self):
+        with mock.patch("os.sched_getaffinity", return_value={2, 4, 6}, create=True), \
+             mock.patch("os.sched_setaffinity", create=True) as setaffinity:
+            hook = Scheduler(workers=4, pin=True).spawn_hook(4)
+            hook(mock.Mock(pid=1234))
+        setaffinity.assert_called_once_with(1234, {4})
+        self.assertIsNone(Scheduler(workers=4).spawn_hook(0))
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "process limits require Linux")
+    def test_spawn_hook_limits(self):
+        child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+        try:
+            hook = Scheduler(workers=1, nice=5, memory_limit="3G").spawn_hook(0)
+            hook(child)
+            self.assertEqual(os.getpriority(os.PRIO_PROCESS, child.pid), os.getpriority(os.PRIO_PROCESS, 0) + 5)
+            self.assertEqual(resource.prlimit(child.pid, resource.RLIMIT_AS), (3*1024**3, 3*1024**3))
+        finally:
+            child.kill()
+            child.wait()
+
+
+if __name__ == '__main__':
+    unittest.main()
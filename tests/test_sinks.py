@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import os
+import csv
+import json
+import shutil
+import tempfile
+import unittest
+
+from tawnycalc.archive import Archive
+from tawnycalc.runner import Runner, pt_task
+from tawnycalc.sinks import csv_output, jsonl_output, archive_output, store_output, stream
+from tawnycalc.store import ResultStore
+
+from . import fakes
+
+
+class SinksTestSuite(unittest.TestCase):
+    """Streaming outcomes to result sinks."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.context = fakes.context(self.directory)
+        self.runner = Runner(self.context, workers=2)
+        self.tasks = [ pt_task(2., T) for T in range(580, 680, 10) ]
+        self.paths = { name:os.path.join(self.directory, name) for name in ("out.csv", "out.jsonl", "out.tcar", "out.db") }
+
+    def tearDown(self):
+        self.runner.close()
+        self.context.cleanup()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def sinks(self, batch_size):
+        return [ csv_output(self.paths["out.csv"], self.context, batch_size=batch_size),
+                 jsonl_output(self.paths["out.jsonl"], batch_size=batch_size),
+                 archive_output(self.paths["out.tcar"], batch_size=batch_size),
+                 store_output(self.paths["out.db"], batch_size=batch_size) ]
+
+    def rows(self):
+        with open(self.paths["out.csv"], 'r', newline='') as fp:
+            return list(csv.DictReader(fp))
+
+    def records(self):
+        with open(self.paths["out.jsonl"], 'r') as fp:
+            return [ json.loads(line) for line in fp ]
+
+    def test_outputs(self):
+        indices = list(range(100, 110))
+        outcomes = list(stream(self.runner, iter(self.tasks), self.sinks(4), window=3, indices=indices))
+        self.assertEqual(sorted(outcome.index for outcome in outcomes), list(range(10)))
+
+        rows = sorted(self.rows(), key=lambda row: int(row["index"]))
+        self.assertEqual([ int(row["index"]) for row in rows ], indices)
+        row = rows[-1]
+        self.assertEqual((float(row["P"]), float(row["T"]), row["status"]), (2., 670., "ok"))
+        self.assertAlmostEqual(float(row["mode(g)"]), 0.05)
+        self.assertAlmostEqual(float(row["x(g)"]), 0.25)
+        self.assertAlmostEqual(float(row["mode(H2O)"]), 0.4)
+        self.assertEqual(row["extra"], "")
+
+        records = { record["index"]:record for record in self.records() }
+        self.assertEqual(sorted(records), indices)
+        self.assertEqual(records[100]["phases"], "chl bi mu q H2O (fluid)")
+        self.assertAlmostEqual(records[109]["xyz"]["x(g)"], 0.25)
+
+        archive = Archive(self.paths["out.tcar"])
+        self.assertEqual(len(archive), 10)
+        meta = archive.meta("index:105")
+        self.assertEqual((meta["index"], meta["T"], meta["failure"]), (105, 630., None))
+
+        store = ResultStore(self.paths["out.db"])
+        try:
+            self.assertEqual(store.count(), 10)
+            self.assertEqual(store.count(contains="g"), 5)
+        finally:
+            store.close()
+
+    def test_failures_recorded(self):
+        with csv_output(self.paths["out.csv"], self.context).open() as sink:
+            sink.write(0, None, RuntimeError("crashed"), pt_task(2., 580.))
+        row = self.rows()[0]
+        self.assertEqual((row["status"], row["error"], float(row["T"])), ("failed", "RuntimeError: crashed", 580.))
+
+    def test_flushed_on_early_close(self):
+        outcomes = stream(self.runner, iter(self.tasks), self.sinks(100), window=2)
+        received = [ next(outcomes) for i in range(3) ]
+        outcomes.close()
+        # outcomes passed to sinks before closing are written, and none twice
+        self.assertGreaterEqual(len(self.rows()), len(received))
+        self.assertEqual(len(self.rows()), len(self.records()))
+        self.assertEqual(len(set( row["index"] for row in self.rows() )), len(self.rows()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from tawnycalc import staging
+
+from . import fakes
+
+DATASETS = os.path.join(os.path.dirname(staging.__file__), "datasets")
+DATASET = os.path.join(DATASETS, "tc-ds62.txt")
+AXFILE = os.path.join(DATASETS, "tc-mb50NCKFMASHTO.txt")
+SCRIPT = { "axfile":"mb50NCKFMASHTO", "which":"chl bi g", "inexcess":"mu q H2O", "xyzguess":{ "x(g)":"0.8" } }
+
+
+class StagingTestSuite(unittest.TestCase):
+    """Trimming the bundled dataset and a-x files."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_required(self):
+        phases, names = staging.required(DATASET, AXFILE, SCRIPT)
+        self.assertEqual(phases, {"chl", "bi", "g", "mu"})
+        # end-members of the phase blocks, and those named by the script
+        self.assertTrue({"py", "alm", "gr", "phl", "ann", "clin", "daph", "mu", "cel", "q", "H2O"} <= names)
+        self.assertFalse({"tr", "parg", "en", "fo"} & names)
+        full = staging.dataset(DATASET)
+        self.assertTrue(names <= set(full.entries))
+
+    def test_trimmed(self):
+        paths = staging.trimmed(DATASET, AXFILE, SCRIPT, cache_dir=self.directory)
+        self.assertEqual([ os.path.basename(path) for path in paths ], ["tc-ds62.txt", "tc-mb50NCKFMASHTO.txt"])
+        phases, names = staging.required(DATASET, AXFILE, SCRIPT)
+
+        full, trimmed = staging.dataset(DATASET), staging.dataset(paths[0])
+        keep = [ name for name in full.entries if name in names ]
+        self.assertEqual(list(trimmed.entries), keep)
+        self.assertEqual(int(trimmed.lines[0].split()[0]), len(keep))
+        for name, line in trimmed.entries.items():
+            self.assertEqual(trimmed.lines[line:line+4], full.lines[full.entries[name]:full.entries[name]+4])
+        # the uncertainty matrix is the upper triangle of the retained rows and columns
+        self.assertEqual(sum(len(row) for row in trimmed.rows), len(keep)*(len(keep) + 1)//2)
+        self.assertEqual(trimmed.scalar, full.scalar)
+        indices = [ list(full.entries).index(name) for name in keep ]
+        for row, index in enumerate(indices):
+            self.assertEqual(trimmed.rows[row], [ full.rows[index][column - index] for column in indices[row:] ])
+        self.assertEqual(trimmed.lines[trimmed.trailer:], full.lines[full.trailer:])
+
+        full, trimmed = staging.axfile(AXFILE), staging.axfile(paths[1])
+        self.assertEqual(list(trimmed.blocks), [ name for name in full.blocks if name in phases ])
+        for name, span in trimmed.blocks.items():
+            self.assertEqual(trimmed.lines[slice(*span)], full.lines[slice(*full.blocks[name])])
+        self.assertEqual(trimmed.lines[slice(*trimmed.preamble)], full.lines[slice(*full.preamble)])
+        self.assertEqual(trimmed.lines[slice(*trimmed.tail)], full.lines[slice(*full.tail)])
+        self.assertFalse({"hb", "opx", "L", "ilm"} & set(trimmed.blocks))
+
+        # cached files are reused, and differing phase sets are cached separately
+        mtimes = [ os.stat(path).st_mtime_ns for path in paths ]
+        self.assertEqual(staging.trimmed(DATASET, AXFILE, SCRIPT, cache_dir=self.directory), paths)
+        self.assertEqual([ os.stat(path).st_mtime_ns for path in paths ], mtimes)
+        other = staging.trimmed(DATASET, AXFILE, dict(SCRIPT, which="chl bi"), cache_dir=self.directory)
+        self.assertNotEqual(other, paths)
+        self.assertNotIn("g", staging.axfile(other[1]).blocks)
+
+    def test_compare(self):
+        results = { "P":10., "T":600., "phases":"g bi", "modes":{ "g":0.1, "bi":0.2 }, "xyz":{ "x(g)":0.8 } }
+        self.assertEqual(staging.compare(results, dict(results, modes={ "g":0.1 + 1e-9, "bi":0.2 })), [])
+        differences = staging.compare(results, dict(results, phases="bi", T=601., modes={ "bi":0.2 }))
+        self.assertEqual(differences, ["phases: 'g bi' != 'bi'", "T: 600.0 != 601.0", "modes[g]: 0.1 != None"])
+
+    def test_verify(self):
+        context = fakes.context(self.directory)
+        context.script["axfile"] = "mb50NCKFMASHTO"
+        context.set_pt(2., 660.)
+        try:
+            with mock.patch.dict(os.environ, TAWNYCALC_TRIM_CACHE=os.path.join(self.directory, "trimmed")):
+                results = context.execute(datasets_dir=DATASETS, trim="verify")
+                self.assertEqual(results["phases"], "g bi mu q H2O (fluid)")
+                # trimming which drops a required phase is detected
+                required = staging.required
+                def dropped(*args):
+                    phases, names = required(*args)
+                    return phases - {"g"}, names
+                with mock.patch.object(staging, "required", dropped):
+                    results = context.execute(datasets_dir=DATASETS, trim=True)
+                    self.assertEqual(results["phases"], "chl bi mu q H2O (fluid)")
+                    with self.assertRaises(RuntimeError) as raised:
+                        context.execute(datasets_dir=DATASETS, trim="verify")
+                self.assertIn("phases: 'chl bi mu q H2O (fluid)' != 'g bi mu q H2O (fluid)'", str(raised.exception))
+        finally:
+            context.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from tawnycalc.runner import Outcome
+from tawnycalc.store import ResultStore
+
+
+def results(P, T):
+    g = T > 600. + 10.*P
+    phases = "g bi mu q H2O" if g else "chl bi mu q H2O"
+    found = { "P":P, "T":T, "phases":phases, "failure":None, "modes":{ "bi":0.1, "q":0.3 },
+              "xyz":{ "x(bi)":0.5 + P/100. } }
+    if g:
+        found["modes"]["g"] = 0.001*(T - 600. - 10.*P)
+    return found
+
+
+class StoreTestSuite(unittest.TestCase):
+    """Recording to and querying a result store."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = ResultStore(os.path.join(self.directory, "results.db"))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def outcomes(self, count):
+        return [ Outcome(i, results(2., 580. + 10.*i), None) for i in range(count) ]
+
+    def test_record_batches(self):
+        recorded = self.store.record(self.outcomes(10), batch_size=4)
+        self.assertEqual([ outcome.index for outcome in recorded ], list(range(10)))
+        self.assertEqual(len(self.store), 10)
+
+    def test_record_early_close(self):
+        recorded = self.store.record(self.outcomes(10), batch_size=4)
+        next(recorded)
+        recorded.close()
+        self.assertEqual(len(self.store), 4)
+
+    def test_query(self):
+        points = [ (P, T) for P in (1., 2., 3.) for T in (580., 620., 660.) ]
+        self.store.add_many([ results(P, T) for P, T in points ] + [ ({ "failure":"timeout" }, { "setPwindow":"2 2" }) ])
+        self.assertEqual(len(self.store), 10)
+        self.assertEqual(self.store.count(), 9)
+        self.assertEqual(self.store.count(include_failed=True), 10)
+        self.assertEqual(self.store.count(P=2.), 3)
+        self.assertEqual(self.store.count(T=(600., None)), 6)
+        self.assertEqual(self.store.count(assemblage="H2O q mu bi g"), 4)
+        self.assertEqual(self.store.count(contains="chl"), 5)
+        found = self.store.query(modes={ "g":(0.02, None) }, columns=["mode(g)", "x(bi)", "assemblage"])
+        self.assertEqual(sorted(zip(found["P"], found["T"])), [(1., 660.), (2., 660.), (3., 660.)])
+        self.assertTrue(all(found["mode(g)"] >= 0.02))
+        self.assertEqual(list(found["x(bi)"]), [ 0.5 + P/100. for P in found["P"] ])
+        self.assertEqual(self.store.count(xyz={ "x(bi)":(0.515, None) }), 6)
+        self.assertEqual(list(self.store.assemblages().values()), [5, 4])
+
+        # new runs extend cached columns
+        self.store.add(results(4., 700.))
+        self.assertEqual(self.store.count(modes={ "g":(0.02, None) }), 4)
+
+    def test_query_uses_indexes(self):
+        self.store.add_many([ results(P, T) for P in (1., 2., 3.) for T in (580., 620., 660.) ])
+        def plan(**constraints):
+            statements = []
+            self.store._db.set_trace_callback(statements.append)
+            try:
+                found = self.store.query(**constraints)
+            finally:
+                self.store._db.set_trace_callback(None)
+            statement = [ sql for sql in statements if sql.startswith("SELECT id FROM runs") ][0]
+            return found, " ".join( row[-1] for row in self.store._db.execute("EXPLAIN QUERY PLAN " + statement) )
+
+        found, used = plan(P=(1.5, 2.5), contains=("g", "bi"), modes={ "g":(0.01, None) })
+        self.assertEqual(list(zip(found["P"], found["T"])), [(2., 660.)])
+        self.assertIn("SEARCH phases USING PRIMARY KEY (phase=?)", used)
+        self.assertIn("USING COVERING INDEX modes_phase (phase=?)", used)
+        # filter columns are neither loaded nor cached
+        self.assertEqual(list(self.store._run_columns), ["P", "T"])
+        self.assertEqual(list(self.store._child_columns), [])
+        found, used = plan(P=(1.5, 2.5))
+        self.assertEqual(list(found["T"]), [580., 620., 660.])
+        self.assertIn("USING INDEX runs_P", used)
+        found, used = plan(assemblage="chl bi mu q H2O", xyz={ "x(bi)":0.51 })
+        self.assertEqual(list(zip(found["P"], found["T"])), [(1., 580.)])
+        self.assertIn("USING INDEX runs_assemblage", used)
+
+    def test_keep_results(self):
+        from tawnycalc import Results
+        store = ResultStore(os.path.join(self.directory, "complete.db"), keep_results=True)
+        try:
+            id = store.add(Results(results(2., 660.)))
+            self.assertEqual(store.results(id)["modes"]["g"], results(2., 660.)["modes"]["g"])
+        finally:
+            store.close()
+        with self.assertRaises(RuntimeError):
+            self.store.results(self.store.add(results(2., 660.)))
+
+
+if __name__ == '__main__':
+    unittest.main()
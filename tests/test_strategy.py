@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+import unittest
+
+from tawnycalc import strategy
+from tawnycalc.runner import Runner, pt_task
+
+from . import fakes
+
+
+class StrategyTestSuite(unittest.TestCase):
+    """Adaptive escalation against a fake thermocalc with a garnet-in boundary."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.context = fakes.context(self.directory)
+        self.context.script["dogmin"] = "yes"
+
+    def tearDown(self):
+        self.context.cleanup()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def run_points(self, points):
+        with Runner(self.context, workers=1, strategy=strategy.Adaptive()) as runner:
+            return [ outcome.results for outcome in runner.map([ pt_task(P, T) for P, T in points ]) ]
+
+    def assertStable(self, found):
+        for results in found:
+            stable = results["T"] > 600. + 10.*results["P"]
+            self.assertEqual(results["phases"].startswith("g"), stable, (results["P"], results["T"]))
+
+    def test_grid_order_is_never_metastable(self):
+        # the neighbouring chlorite assemblage converges metastably beyond the boundary
+        found = self.run_points([ (2., T) for T in range(560, 720, 5) ])
+        self.assertStable(found)
+
+    def test_coarse_to_fine(self):
+        points = [ (P, float(T)) for P in (1., 1.5, 2., 2.5, 3.) for T in range(560, 720, 5) ]
+        order = strategy.coarse_to_fine(points)
+        self.assertEqual(sorted(order), list(range(len(points))))
+        self.assertEqual(set(order[:4]), {0, 31, 128, 159})
+        found = self.run_points([ points[i] for i in order ])
+        self.assertStable(found)
+        paths = [ results["strategy"] for results in found ]
+        self.assertGreater(paths.count(strategy.TARGETED), len(points)//4)
+        self.assertIn(strategy.CONFIRMED, paths)
+
+    def test_bracketed(self):
+        self.assertTrue(strategy._bracketed([(-1., 0.), (1., 0.)]))
+        self.assertTrue(strategy._bracketed([(-1., -1.), (1., -1.), (0., 1.)]))
+        self.assertTrue(strategy._bracketed([(0., 0.)]))
+        self.assertFalse(strategy._bracketed([(-1., 0.), (-1., 1.), (-0.5, -1.)]))
+        self.assertFalse(strategy._bracketed([(1., 0.)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+import unittest
+
+from tawnycalc import sweep
+from tawnycalc.runner import Runner, pt_task
+
+from . import fakes
+
+
+class SweepTestSuite(unittest.TestCase):
+    """Incremental sweeps against a fake thermocalc."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.context = fakes.context(self.directory)
+        self.runner = Runner(self.context, workers=2)
+        self.tasks = [ pt_task(2., T) for T in (580., 620., 660.) ]
+
+    def tearDown(self):
+        self.runner.close()
+        self.context.cleanup()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def run_sweep(self, tasks=None, previous=None, **kwargs):
+        return sweep.run(self.context, tasks or self.tasks, previous=previous, runner=self.runner, **kwargs)
+
+    def test_recomputes_changed_points(self):
+        first = self.run_sweep()
+        self.assertEqual(first.recomputed, [0, 1, 2])
+        self.assertEqual(self.run_sweep(previous=first).recomputed, [])
+        tasks = list(self.tasks)
+        tasks[1] = pt_task(2., 640.)
+        second = self.run_sweep(tasks, previous=first)
+        self.assertEqual(second.recomputed, [1])
+        self.assertEqual(second.results[1]["T"], 640.)
+        self.assertEqual(second.results[2]["T"], 660.)
+
+    def test_execute_arguments_invalidate(self):
+        first = self.run_sweep(timeout=60.)
+        self.assertEqual(self.run_sweep(previous=first, timeout=60.).recomputed, [])
+        self.assertEqual(self.run_sweep(previous=first, timeout=30.).recomputed, [0, 1, 2])
+        self.assertEqual(self.run_sweep(previous=first, timeout=60., print_output=False).recomputed, [])
+
+    def test_unused_guesses_do_not_invalidate(self):
+        first = self.run_sweep()
+        self.context.script["xyzguess"]["x(st)"] = "0.7"
+        self.assertEqual(self.run_sweep(previous=first).recomputed, [])
+        self.context.script["xyzguess"]["x(g)"] = "0.7"
+        self.assertEqual(self.run_sweep(previous=first).recomputed, [0, 1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()